@@ -8,6 +8,7 @@ import numpy as np
 from classify_relationship import LengthClassifier
 from calculate_probabilities import calculate_probabilities
 from data_logging import write_log
+from founder_index import FounderIndex
 from util import first_missing_ancestor, all_related
 
 #TODO: Change this tuple, the last two values are not used.
@@ -40,7 +41,9 @@ class BayesDeanonymize:
         self.exclude_anchors = set()
         self.probability_logging = probability_logging
         self._genome_nodes_cache = list(member for member in population.members
-                                        if member.genome is not None)
+                                        if member.has_genome)
+        self._founder_index = None
+        self._founder_index_key = None
 
     def __remove_erroneous_labeled(self):
         print("Removing erroneous labeled nodes")
@@ -106,7 +109,7 @@ class BayesDeanonymize:
 
     def _compute_related(self):
         nodes = set(member for member in self._population.members
-                    if member.genome is not None)
+                    if member.has_genome)
         self._labeled_related = dict()
         length_classifier = self._length_classifier
         for labeled_node_id in length_classifier._labeled_nodes:
@@ -116,37 +119,81 @@ class BayesDeanonymize:
         if node_id in self._length_classifier._labeled_nodes:
             return
         self._length_classifier._labeled_nodes.append(node_id)
+        self.invalidate_anchor_index()
         if self._only_related:
             nodes = list(member for member in self._population.members
-                         if member.genome is not None)
+                         if member.has_genome)
             self._add_node_id_relatives(node_id, nodes)
 
     def remove_labeled_node_id(self, node_id):
         self._length_classifier._labeled_nodes.remove(node_id)
+        self.invalidate_anchor_index()
 
     def restrict_search(self, nodes):
         self._restrict_search_nodes = set(nodes)
 
+    def set_error_scenario(self, overlay, classifier):
+        """
+        Switch the suspected genealogy of the population to the given
+        SuspectedOverlay. The distributions of a classifier are keyed
+        on relationships in the suspected genealogy it was generated
+        from, so classifier must have been generated for overlay.
+        Genomes are shared between scenarios.
+        """
+        self._population.apply_overlay(overlay)
+        self._length_classifier = classifier
+        self.invalidate_anchor_index()
+        if self._only_related:
+            self._compute_related()
+
+    def invalidate_anchor_index(self):
+        """
+        Drop the cached index of anchor genomes. Call this after
+        changing the genomes of anchors without the node generator
+        knowing, eg. by mutating a genome in place.
+        """
+        self._founder_index = None
+        self._founder_index_key = None
+
+    def _anchor_index(self, anchor_ids):
+        """
+        Returns a FounderIndex over the suspected genomes of the sorted
+        anchor_ids. The index is reused until the anchors, the genome
+        stores of the population or any genome in them change, so
+        genome stores that decode a new object on every access don't
+        rebuild it.
+        """
+        node_generator = self._population.node_generator
+        stores = (node_generator._genomes, node_generator._suspected_genomes)
+        version = node_generator.genome_version
+        key = self._founder_index_key
+        index = self._founder_index
+        if (index is None or key[:2] != (anchor_ids, version)
+            or any(a is not b for a, b in zip(key[2:], stores))):
+            id_map = self._population.id_mapping
+            def anchor_genome(anchor_i):
+                return id_map[anchor_ids[anchor_i]].suspected_genome
+            index = FounderIndex((id_map[anchor_id].suspected_genome
+                                  for anchor_id in anchor_ids),
+                                 anchor_genome)
+            self._founder_index = index
+            self._founder_index_key = (anchor_ids, version) + stores
+        return index
+
     def identify(self, genome, actual_node, segment_detector):
-        id_map = self._population.id_mapping
         length_classifier = self._length_classifier
         # TODO: Eliminated shared_list and use shared_dict everywhere
-        shared_list = []
         anchors = set(length_classifier._labeled_nodes) - self.exclude_anchors
         sorted_labeled = sorted(anchors)
         np_sorted_labeled = np.array(sorted_labeled, dtype = np.uint32)
-        sorted_shared = []
-        for labeled_node_id in sorted_labeled:
-            labeled_node = id_map[labeled_node_id]
-            s = segment_detector.shared_segment_length(genome,
-                                                       labeled_node.suspected_genome)
-            shared_list.append((labeled_node_id, s))
-            sorted_shared.append(s)
-
-        write_log("positive ibd count", sum(0.0 < x for x in sorted_shared))
+        anchor_index = self._anchor_index(tuple(sorted_labeled))
+        sorted_shared = segment_detector.shared_segment_lengths(genome,
+                                                                anchor_index)
+        shared_list = list(zip(sorted_labeled, sorted_shared.tolist()))
+
+        write_log("positive ibd count", int(np.count_nonzero(sorted_shared > 0.0)))
         #write_log("shared", sorted_shared)
         shared_dict = dict(shared_list)
-        sorted_shared = np.array(sorted_shared, dtype = np.float64)
 
         labeled_nodes_cryptic, all_lengths = list(zip(*shared_dict.items()))
         np_cryptic = np.log(length_classifier.get_batch_smoothing_gamma(sorted_shared))
@@ -255,15 +302,18 @@ def _get_logging_cryptic_lengths(shared_dict, cryptic_nodes, unique_lengths):
     store_counts[i] = counts
     return store_counts
 
+def _sibling_group(node, suspected):
+    generator = node.node_generator
+    sibling_ids = generator.pedigree.sibling_ids(node._id, suspected)
+    if sibling_ids is None:
+        return set([node])
+    return set(map(generator.node, sibling_ids.tolist()))
+
 def get_sibling_group(node):
     """
     Returns the set containing node and all its full siblings
     """
-    if node.mother is None or node.father is None:
-        return set([node])
-    return set(node.mother.children).intersection(node.father.children)
+    return _sibling_group(node, False)
 
 def get_suspected_sibling_group(node):
-    if node.suspected_mother is None or node.suspected_father is None:
-        return set([node])
-    return set(node.suspected_mother.suspected_children).intersection(node.suspected_father.suspected_children)
+    return _sibling_group(node, True)
@@ -1,5 +1,5 @@
 from collections import namedtuple, defaultdict
-from itertools import chain, product, combinations
+from itertools import chain, product
 from os import listdir, makedirs
 from os.path import join, exists, abspath, dirname
 from shutil import rmtree
@@ -17,9 +17,14 @@ from population_statistics import all_ancestors_of
 from gamma import fit_hurdle_gamma, fit_hurdle_gamma_vector
 from cm import centimorgan_data_from_directory
 from shared_segment_detector import SharedSegmentDetector
+from pairwise_ibd import pairwise_ibd
 from read_binary_simulation import BinarySimulationDeserializer
+from simulation import simulate
 
 ZERO_REPLACE = 1e-12
+# Name of the simulation file written by generate_classifier in its
+# directory.
+SIMULATION_FILENAME = "simulation"
 
 GammaParams = namedtuple("GammaParams", ["shape", "scale"])
 HurdleGammaParams = namedtuple("HurdleGammaParams", ["shape", "scale", "zero_prob"])
@@ -156,7 +161,14 @@ def related_pairs(unlabeled_nodes, labeled_nodes, population, generations):
 def generate_classifier(population, labeled_nodes, genome_generator,
                         recombinators, directory, clobber = True,
                         iterations = 1000, generations_back_shared = 7,
-                        min_segment_length = 0, non_paternity = 0.0):    
+                        min_segment_length = 0, non_paternity = 0.0,
+                        processes = 1, seed = None):
+    """
+    Simulate the IBD between labeled nodes and their relatives in the
+    last 3 generations iterations times, then fit a classifier to the
+    simulated distributions. Without clobber, a simulation in directory
+    is resumed.
+    """
     if not exists(directory):
         makedirs(directory)
     elif clobber:
@@ -167,26 +179,41 @@ def generate_classifier(population, labeled_nodes, genome_generator,
     to_clear = population.generations[clear_index].members
     for node in to_clear:
         node.suspected_mother = None
-        node.suspected_mother_id = None
         node.suspected_father = None
-        node.suspected_father_id = None
+    simulation_file = join(directory, SIMULATION_FILENAME)
     if 0 < iterations:
-        exit("Python implementation no longer supports simulation")
+        unlabeled_nodes = set(chain.from_iterable(generation.members
+                                                  for generation
+                                                  in population.generations[-3:]))
+        pairs = related_pairs(unlabeled_nodes, labeled_nodes, population,
+                              generations_back_shared)
+        recomb_dir = abspath(join(dirname(__file__),
+                                  "../data/recombination_rates/"))
+        cm_data = centimorgan_data_from_directory(recomb_dir)
+        ibd_detector = SharedSegmentDetector(cm_data, min_segment_length)
+        print("Simulating {} related pairs.".format(len(pairs)))
+        simulate(population, pairs, genome_generator, recombinators,
+                 ibd_detector, simulation_file, iterations, processes, seed)
 
+    if exists(simulation_file):
+        print("Generating classifiers.")
+        return classifier_from_file(simulation_file, population.id_mapping,
+                                    processes)
 
-    
     print("Generating classifiers.")
-    classifier = classifier_from_directory(directory, population.id_mapping)
+    classifier = classifier_from_directory(directory, population.id_mapping,
+                                           processes)
 
     print("Calculating cryptic parameters")
     cryptic_params = cryptic_parameters(population.id_mapping,
                                         classifier._labeled_nodes,
-                                        set(classifier._distributions.keys()))
+                                        set(classifier._distributions.keys()),
+                                        processes)
     classifier._cryptic_distribution = cryptic_params
 
     return classifier
 
-def cryptic_parameters(id_map, labeled_nodes, related_pairs):
+def cryptic_parameters(id_map, labeled_nodes, related_pairs, processes = 1):
 
     # TODO: Add argument for this
     recomb_dir = abspath(join(dirname(__file__),
@@ -203,18 +230,17 @@ def cryptic_parameters(id_map, labeled_nodes, related_pairs):
     shuffle(labeled_copy)
     setstate(rand_state)
     
-    labeled_node_pairs = set(combinations(labeled_copy[:1000], 2))
+    anchors = labeled_copy[:1000]
     related_pairs = set(related_pairs)
-    cryptic_pairs = set(x for x in labeled_node_pairs if x not in related_pairs)
-    lengths = []
-    for node_a_id, node_b_id in cryptic_pairs:
-        node_a = id_map[node_a_id]
-        node_b = id_map[node_b_id]
-        genome_a = node_a.genome
-        genome_b = node_b.genome
-        length = ibd_detector.shared_segment_length(genome_a, genome_b)
-        lengths.append(length)
-    np_lengths = np.array(lengths, dtype = np.float64)
+    # IBD of all anchor pairs is computed at once by the tiled engine,
+    # which skips pairs without a common founder.
+    lengths = pairwise_ibd(ibd_detector,
+                           [id_map[anchor] for anchor in anchors],
+                           processes = processes)
+    rows, columns = np.triu_indices(len(anchors), k = 1)
+    cryptic = [(anchors[i], anchors[j]) not in related_pairs
+               for i, j in zip(rows.tolist(), columns.tolist())]
+    np_lengths = lengths[rows, columns][np.array(cryptic, dtype = bool)]
     params = fit_hurdle_gamma(np_lengths)
     assert all(x is not None for x in params)
     return params
@@ -229,7 +255,7 @@ def adjust_shape_scale(shape, scale):
 
 # TODO: Factor out the common code from this function and
 # classifier_from_directory
-def classifier_from_file(filename, id_mapping):
+def classifier_from_file(filename, id_mapping, processes = 1):
     deserializer = BinarySimulationDeserializer(filename)
     distributions = dict()
     labeled_nodes = deserializer.anchors
@@ -251,17 +277,17 @@ def classifier_from_file(filename, id_mapping):
     hybrid_distributions = transform_distributions(distributions)
     del distributions
     cryptic_params = cryptic_parameters(id_mapping, labeled_nodes,
-                                        related_pairs)
+                                        related_pairs, processes)
     return LengthClassifier(hybrid_distributions, labeled_nodes, cryptic_params)
 
-def classifier_from_directory(directory, id_mapping):
+def classifier_from_directory(directory, id_mapping, processes = 1):
     distributions = distributions_from_directory(directory, id_mapping)
     related_pairs = set(distributions.keys())
     hybrid_distributions = transform_distributions(distributions)
     del distributions
     labeled_nodes = set(int(filename) for filename in listdir(directory))
     cryptic_params = cryptic_parameters(id_mapping, labeled_nodes,
-                                        related_pairs)
+                                        related_pairs, processes)
     return LengthClassifier(hybrid_distributions, labeled_nodes, cryptic_params)
 
 def distributions_from_directory(directory, id_mapping):
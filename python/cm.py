@@ -3,35 +3,33 @@ from collections import namedtuple
 import numpy as np
 import pdb
 
-from recomb_genome import hapmap_filenames, CHROMOSOME_ORDER, _read_recombination_file
+from recomb_genome import CHROMOSOME_ORDER, read_recombination_maps
 
 CentimorganData = namedtuple("CentimorganData", ["bases", "cm", "rates"])
 
 def centimorgan_data_from_directory(directory):
     """
     Given a directory with hapmap data, returns CentimorganData for data.
-    TODO: Some of this functionality is redundant with functionality in
-    recomb_genome. A refactor at some point should clean this up.
+    The hapmap files are read through the cache used by
+    recombinators_from_directory.
     """
-    file_names = hapmap_filenames(directory)
+    chrom_data = read_recombination_maps(directory)
     bp = []
     cm = []
     rates = []
     bp_accum = 0
     cm_accum = 0
     for chrom in CHROMOSOME_ORDER:
-        filename = file_names[chrom]
-        data = _read_recombination_file(filename)
-        for loci, rate, cumulative_cm in data:
-            bp.append(loci + bp_accum)
-            cm.append(cumulative_cm + cm_accum)
-            rates.append(rate / 1000000)
-        bp_accum += data[-1][0]
-        cm_accum += data[-1][2]
+        data = chrom_data[chrom]
+        bp.append(data[:, 0] + bp_accum)
+        cm.append(data[:, 2] + cm_accum)
+        rates.append(data[:, 1] / 1000000)
+        bp_accum += int(data[-1, 0])
+        cm_accum += float(data[-1, 2])
 
-    np_bases = np.array(bp, dtype = np.uint32)
-    np_cm = np.array(cm)
-    np_rates = np.array(rates)
+    np_bases = np.concatenate(bp).astype(np.uint32)
+    np_cm = np.concatenate(cm)
+    np_rates = np.concatenate(rates)
     return CentimorganData(np_bases, np_cm, np_rates)
         
         
@@ -9,6 +9,9 @@ from collections import defaultdict
 cimport numpy as np
 cimport cython
 
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memmove
+
 cpdef common_segment_ibd(genome_a, genome_b, segment_filter):
     """
     Given two genomes returns a list of integers for each autosome,
@@ -293,6 +296,391 @@ cpdef common_homolog_segments_by_founder(homolog_a, homolog_b):
     return shared_segments
 
 
+# Growable array of (start, stop) segments used by the fused IBD
+# kernel in place of lists of tuples.
+cdef struct Segments:
+    np.uint32_t *starts
+    np.uint32_t *stops
+    Py_ssize_t size
+    Py_ssize_t capacity
+
+cdef int _reserve(Segments *segments, Py_ssize_t capacity) except -1:
+    cdef np.uint32_t *starts
+    cdef np.uint32_t *stops
+    if capacity <= segments.capacity:
+        return 0
+    capacity = max(capacity, 2 * segments.capacity)
+    starts = <np.uint32_t *> realloc(segments.starts,
+                                     capacity * sizeof(np.uint32_t))
+    if starts == NULL:
+        raise MemoryError()
+    segments.starts = starts
+    stops = <np.uint32_t *> realloc(segments.stops,
+                                    capacity * sizeof(np.uint32_t))
+    if stops == NULL:
+        raise MemoryError()
+    segments.stops = stops
+    segments.capacity = capacity
+    return 0
+
+cdef void _free(Segments *segments):
+    free(segments.starts)
+    free(segments.stops)
+    segments.starts = NULL
+    segments.stops = NULL
+    segments.size = 0
+    segments.capacity = 0
+
+cdef class _GenomeView:
+    """
+    Contiguous uint32 views of the haplotype arrays of a genome.
+    """
+    cdef const np.uint32_t[::1] mother_starts
+    cdef const np.uint32_t[::1] mother_founder
+    cdef const np.uint32_t[::1] father_starts
+    cdef const np.uint32_t[::1] father_founder
+    cdef np.uint32_t end
+
+    def __init__(self, genome):
+        mother = genome.mother
+        father = genome.father
+        try:
+            self.mother_starts = mother.starts
+            self.mother_founder = mother.founder
+            self.father_starts = father.starts
+            self.father_founder = father.founder
+        except (ValueError, TypeError):
+            # Not contiguous uint32 arrays, eg. lists.
+            self.mother_starts = np.ascontiguousarray(mother.starts,
+                                                      dtype = np.uint32)
+            self.mother_founder = np.ascontiguousarray(mother.founder,
+                                                       dtype = np.uint32)
+            self.father_starts = np.ascontiguousarray(father.starts,
+                                                      dtype = np.uint32)
+            self.father_founder = np.ascontiguousarray(father.founder,
+                                                       dtype = np.uint32)
+        self.end = mother.end
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _homolog_segments(const np.uint32_t[::1] starts_a,
+                           const np.uint32_t[::1] founder_a,
+                           const np.uint32_t[::1] starts_b,
+                           const np.uint32_t[::1] founder_b,
+                           np.uint32_t end, Segments *out) except -1:
+    """
+    Native common_homolog_segments, writing the consolidated segments
+    to out.
+    """
+    cdef Py_ssize_t len_a = starts_a.shape[0]
+    cdef Py_ssize_t len_b = starts_b.shape[0]
+    cdef Py_ssize_t index_a = 0, index_b = 0
+    cdef np.uint32_t a_start, a_stop, b_start, b_stop, start, stop
+    out.size = 0
+    _reserve(out, len_a + len_b)
+    while index_a < len_a and index_b < len_b:
+        a_start = starts_a[index_a]
+        if index_a + 1 < len_a:
+            a_stop = starts_a[index_a + 1]
+        else:
+            a_stop = end
+        b_start = starts_b[index_b]
+        if index_b + 1 < len_b:
+            b_stop = starts_b[index_b + 1]
+        else:
+            b_stop = end
+        if founder_a[index_a] == founder_b[index_b]:
+            start = a_start if a_start > b_start else b_start
+            stop = a_stop if a_stop < b_stop else b_stop
+            if out.size > 0 and out.stops[out.size - 1] == start:
+                out.stops[out.size - 1] = stop
+            else:
+                out.starts[out.size] = start
+                out.stops[out.size] = stop
+                out.size += 1
+        if a_stop == b_stop:
+            index_a += 1
+            index_b += 1
+        elif a_stop > b_stop:
+            index_b += 1
+        else:
+            index_a += 1
+    return 0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _merge_overlaps(Segments *a, Segments *b, Segments *out) except -1:
+    """
+    Native merge_overlaps of the sorted segments a and b.
+    """
+    cdef Py_ssize_t i = 0, j = 0
+    cdef np.uint32_t start, stop
+    cdef bint take_a
+    out.size = 0
+    _reserve(out, a.size + b.size)
+    while i < a.size or j < b.size:
+        if j == b.size:
+            take_a = True
+        elif i == a.size:
+            take_a = False
+        else:
+            take_a = (a.starts[i] < b.starts[j]
+                      or (a.starts[i] == b.starts[j]
+                          and a.stops[i] <= b.stops[j]))
+        if take_a:
+            start = a.starts[i]
+            stop = a.stops[i]
+            i += 1
+        else:
+            start = b.starts[j]
+            stop = b.stops[j]
+            j += 1
+        if out.size > 0 and start <= out.stops[out.size - 1]:
+            if out.stops[out.size - 1] < stop:
+                out.stops[out.size - 1] = stop
+        else:
+            out.starts[out.size] = start
+            out.stops[out.size] = stop
+            out.size += 1
+    return 0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _subtract_region(Segments *a, np.uint32_t region_start,
+                          np.uint32_t region_stop) except -1:
+    """
+    Native subtract_region on the sorted segments a.
+    """
+    cdef Py_ssize_t start_i = 0
+    cdef Py_ssize_t stop_i = a.size - 1
+    cdef np.uint32_t pieces_start[2]
+    cdef np.uint32_t pieces_stop[2]
+    cdef Py_ssize_t num_pieces = 0, removed, k
+    while start_i < a.size and a.stops[start_i] <= region_start:
+        start_i += 1
+    while 0 <= stop_i and region_stop <= a.starts[stop_i]:
+        stop_i -= 1
+    if stop_i < start_i:
+        return 0
+    if a.starts[start_i] < region_start:
+        pieces_start[num_pieces] = a.starts[start_i]
+        pieces_stop[num_pieces] = region_start
+        num_pieces += 1
+    if region_stop < a.stops[stop_i]:
+        pieces_start[num_pieces] = region_stop
+        pieces_stop[num_pieces] = a.stops[stop_i]
+        num_pieces += 1
+    removed = stop_i - start_i + 1
+    _reserve(a, a.size - removed + num_pieces)
+    # Move the segments after the region to follow the pieces.
+    memmove(a.starts + start_i + num_pieces, a.starts + stop_i + 1,
+            (a.size - stop_i - 1) * sizeof(np.uint32_t))
+    memmove(a.stops + start_i + num_pieces, a.stops + stop_i + 1,
+            (a.size - stop_i - 1) * sizeof(np.uint32_t))
+    for k in range(num_pieces):
+        a.starts[start_i + k] = pieces_start[k]
+        a.stops[start_i + k] = pieces_stop[k]
+    a.size += num_pieces - removed
+    return 0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef unsigned long _size_of_overlap(Segments *a, np.uint32_t region_start,
+                                    np.uint32_t region_stop):
+    cdef unsigned long overlap = 0
+    cdef np.uint32_t start, stop
+    cdef Py_ssize_t i
+    for i in range(a.size):
+        start = a.starts[i] if a.starts[i] > region_start else region_start
+        stop = a.stops[i] if a.stops[i] < region_stop else region_stop
+        if start < stop:
+            overlap += stop - start
+    return overlap
+
+cdef class SegmentFilter:
+    """
+    Segment filter for common_segment_ibd that keeps segments of at
+    least minimum_base_length bases and minimum_cm_length
+    centimorgans. Centimorgan positions are interpolated from the
+    columns of recomb_data (CentimorganData) as cm.cumulative_cm does,
+    without allocating arrays.
+
+    shared_segment_length and shared_segment_lengths run a fused
+    native version of common_segment_ibd with this filter followed by
+    summing centimorgans, on scratch arrays of segments rather than
+    lists of tuples.
+    """
+    cdef readonly object recomb_data
+    cdef readonly unsigned long minimum_base_length
+    cdef readonly double minimum_cm_length
+    cdef const np.uint32_t[::1] bases
+    cdef const double[::1] cm
+    cdef const double[::1] rates
+    # Scratch segments: IBD of the two homologs of genome_a with one
+    # homolog of genome_b, the merged IBD of each homolog of genome_b,
+    # and the inbred regions of both genomes.
+    cdef Segments first
+    cdef Segments second
+    cdef Segments b_mother
+    cdef Segments b_father
+    cdef Segments b_inbreed
+    cdef Segments a_inbreed
+
+    def __init__(self, recomb_data, unsigned long minimum_base_length,
+                 double minimum_cm_length):
+        self.recomb_data = recomb_data
+        self.minimum_base_length = minimum_base_length
+        self.minimum_cm_length = minimum_cm_length
+        self.bases = np.ascontiguousarray(recomb_data.bases, dtype = np.uint32)
+        self.cm = np.ascontiguousarray(recomb_data.cm, dtype = np.float64)
+        self.rates = np.ascontiguousarray(recomb_data.rates,
+                                          dtype = np.float64)
+
+    def __dealloc__(self):
+        _free(&self.first)
+        _free(&self.second)
+        _free(&self.b_mother)
+        _free(&self.b_father)
+        _free(&self.b_inbreed)
+        _free(&self.a_inbreed)
+
+    def __reduce__(self):
+        return (SegmentFilter, (self.recomb_data, self.minimum_base_length,
+                                self.minimum_cm_length))
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double cumulative_cm(self, unsigned long location) except -1:
+        cdef Py_ssize_t low = 0
+        cdef Py_ssize_t high = self.bases.shape[0]
+        cdef Py_ssize_t middle
+        # Index of the first base >= location, as with searchsorted.
+        while low < high:
+            middle = (low + high) // 2
+            if self.bases[middle] < location:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.bases.shape[0]:
+            raise ValueError("Location {} is past the end of the recombination data.".format(location))
+        if low == 0:
+            return self.cm[0]
+        return (self.cm[low]
+                - <double> (self.bases[low] - location) * self.rates[low - 1])
+
+    cdef double cm_length(self, unsigned long start,
+                          unsigned long stop) except -1:
+        return self.cumulative_cm(stop) - self.cumulative_cm(start)
+
+    cdef bint keep(self, np.uint32_t start, np.uint32_t stop) except -1:
+        if stop - start < self.minimum_base_length:
+            return False
+        return (self.minimum_cm_length <= 0.0
+                or self.cm_length(start, stop) >= self.minimum_cm_length)
+
+    cdef list apply(self, list segments):
+        cdef unsigned long start, stop
+        cdef list kept = []
+        for start, stop in segments:
+            if self.keep(start, stop):
+                kept.append((start, stop))
+        return kept
+
+    def __call__(self, list segments):
+        return self.apply(segments)
+
+    cpdef double total_cm(self, list segments) except -1:
+        """
+        Sum of the centimorgan lengths of segments.
+        """
+        cdef unsigned long start, stop
+        cdef double total = 0.0
+        for start, stop in segments:
+            total += self.cm_length(start, stop)
+        return total
+
+    cdef int filter_segments(self, Segments *segments) except -1:
+        cdef Py_ssize_t i, kept = 0
+        for i in range(segments.size):
+            if self.keep(segments.starts[i], segments.stops[i]):
+                segments.starts[kept] = segments.starts[i]
+                segments.stops[kept] = segments.stops[i]
+                kept += 1
+        segments.size = kept
+        return 0
+
+    cdef int homolog_ibd(self, _GenomeView a, const np.uint32_t[::1] starts_b,
+                         const np.uint32_t[::1] founder_b,
+                         Segments *out) except -1:
+        # Filtered IBD of both homologs of a with one homolog of b,
+        # with overlaps from inbreeding in a merged.
+        _homolog_segments(a.mother_starts, a.mother_founder, starts_b,
+                          founder_b, a.end, &self.first)
+        self.filter_segments(&self.first)
+        _homolog_segments(a.father_starts, a.father_founder, starts_b,
+                          founder_b, a.end, &self.second)
+        self.filter_segments(&self.second)
+        _merge_overlaps(&self.first, &self.second, out)
+        return 0
+
+    cdef double segments_cm(self, Segments *segments) except -1:
+        cdef double total = 0.0
+        cdef Py_ssize_t i
+        for i in range(segments.size):
+            total += self.cm_length(segments.starts[i], segments.stops[i])
+        return total
+
+    cdef double fused_ibd(self, _GenomeView a, _GenomeView b) except -1:
+        """
+        Centimorgans of common_segment_ibd(a, b, self), without
+        building lists.
+        """
+        cdef Py_ssize_t i
+        cdef np.uint32_t start, stop
+        cdef unsigned long mother_overlap, father_overlap
+        self.homolog_ibd(a, b.mother_starts, b.mother_founder, &self.b_mother)
+        self.homolog_ibd(a, b.father_starts, b.father_founder, &self.b_father)
+        _homolog_segments(b.mother_starts, b.mother_founder, b.father_starts,
+                          b.father_founder, b.end, &self.b_inbreed)
+        if self.b_inbreed.size > 0:
+            _homolog_segments(a.mother_starts, a.mother_founder,
+                              a.father_starts, a.father_founder, a.end,
+                              &self.a_inbreed)
+            for i in range(self.a_inbreed.size):
+                _subtract_region(&self.b_inbreed, self.a_inbreed.starts[i],
+                                 self.a_inbreed.stops[i])
+            for i in range(self.b_inbreed.size):
+                start = self.b_inbreed.starts[i]
+                stop = self.b_inbreed.stops[i]
+                mother_overlap = _size_of_overlap(&self.b_mother, start, stop)
+                father_overlap = _size_of_overlap(&self.b_father, start, stop)
+                if mother_overlap == 0 or father_overlap == 0:
+                    continue
+                if mother_overlap < father_overlap:
+                    _subtract_region(&self.b_mother, start, stop)
+                else:
+                    _subtract_region(&self.b_father, start, stop)
+        return self.segments_cm(&self.b_mother) + self.segments_cm(&self.b_father)
+
+    def shared_segment_length(self, genome_a, genome_b):
+        """
+        Centimorgans genome_a and genome_b share IBD.
+        """
+        return self.fused_ibd(_GenomeView(genome_a), _GenomeView(genome_b))
+
+    def shared_segment_lengths(self, genome, genomes):
+        """
+        Returns a float64 array with the centimorgans genome shares
+        IBD with each genome in genomes.
+        """
+        cdef Py_ssize_t i
+        cdef _GenomeView view = _GenomeView(genome)
+        cdef np.ndarray[np.float64_t, ndim=1] shared = \
+            np.empty(len(genomes), dtype = np.float64)
+        for i, other in enumerate(genomes):
+            shared[i] = self.fused_ibd(view, _GenomeView(other))
+        return shared
+
 cpdef list lengths(list segments):
     """
     Takes a list of segments and returns a list of lengths.
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from os.path import exists
+from sys import exit
+
+from population_file import (convert_pickle, is_population_file,
+                             load_population, save_population)
+
+parser = ArgumentParser(description = "Convert a pickled population to the binary population file format.")
+parser.add_argument("pickle_file", help = "Pickled file with population, or a binary population file to rewrite.")
+parser.add_argument("output_file",
+                    help = "Binary population file to write.")
+parser.add_argument("--compress-genomes", action = "store_true",
+                    default = False,
+                    help = "Store genomes compressed in the output file.")
+args = parser.parse_args()
+
+if exists(args.output_file):
+    print("Output file already exists.")
+    exit(1)
+
+print("Converting {} to {}".format(args.pickle_file, args.output_file))
+if is_population_file(args.pickle_file):
+    save_population(load_population(args.pickle_file), args.output_file,
+                    args.compress_genomes)
+else:
+    convert_pickle(args.pickle_file, args.output_file, args.compress_genomes)
@@ -8,8 +8,8 @@ from os.path import exists, realpath, split, join
 from evaluation import Evaluation
 from shared_segment_detector import SharedSegmentDetector
 from expansion import ExpansionData
-from population import PopulationUnpickler, fix_twin_parents
-from population_genomes import generate_genomes
+from population_file import load_population, compress_genomes
+from population_genomes import generate_genomes, use_lazy_genomes
 from sex import Sex
 from recomb_genome import recombinators_from_directory, RecombGenomeGenerator
 from cm import centimorgan_data_from_directory
@@ -52,6 +52,12 @@ parser.add_argument("--expansion-pool", type = int,
                     help = "Number of individuals per round in expansion rounds..")
 parser.add_argument("--recombination_dir",
                     help = "Directory containing Hapmap and decode data. If this is specified, new genomes will be generated.")
+parser.add_argument("--processes", type = int, default = None,
+                    help = "Number of worker processes used to generate new genomes when --recombination_dir is given.")
+parser.add_argument("--genome-cache-mb", type = int, default = None,
+                    help = "With --recombination_dir, generate genomes on demand instead of up front, caching at most this many megabytes of genomes. Anchor genomes are always kept.")
+parser.add_argument("--compress-genomes", action = "store_true", default = False,
+                    help = "Keep genomes compressed in memory, decoding them as they are compared.")
 parser.add_argument("--disable-probability-logging", action = "store_true", default = False, help = "This option will disable the logging of individual probabilties to the log file. Much less disk space is used when this option is specified.")
 parser.add_argument("--out-of-genealogy", default = 0, type = int,
                     help = "All nodes to be identified will be erased from analyst view. This should result in always inferring the incorrect individual, as the analyst is restricted to guessing individuals in its genealogy.")
@@ -61,6 +67,15 @@ args = parser.parse_args()
 if args.test_node and args.test_node_file:
     parser.error("Cannot specify both test nodes and a test node file.")
 
+if args.genome_cache_mb is not None and not args.recombination_dir:
+    parser.error("--genome-cache-mb requires --recombination_dir.")
+
+if args.genome_cache_mb is not None and args.processes is not None:
+    parser.error("Genomes generated on demand can't use --processes.")
+
+if args.genome_cache_mb is not None and args.compress_genomes:
+    parser.error("Genomes generated on demand can't be compressed.")
+
 if args.anchor_node_file and args.subset_labeled:
     parser.error("Cannot specify both anchor nodes subset size and a anchor node file.")
 
@@ -85,9 +100,7 @@ write_log("args", args)
 
 
 print("Loading population.", flush = True)
-with open(args.population, "rb") as pickle_file:
-    population = PopulationUnpickler(pickle_file).load()
-fix_twin_parents(population)
+population = load_population(args.population)
 
 if args.recombination_dir:
     print("Generating new genomes for population.")
@@ -96,8 +109,22 @@ if args.recombination_dir:
     chrom_sizes = recombinators[Sex.Male]._num_bases
     genome_generator = RecombGenomeGenerator(chrom_sizes)
     population.clean_genomes()
-    print("Generating genomes")
-    generate_genomes(population, genome_generator, recombinators, 3)
+    if args.genome_cache_mb is not None:
+        lazy_genomes = use_lazy_genomes(population, genome_generator,
+                                        recombinators,
+                                        max_bytes = args.genome_cache_mb * 2 ** 20,
+                                        keep_last = 3)
+    else:
+        lazy_genomes = None
+        print("Generating genomes")
+        generate_genomes(population, genome_generator, recombinators, 3,
+                         processes = args.processes)
+else:
+    lazy_genomes = None
+
+if args.compress_genomes:
+    print("Compressing genomes")
+    compress_genomes(population)
 
 print("Loading classifier", flush = True)
 with open(args.classifier, "rb") as pickle_file:
@@ -162,6 +189,9 @@ evaluation = Evaluation(population, classifier, run_labeled,
 if args.disable_probability_logging:
     evaluation.probability_logging = False
 
+if lazy_genomes is not None:
+    lazy_genomes.pin(evaluation.labeled_nodes)
+
 if args.expansion_rounds_data and expansion_data is None:
     expansion_data = ExpansionData(evaluation.labeled_nodes)
 
@@ -169,7 +199,7 @@ write_log("labeled nodes", evaluation.labeled_nodes)
 
 id_mapping = population.id_mapping
 nodes = set(member for member in population.members
-             if member.genome is not None)
+             if member.has_genome)
 labeled_nodes = set(id_mapping[node_id] for node_id
                     in evaluation.labeled_nodes)
 if args.test_node is not None and len(args.test_node) > 0:
@@ -10,7 +10,7 @@ import pdb
 from scipy import stats
 
 from bayes_deanonymize import BayesDeanonymize
-from population import PopulationUnpickler
+from population_file import load_population
 
 parser = ArgumentParser(description = "Evaluate performance of classification.")
 parser.add_argument("population")
@@ -26,15 +26,14 @@ args = parser.parse_args()
 
 
 print("Loading population.")
-with open(args.population, "rb") as pickle_file:
-    population = PopulationUnpickler(pickle_file).load()
+population = load_population(args.population)
 
 print("Loading classifier")
 with open(args.classifier, "rb") as pickle_file:
     classifier = load(pickle_file)
 
 nodes = set(member for member in population.members
-             if member.genome is not None)
+             if member.has_genome)
 
 
 def evaluate(unlabeled, bayes):
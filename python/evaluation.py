@@ -82,6 +82,16 @@ class Evaluation:
         assert len(nodes) > 0
         self._bayes.restrict_search(nodes)
 
+    def set_error_scenario(self, overlay, classifier):
+        """
+        Evaluate against a different suspected genealogy, given as a
+        SuspectedOverlay from Population.error_scenario. classifier
+        must be generated for the same scenario, as the distributions
+        depend on the suspected genealogy.
+        """
+        self._classifier = classifier
+        self._bayes.set_error_scenario(overlay, classifier)
+
     def print_metrics(self):
         total = self.correct + self.incorrect
         print("{} correct, {} incorrect, {} total.".format(self.correct,
@@ -2,12 +2,12 @@ from argparse import ArgumentParser
 from random import sample
 from itertools import chain
 
-from population import PopulationUnpickler
+from population_file import load_population
 from classify_relationship import related_pairs
 from to_json import to_json
 
 parser = ArgumentParser(description = "Serialize a population for simulation in Rust. Anchor nodes and adversary horizon are picked before serialization")
-parser.add_argument("population_file", help = "Pickled file with population")
+parser.add_argument("population_file", help = "Population file (binary or pickled)")
 parser.add_argument("output", help = "Name of file for json output")
 parser.add_argument("--gen-back", "-g", type = int, default = 6,
                     help = "Ignore common ancestry more than the given number of generations back. This sets the analyst horizion.")
@@ -16,8 +16,7 @@ parser.add_argument("--num-anchor-nodes", "-n", type = int, default = 0,
 args = parser.parse_args()
 
 print("Loading population")
-with open(args.population_file, "rb") as pickle_file:
-    population = PopulationUnpickler(pickle_file).load()
+population = load_population(args.population_file)
 
 potentially_labeled = list(chain.from_iterable([generation.members
                                                 for generation
@@ -33,9 +32,7 @@ clear_index = max(num_generations - args.gen_back, 0)
 to_clear = population.generations[clear_index].members
 for node in to_clear:
     node.suspected_mother = None
-    node.suspected_mother_id = None
     node.suspected_father = None
-    node.suspected_father_id = None
 unlabeled_nodes = set(potentially_labeled)
 print("Computing related pairs.")
 related_nodes = related_pairs(unlabeled_nodes, labeled_nodes, population,
@@ -0,0 +1,91 @@
+"""
+Synthetic recombination maps, populations and detectors shared by the
+tests.
+"""
+import numpy as np
+
+from cm import CentimorganData
+from island_model import IslandNode, IslandModel
+from node import NodeGenerator
+from population import IslandPopulation
+from population_genomes import mate
+from recomb_genome import (Recombinator, RecombGenomeGenerator, MeiosisRandom,
+                           CHROMOSOME_ORDER)
+from sex import Sex
+
+class FounderDetector:
+    """
+    Stands in for SharedSegmentDetector, measuring the number of
+    founder haplotypes two genomes have in common.
+    """
+    def shared_segment_length(self, genome_a, genome_b):
+        founders_a = set(genome_a.mother.founder.tolist()
+                         + genome_a.father.founder.tolist())
+        founders_b = set(genome_b.mother.founder.tolist()
+                         + genome_b.father.founder.tolist())
+        return float(len(founders_a & founders_b))
+
+    def pair_shared_segment_lengths(self, genomes_a, genomes_b,
+                                    signatures_a = None, signatures_b = None):
+        return np.array([self.shared_segment_length(genome_a, genome_b)
+                         for genome_a, genome_b in zip(genomes_a, genomes_b)],
+                        dtype = np.float64)
+
+def uniform_recombinators():
+    """
+    Recombinators for both sexes where every chromosome is 10Mb long
+    with 50cM spread evenly over it.
+    """
+    data = {chrom: [(0, 5.0, 0.0), (5000000, 5.0, 25.0),
+                    (10000000, 5.0, 50.0)]
+            for chrom in CHROMOSOME_ORDER}
+    recombinator = Recombinator(data)
+    return {Sex.Male: recombinator, Sex.Female: recombinator}
+
+def uniform_cm_data():
+    """
+    Centimorgan map with points every megabase and 1cM per megabase.
+    """
+    bases = np.arange(0, 220000001, 1000000, dtype = np.uint32)
+    cm = np.arange(len(bases), dtype = np.float64)
+    rates = np.append(np.diff(cm) / 1000000, 0.0)
+    return CentimorganData(bases, cm, rates)
+
+def related_genomes():
+    """
+    Genomes of 6 unrelated founders, 4 siblings (children of the first
+    two founders), 3 cousins (children of a sibling and a founder) and
+    3 inbred children of two siblings, in that order.
+    """
+    recombinator = uniform_recombinators()[Sex.Male]
+    generator = RecombGenomeGenerator(recombinator._num_bases)
+    meiosis_random = MeiosisRandom(3)
+    def child(mother, father, node_id):
+        return mate(mother, father, recombinator, recombinator,
+                    meiosis_random, node_id)
+    founders = [generator.generate() for _ in range(6)]
+    siblings = [child(founders[0], founders[1], i) for i in range(10, 14)]
+    cousins = [child(siblings[0], founders[2], 20),
+               child(founders[3], siblings[1], 21),
+               child(siblings[2], founders[4], 22)]
+    inbred = [child(siblings[2], siblings[3], i) for i in range(30, 33)]
+    return founders + siblings + cousins + inbred
+
+def founder_population(seed, num_founders = 40, size = 600,
+                       num_generations = 2):
+    """
+    Population on a single island with num_founders founders of
+    alternating sex, followed by num_generations generations of size
+    nodes.
+    """
+    generator = NodeGenerator()
+    islands = [IslandNode(0.1)]
+    island_model = IslandModel(islands)
+    for i in range(num_founders):
+        sex = Sex.Male if i % 2 == 0 else Sex.Female
+        island_model.add_individual(islands[0],
+                                    generator.generate_node(sex = sex))
+    population = IslandPopulation(island_model, seed = seed)
+    for _ in range(num_generations):
+        population.new_generation(generator, size = size)
+    return population
@@ -0,0 +1,166 @@
+"""
+Inverted index from founder ids to the haplotype segments of a set of
+genomes (eg. the anchors), used to skip IBD detection between genomes
+that can't share any segment.
+"""
+import numpy as np
+
+def _haplotype_segments(diploid):
+    """
+    Returns the (starts, stops, founder) arrays of the segments of a
+    haplotype.
+    """
+    starts = np.asarray(diploid.starts, dtype = np.uint32)
+    stops = np.empty_like(starts)
+    stops[:-1] = starts[1:]
+    stops[-1:] = diploid.end
+    return (starts, stops, np.asarray(diploid.founder, dtype = np.uint32))
+
+class FounderIndex:
+    """
+    Index over a list of genomes. Every segment of every haplotype is
+    a posting (genome, haplotype, start, stop) filed under its founder
+    id, and the postings of each founder are sorted by start.
+
+    Two haplotypes can only be IBD where they carry the same founder id
+    over overlapping intervals, so a query only looks at the postings
+    of the founders of the query genome that start close enough to
+    overlap its segments. The longest posting of each founder bounds
+    how far before a segment an overlapping posting can start.
+
+    The index doesn't keep the genomes themselves unless get_genome is
+    None. Otherwise get_genome(i) returns genome i when it is needed,
+    so genomes that are decoded on access (eg. compressed ones) aren't
+    held in memory by the index.
+    """
+    def __init__(self, genomes, get_genome = None):
+        starts = []
+        stops = []
+        founders = []
+        owners = []
+        haplotypes = []
+        kept = []
+        for genome_i, genome in enumerate(genomes):
+            if get_genome is None:
+                kept.append(genome)
+            for haplotype, diploid in enumerate((genome.mother,
+                                                 genome.father)):
+                haplotype_starts, haplotype_stops, founder = \
+                    _haplotype_segments(diploid)
+                starts.append(haplotype_starts)
+                stops.append(haplotype_stops)
+                founders.append(founder)
+                owners.append(np.full(len(founder), genome_i,
+                                      dtype = np.int32))
+                haplotypes.append(np.full(len(founder), haplotype,
+                                          dtype = np.uint8))
+        self._num_genomes = len(owners) // 2
+        if get_genome is None:
+            get_genome = kept.__getitem__
+        self._get_genome = get_genome
+        if len(owners) == 0:
+            starts = stops = founders = [np.empty(0, dtype = np.uint32)]
+            owners = [np.empty(0, dtype = np.int32)]
+            haplotypes = [np.empty(0, dtype = np.uint8)]
+        starts = np.concatenate(starts)
+        founders = np.concatenate(founders)
+        order = np.lexsort((starts, founders))
+        self._starts = starts[order]
+        self._stops = np.concatenate(stops)[order]
+        self._genome = np.concatenate(owners)[order]
+        self._haplotype = np.concatenate(haplotypes)[order]
+        self._founders, first = np.unique(founders[order],
+                                          return_index = True)
+        # Postings of founder self._founders[i] are the range
+        # self._offsets[i]:self._offsets[i + 1].
+        self._offsets = np.append(first, len(order)).astype(np.int64)
+        lengths = self._stops - self._starts
+        if len(lengths) > 0:
+            self._max_length = np.maximum.reduceat(lengths, first)
+        else:
+            self._max_length = np.empty(0, dtype = np.uint32)
+
+    def __len__(self):
+        return self._num_genomes
+
+    def genome(self, genome_i):
+        """
+        Returns genome genome_i of the index.
+        """
+        return self._get_genome(genome_i)
+
+    def _founder_range(self, founder):
+        founder_i = np.searchsorted(self._founders, founder)
+        if (founder_i == len(self._founders)
+            or self._founders[founder_i] != founder):
+            return (0, 0)
+        return (self._offsets[founder_i], self._offsets[founder_i + 1])
+
+    def postings(self, founder):
+        """
+        Returns the (genome, haplotype, start, stop) arrays of the
+        postings of founder.
+        """
+        low, high = self._founder_range(founder)
+        return (self._genome[low:high], self._haplotype[low:high],
+                self._starts[low:high], self._stops[low:high])
+
+    def _first_start(self, low, high, values):
+        """
+        For each range low[i]:high[i] of postings sorted by start,
+        returns the position of the first posting that starts at or
+        after values[i] (high[i] if there is none). The ranges are
+        bisected together.
+        """
+        low = low.copy()
+        high = high.copy()
+        last = max(len(self._starts) - 1, 0)
+        while True:
+            active = low < high
+            if not active.any():
+                return low
+            middle = (low + high) >> 1
+            middle_starts = self._starts[np.minimum(middle, last)]
+            before = active & (middle_starts < values)
+            low[before] = middle[before] + 1
+            after = active & ~before
+            high[after] = middle[after]
+
+    def candidates(self, genome):
+        """
+        Returns a sorted array with the indices of the genomes that
+        carry a founder id of genome over an interval overlapping
+        where genome carries it. All other genomes share no IBD with
+        genome.
+        """
+        if len(self._founders) == 0:
+            return np.empty(0, dtype = np.int64)
+        segments = [_haplotype_segments(diploid)
+                    for diploid in (genome.mother, genome.father)]
+        starts, stops, founders = (np.concatenate(column)
+                                   for column in zip(*segments))
+        founder_i = np.searchsorted(self._founders, founders)
+        founder_i[founder_i == len(self._founders)] = 0
+        known = self._founders[founder_i] == founders
+        founder_i = founder_i[known]
+        starts = starts[known].astype(np.int64)
+        stops = stops[known].astype(np.int64)
+        earliest = np.maximum(starts - self._max_length[founder_i] + 1, 0)
+        # Both ends of the postings starting in [earliest, stops) are
+        # searched in one pass.
+        first = self._offsets[founder_i]
+        last = self._offsets[founder_i + 1]
+        ends = self._first_start(np.concatenate((first, first)),
+                                 np.concatenate((last, last)),
+                                 np.concatenate((earliest, stops)))
+        low = ends[:len(first)]
+        high = ends[len(first):]
+        counts = high - low
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype = np.int64)
+        offsets = np.cumsum(counts) - counts
+        postings = (np.repeat(low - offsets, counts)
+                    + np.arange(total, dtype = np.int64))
+        overlapping = self._stops[postings] > np.repeat(starts, counts)
+        return np.unique(self._genome[postings[overlapping]]).astype(np.int64)
@@ -0,0 +1,54 @@
+"""
+Founder signatures of genomes. The signature of a genome is a bitmap
+of SIGNATURE_BITS bits with bit (founder id mod SIGNATURE_BITS) set
+for every founder id on either haplotype. Genomes whose signatures
+have no bit in common carry no common founder id and can't share any
+IBD, which is tested with one AND of the signatures. Genomes whose
+signatures intersect may still share nothing, as different founders
+can map to the same bit.
+"""
+import numpy as np
+
+SIGNATURE_BITS = 4096
+SIGNATURE_WORDS = SIGNATURE_BITS // 64
+
+def signatures_from_founders(founder, rows, num_rows):
+    """
+    Returns a (num_rows, SIGNATURE_WORDS) uint64 array with the
+    signature of each row, where founder[i] is a founder id of row
+    rows[i].
+    """
+    # Bits are set in place in the words, as a bitmap of SIGNATURE_BITS
+    # bytes per row would be 8 times the size of the signatures.
+    signatures = np.zeros((num_rows, SIGNATURE_WORDS), dtype = np.uint64)
+    bits = np.asarray(founder, dtype = np.uint64) % np.uint64(SIGNATURE_BITS)
+    words = (bits // np.uint64(64)).astype(np.intp)
+    np.bitwise_or.at(signatures, (np.asarray(rows), words),
+                     np.left_shift(np.uint64(1), bits % np.uint64(64)))
+    return signatures
+
+def founder_signatures(genomes):
+    """
+    Returns a (len(genomes), SIGNATURE_WORDS) uint64 array with the
+    signature of each genome.
+    """
+    genomes = list(genomes)
+    founders = []
+    rows = []
+    for row, genome in enumerate(genomes):
+        for diploid in (genome.mother, genome.father):
+            founders.append(diploid.founder)
+            rows.append(np.full(len(diploid.founder), row, dtype = np.intp))
+    if len(founders) == 0:
+        return np.zeros((0, SIGNATURE_WORDS), dtype = np.uint64)
+    return signatures_from_founders(np.concatenate(founders),
+                                    np.concatenate(rows), len(genomes))
+
+def share_founders(signatures_a, signatures_b):
+    """
+    True where the signatures (rows of the two arrays, broadcast
+    against each other) have a bit in common, ie. where the genomes
+    may share IBD.
+    """
+    return np.any(np.bitwise_and(signatures_a, signatures_b) != 0,
+                  axis = -1)
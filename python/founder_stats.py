@@ -3,7 +3,7 @@ from collections import defaultdict
 from json import dump
 
 from population_genomes import generate_genomes
-from population import PopulationUnpickler
+from population_file import load_population
 from sex import Sex
 from recomb_genome import recombinators_from_directory, RecombGenomeGenerator
 
@@ -44,7 +44,7 @@ def simulate_founder_stats(population, genome_generator, recombinators,
         dump(node_stats, output_json)
             
 parser = ArgumentParser(description = "Generate a classifier which can (hopefully) identify individuals in a population.")
-parser.add_argument("population_file", help = "Pickled file with population")
+parser.add_argument("population_file", help = "Population file (binary or pickled)")
 parser.add_argument("num_iterations", type = int, default = 1000,
                     help = "Number of samples to collect from empirical distributions")
 parser.add_argument("output")
@@ -54,8 +54,7 @@ parser.add_argument("--gen_back", "-g", type = int, default = 7,
 args = parser.parse_args()
 
 print("Loading population")
-with open(args.population_file, "rb") as pickle_file:
-    population = PopulationUnpickler(pickle_file).load()
+population = load_population(args.population_file)
 
 print("Loading recombination data.")
 recombinators = recombinators_from_directory("../data/recombination_rates/")
@@ -70,9 +69,7 @@ clear_index = num_generations - args.gen_back
 to_clear = population.generations[clear_index].members
 for node in to_clear:
     node.suspected_mother = None
-    node.suspected_mother_id = None
     node.suspected_father = None
-    node.suspected_father_id = None
 
 simulate_founder_stats(population, genome_generator, recombinators,
                        args.num_iterations, args.output)
@@ -1,14 +1,13 @@
 from argparse import ArgumentParser
-from itertools import combinations
 from os.path import realpath, split, join
 from pickle import load
 
 import numpy as np
-from progressbar import progressbar
 
 from shared_segment_detector import SharedSegmentDetector
+from pairwise_ibd import pairwise_ibd
 from gamma import fit_hurdle_gamma
-from population import PopulationUnpickler, fix_twin_parents
+from population_file import load_population
 from cm import centimorgan_data_from_directory
 
 parser = ArgumentParser(description = "Generate hurdle gamma params for a given population and classifier.")
@@ -17,44 +16,40 @@ parser.add_argument("classifier")
 parser.add_argument("--cm-ibd-threshold", type = float, default = 0.0,
                     help = "IBD segments smaller than length in cM will "
                     "go undetected")
+parser.add_argument("--processes", type = int, default = 1,
+                    help = "Number of worker processes computing IBD.")
 
 args = parser.parse_args()
 
 print("Loading population.", flush = True)
-with open(args.population, "rb") as pickle_file:
-    population = PopulationUnpickler(pickle_file).load()
-fix_twin_parents(population)
+population = load_population(args.population)
 
 print("Loading classifier", flush = True)
 with open(args.classifier, "rb") as pickle_file:
     classifier = load(pickle_file)
 
+cur_path = realpath(__file__)
+parent = split(split(cur_path)[0])[0]
+rates_dir = join(parent, "data", "recombination_rates")
+print("Loading recombination data.", flush = True)
+recomb_data = centimorgan_data_from_directory(rates_dir)
 if args.cm_ibd_threshold > 0:
-    cur_path = realpath(__file__)
-    parent = split(split(cur_path)[0])[0]
-    rates_dir = join(parent, "data", "recombination_rates")
-    print("Loading recombination data for centimorgan cutoff.", flush = True)
-    recomb_data = centimorgan_data_from_directory(rates_dir)
-    ibd_detector = SharedSegmentDetector(0, 5, recomb_data)
+    ibd_detector = SharedSegmentDetector(recomb_data, 0,
+                                         args.cm_ibd_threshold)
 else:
-    ibd_detector = SharedSegmentDetector(5000000)
+    ibd_detector = SharedSegmentDetector(recomb_data, 5000000)
 
-labeled_nodes = classifier._labeled_nodes
-labeled_node_pairs = set(combinations(labeled_nodes, 2))
+labeled_nodes = list(classifier._labeled_nodes)
 related_pairs = set(classifier._distributions.keys())
-cryptic_pairs = set(x for x in combinations(labeled_nodes, 2)
-                    if x not in related_pairs)
 
 print("Calculating IBD for pairs.")
-lengths = []
 id_map = population.id_mapping
-for node_a_id, node_b_id in progressbar(cryptic_pairs):
-    node_a = id_map[node_a_id]
-    node_b = id_map[node_b_id]
-    genome_a = node_a.genome
-    genome_b = node_b.genome
-    length = ibd_detector.shared_segment_length(genome_a, genome_b)
-    lengths.append(length)
-
-np_lengths = np.array(lengths, dtype = np.uint64)
+lengths = pairwise_ibd(ibd_detector, [id_map[node] for node in labeled_nodes],
+                       processes = args.processes)
+rows, columns = np.triu_indices(len(labeled_nodes), k = 1)
+cryptic = [(labeled_nodes[i], labeled_nodes[j]) not in related_pairs
+           for i, j in zip(rows.tolist(), columns.tolist())]
+cryptic_lengths = lengths[rows, columns][np.array(cryptic, dtype = bool)]
+
+np_lengths = np.array(cryptic_lengths, dtype = np.uint64)
 print(fit_hurdle_gamma(np_lengths))
@@ -1,17 +1,24 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
-from random import choice
+from atexit import register
+from random import seed
 from pickle import dump, HIGHEST_PROTOCOL
 from os.path import exists
 from sys import exit
 
+import numpy as np
+
 from population import IslandPopulation
-from population_genomes import generate_genomes
+from population_file import save_population, PopulationFileWriter
+from population_genomes import (generate_genomes, generate_generation_genomes,
+                                clear_generation_genomes, MatePool,
+                                use_genome_arena)
 from node import NodeGenerator
 from recomb_genome import recombinators_from_directory, RecombGenomeGenerator
-from island_model import islands_from_file
-from sex import Sex
+from island_model import IslandModel, islands_from_file
+from sex import Sex, SEXES
+from pedigree import NO_NODE
 
 def isclose(a, b, rel_tol=1e-09, abs_tol=0.0):
     return abs(a-b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
@@ -49,8 +56,18 @@ parser.add_argument("--avg-children", type = float, default = None,
                     help = "Average number of children per individual in each generation. Default results in constant sized generations.")
 
 
-parser.add_argument("--output_file", default = "population.pickle",
-                    help = "Outputs a pickle file containing a Population object to this file. This file will be clobbered if it exists.")
+parser.add_argument("--seed", type = int, default = None,
+                    help = "Seed for the random number generators, for reproducible populations.")
+parser.add_argument("--processes", type = int, default = None,
+                    help = "Generate the genomes of each generation in parallel with this many worker processes. Genomes only depend on the seed, not on the number of processes.")
+parser.add_argument("--output_file", default = "population.pop",
+                    help = "Outputs a binary population file to this file. This file will be clobbered if it exists.")
+parser.add_argument("--pickle", action = "store_true", default = False,
+                    help = "Write the population as a pickled Population object instead of a binary population file.")
+parser.add_argument("--compress-genomes", action = "store_true", default = False,
+                    help = "Store genomes compressed in the population file.")
+parser.add_argument("--stream", action = "store_true", default = False,
+                    help = "Write each generation to the output file as soon as it is generated, keeping only the previous generation in memory. Use this for populations too large to fit in memory.")
 
 args = parser.parse_args()
 if args.num_generations < 1:
@@ -62,38 +79,102 @@ if not 0 <= args.non_paternity <= 1:
 if not 0 <= args.adoption <= 1:
     parser.error("adoption rate must be in the range [0, 1]")
 
+if args.processes is not None and args.processes < 1:
+    parser.error("processes must be >= 1")
+
+if args.stream and args.pickle:
+    parser.error("Streaming generation writes a binary population file, it can't be used with --pickle.")
+
+if args.compress_genomes and (args.stream or args.pickle):
+    parser.error("--compress-genomes can't be used with --stream or --pickle. Use convert_population.py to compress genomes afterwards.")
+
 if args.avg_children is not None:
     sizes = generation_sizes(args.generation_size, args.avg_children,
                              args.num_generations)
 else:
     sizes = [args.generation_size for _ in range(args.num_generations)]
 
-node_generator = NodeGenerator()
+if args.seed is not None:
+    seed(args.seed)
+    np.random.seed(args.seed)
+
+# Genomes are only saved for this many of the most recent generations.
+keep_genomes = 3
+
+if args.stream:
+    if exists(args.output_file):
+        print("Output file already exists.")
+        exit(1)
+    writer = PopulationFileWriter(args.output_file, sum(sizes),
+                                  islands_from_file(args.island_file).islands)
+    # Don't leave a partial file behind if generation fails.
+    register(writer.discard)
+    node_generator = writer.node_generator
+    island_model = writer.island_model
+else:
+    node_generator = NodeGenerator()
+    island_model = IslandModel(islands_from_file(args.island_file).islands,
+                               node_generator)
+
 print("Generating founders")
-founders = [node_generator.generate_node() for _ in range(sizes[0])]
+# Founders have random sexes and are placed on random islands.
+no_parents = np.full(sizes[0], NO_NODE)
+founder_ids = node_generator.pedigree.add_many(no_parents, no_parents,
+                                               sex = np.random.randint(len(SEXES), size = sizes[0]))
+island_model.assign_islands(founder_ids,
+                            np.random.randint(len(island_model.islands),
+                                              size = sizes[0]))
+population = IslandPopulation(island_model, seed = args.seed)
 
-island_model = islands_from_file(args.island_file)
-islands = island_model.islands
-for person in founders:
-    island_model.add_individual(choice(islands), person)
-population = IslandPopulation(island_model)
+if not args.no_genomes:
+    print("Loading recombination rates")
+    recombinators = recombinators_from_directory(args.recombination_dir)
+    chrom_sizes = recombinators[Sex.Male]._num_bases
+    genome_generator = RecombGenomeGenerator(chrom_sizes)
+    use_genome_arena(population)
+    if args.stream:
+        mate_pool = MatePool(recombinators, args.processes or 1, args.seed)
+
+def finish_generation(generation_number):
+    """
+    Generate genomes for the newest generation and write it to the
+    output file, then free the genomes that are no longer needed.
+    """
+    generation = population.generations[-1]
+    if not args.no_genomes:
+        generate_generation_genomes(generation, genome_generator,
+                                    recombinators, mate_pool = mate_pool)
+    write_genomes = len(sizes) - keep_genomes <= generation_number
+    writer.finish_generation(generation, write_genomes)
+    if generation_number > 0:
+        clear_generation_genomes(population.generations[-2])
+
+if args.stream:
+    finish_generation(0)
 
 print("Adding more generations")
-for generation_size in sizes[1:]:
+for generation_number, generation_size in enumerate(sizes[1:], 1):
     population.new_generation(node_generator, size = generation_size,
                               non_paternity_rate = args.non_paternity,
                               adoption_rate = args.adoption,
                               unknown_mother_rate = args.missing_mother,
                               unknown_father_rate = args.missing_father,
                               monogamy_rate = args.monogamy_rate)
+    if args.stream:
+        finish_generation(generation_number)
+
+if args.stream:
+    print("Finishing population file {}".format(args.output_file))
+    writer.close(population)
+    if not args.no_genomes:
+        mate_pool.close()
+    exit(0)
 
 if not args.no_genomes:
-    print("Loading recombination rates")
-    recombinators = recombinators_from_directory(args.recombination_dir)
-    chrom_sizes = recombinators[Sex.Male]._num_bases
-    genome_generator = RecombGenomeGenerator(chrom_sizes)
     print("Generating genomes")
-    generate_genomes(population, genome_generator, recombinators, 3)
+    generate_genomes(population, genome_generator, recombinators,
+                     keep_genomes, processes = args.processes,
+                     seed = args.seed)
 
 
 if args.output_file:
@@ -101,11 +182,9 @@ if args.output_file:
         print("Output file already exists.")
         exit(1)
 
-    with open(args.output_file, "wb") as pickle_file:
-        # Trees cause deep recursion in the pickle module, so we need
-        # to raise the recursion limit. This is the stack depth for
-        # python functions, you may need to increase the native stack
-        # depth using ulimit -s
-        # https://docs.python.org/3.4/library/pickle.html#what-can-be-pickled-and-unpickled
-        print("Saving population file to {}".format(args.output_file))
-        dump(population, pickle_file, protocol = HIGHEST_PROTOCOL)
+    print("Saving population file to {}".format(args.output_file))
+    if args.pickle:
+        with open(args.output_file, "wb") as pickle_file:
+            dump(population, pickle_file, protocol = HIGHEST_PROTOCOL)
+    else:
+        save_population(population, args.output_file, args.compress_genomes)
@@ -1,17 +1,61 @@
+import numpy as np
+
 from sex import Sex
+from pedigree import NODE_ID_DTYPE
 
 class Generation:
-    def __init__(self, members = None):
-        self.members = list(members)
+    """
+    A generation stores the ids of its members. Member Node objects
+    are views created from the shared node generator when requested.
+    """
+    def __init__(self, members = None, node_generator = None):
+        members = list(members)
+        if node_generator is None and len(members) > 0:
+            node_generator = members[0].node_generator
+        self._node_generator = node_generator
+        self._ids = np.fromiter((member._id for member in members),
+                                dtype = NODE_ID_DTYPE, count = len(members))
+
+    @classmethod
+    def from_ids(cls, node_generator, ids):
+        generation = cls([], node_generator)
+        generation._ids = np.asarray(ids, dtype = NODE_ID_DTYPE)
+        return generation
+
+    def __setstate__(self, state):
+        # Old pickles store the member Node objects directly. They are
+        # converted to ids by PopulationUnpickler.
+        if "members" in state:
+            state["_legacy_members"] = state.pop("members")
+        self.__dict__.update(state)
+
+    @property
+    def ids(self):
+        return self._ids
+
+    @property
+    def node_generator(self):
+        return self._node_generator
+
+    @property
+    def members(self):
+        node = self._node_generator.node
+        return [node(node_id) for node_id in self._ids.tolist()]
+
+    def _members_of_sex(self, sex):
+        sexes = self._node_generator.pedigree.sex[self._ids]
+        node = self._node_generator.node
+        return (node(node_id) for node_id
+                in self._ids[sexes == sex.value].tolist())
 
     @property
     def men(self):
-        return (person for person in self.members if person.sex == Sex.Male)
+        return self._members_of_sex(Sex.Male)
 
     @property
     def women(self):
-        return (person for person in self.members if person.sex == Sex.Female)
-    
+        return self._members_of_sex(Sex.Female)
+
     @property
     def size(self):
-        return len(self.members)
+        return len(self._ids)
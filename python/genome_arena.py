@@ -0,0 +1,319 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from diploid import Diploid
+from recomb_genome import RecombGenome, read_only
+from founder_signature import (SIGNATURE_WORDS, founder_signatures,
+                               signatures_from_founders)
+
+# Stored in slot columns for nodes without a genome.
+NO_GENOME = -1
+
+_INITIAL_CAPACITY = 1024
+_INITIAL_SLOTS = 64
+
+class GenomeArena(MutableMapping):
+    """
+    Mapping from node id -> genome where the genomes of the whole
+    population are stored in one pair of contiguous starts and founder
+    arrays. Every genome has a slot, slot s has its mother haplotype at
+    haplotype index 2s and its father haplotype at 2s + 1, and the
+    haplotype bounds table gives the range of each haplotype in the
+    arrays.
+
+    Genomes are returned as RecombGenome views into the arena, created
+    the first time a slot is requested and reused afterwards. Assigning
+    a genome copies it into the arena, unless it is a view of this
+    arena, in which case the nodes share the slot (eg. twins). Views
+    stay valid after the arena grows or is compacted, but are then
+    copied again if assigned to another node.
+
+    Views are read only, so a slot shared by several nodes can't be
+    changed through one of them. Shared slots are copy on write: to
+    change the genome of one node, assign it a modified copy (see
+    recomb_genome.writable_genome), which gets a slot of its own.
+
+    The founder signature (see founder_signature) of every slot is
+    computed when its genome is stored, so it is always in sync with
+    the genomes.
+
+    Removing genomes only marks their slot as free. The arrays are
+    compacted when more than half of them is unused, or all at once by
+    clear, so removing genomes doesn't churn the allocator.
+    """
+    def __init__(self, capacity = _INITIAL_CAPACITY):
+        capacity = max(int(capacity), 1)
+        self._starts = np.empty(capacity, dtype = np.uint32)
+        self._founder = np.empty(capacity, dtype = np.uint32)
+        # Number of array elements in use, including freed slots.
+        self._size = 0
+        # Number of array elements that belong to freed slots.
+        self._garbage = 0
+        self._end = None
+        self._bounds = np.zeros((2 * _INITIAL_SLOTS, 2), dtype = np.int64)
+        self._references = np.zeros(_INITIAL_SLOTS, dtype = np.int32)
+        self._signatures = np.zeros((_INITIAL_SLOTS, SIGNATURE_WORDS),
+                                    dtype = np.uint64)
+        self._num_slots = 0
+        self._free_slots = []
+        self._slot_of = np.full(_INITIAL_SLOTS, NO_GENOME, dtype = np.int32)
+        self._views = dict()
+        self._view_slots = dict()
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes of genome data held by the arena arrays.
+        """
+        return self._starts[:self._size].nbytes + self._founder[:self._size].nbytes
+
+    def slot(self, node_id):
+        """
+        Returns the slot of node_id, or NO_GENOME.
+        """
+        if not 0 <= node_id < len(self._slot_of):
+            return NO_GENOME
+        return int(self._slot_of[node_id])
+
+    def haplotype(self, slot, haplotype):
+        """
+        Returns the (starts, founder) arrays of the given haplotype (0
+        for the mother, 1 for the father) of slot, as views into the
+        arena.
+        """
+        start, stop = self._bounds[2 * slot + haplotype]
+        return (self._starts[start:stop], self._founder[start:stop])
+
+    def founder_signatures(self, node_ids):
+        """
+        Returns the founder signatures of the genomes of node_ids, as
+        a (len(node_ids), SIGNATURE_WORDS) array.
+        """
+        slots = np.array([self.slot(node_id) for node_id in node_ids],
+                         dtype = np.int64)
+        if np.any(slots == NO_GENOME):
+            raise KeyError(np.asarray(node_ids)[slots == NO_GENOME][0])
+        return self._signatures[slots]
+
+    def _view(self, slot):
+        genome = self._views.get(slot)
+        if genome is None:
+            mother_starts, mother_founder = self.haplotype(slot, 0)
+            father_starts, father_founder = self.haplotype(slot, 1)
+            genome = RecombGenome(Diploid(read_only(mother_starts),
+                                          self._end,
+                                          read_only(mother_founder)),
+                                  Diploid(read_only(father_starts),
+                                          self._end,
+                                          read_only(father_founder)))
+            self._views[slot] = genome
+            self._view_slots[id(genome)] = slot
+        return genome
+
+    def __getitem__(self, node_id):
+        slot = self.slot(node_id)
+        if slot == NO_GENOME:
+            raise KeyError(node_id)
+        return self._view(slot)
+
+    def __contains__(self, node_id):
+        return self.slot(node_id) != NO_GENOME
+
+    def _shared_slot(self, genome):
+        slot = self._view_slots.get(id(genome))
+        if slot is not None and self._views.get(slot) is genome:
+            return slot
+        return None
+
+    def _reserve_nodes(self, num_nodes):
+        if num_nodes <= len(self._slot_of):
+            return
+        capacity = len(self._slot_of)
+        while capacity < num_nodes:
+            capacity *= 2
+        slot_of = np.full(capacity, NO_GENOME, dtype = np.int32)
+        slot_of[:len(self._slot_of)] = self._slot_of
+        self._slot_of = slot_of
+
+    def _reserve_slots(self, num_slots):
+        capacity = len(self._references)
+        if num_slots <= capacity:
+            return
+        while capacity < num_slots:
+            capacity *= 2
+        bounds = np.zeros((2 * capacity, 2), dtype = np.int64)
+        bounds[:len(self._bounds)] = self._bounds
+        self._bounds = bounds
+        references = np.zeros(capacity, dtype = np.int32)
+        references[:len(self._references)] = self._references
+        self._references = references
+        signatures = np.zeros((capacity, SIGNATURE_WORDS), dtype = np.uint64)
+        signatures[:len(self._signatures)] = self._signatures
+        self._signatures = signatures
+
+    def _reserve(self, size):
+        capacity = len(self._starts)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for attribute in ("_starts", "_founder"):
+            old = getattr(self, attribute)
+            new = np.empty(capacity, dtype = np.uint32)
+            new[:self._size] = old[:self._size]
+            setattr(self, attribute, new)
+        # Cached views would keep the old arrays alive.
+        self._views = dict()
+        self._view_slots = dict()
+
+    def _new_slot(self):
+        if len(self._free_slots) > 0:
+            return self._free_slots.pop()
+        self._reserve_slots(self._num_slots + 1)
+        self._num_slots += 1
+        return self._num_slots - 1
+
+    def _release(self, node_id):
+        slot = self.slot(node_id)
+        if slot == NO_GENOME:
+            return False
+        self._slot_of[node_id] = NO_GENOME
+        self._references[slot] -= 1
+        if self._references[slot] == 0:
+            bounds = self._bounds[2 * slot:2 * slot + 2]
+            self._garbage += int((bounds[:, 1] - bounds[:, 0]).sum())
+            self._bounds[2 * slot:2 * slot + 2] = 0
+            genome = self._views.pop(slot, None)
+            if genome is not None:
+                del self._view_slots[id(genome)]
+            self._free_slots.append(slot)
+        return True
+
+    def __setitem__(self, node_id, genome):
+        self.set_many([node_id], [genome])
+
+    def set_many(self, node_ids, genomes):
+        """
+        Assign genomes to node_ids, copying all of the new genomes into
+        the arena with one concatenation.
+        """
+        node_ids = [int(node_id) for node_id in node_ids]
+        if len(node_ids) == 0:
+            return
+        self._reserve_nodes(max(node_ids) + 1)
+        shared = [self._shared_slot(genome) for genome in genomes]
+        for node_id, slot in zip(node_ids, shared):
+            if slot is not None:
+                self._references[slot] += 1
+        for node_id in node_ids:
+            self._release(node_id)
+        copied = [genome for genome, slot in zip(genomes, shared)
+                  if slot is None]
+        haplotypes = [haplotype for genome in copied
+                      for haplotype in (genome.mother, genome.father)]
+        if self._end is None and len(copied) > 0:
+            self._end = int(copied[0].mother.end)
+        lengths = np.array([len(haplotype.starts)
+                            for haplotype in haplotypes], dtype = np.int64)
+        stops = self._size + np.cumsum(lengths)
+        total = int(lengths.sum())
+        if total > 0:
+            self._reserve(self._size + total)
+            new_stop = self._size + total
+            self._starts[self._size:new_stop] = np.concatenate(
+                [haplotype.starts for haplotype in haplotypes])
+            self._founder[self._size:new_stop] = np.concatenate(
+                [haplotype.founder for haplotype in haplotypes])
+        signatures = founder_signatures(copied)
+        copied_i = 0
+        for node_id, genome, slot in zip(node_ids, genomes, shared):
+            if slot is None:
+                assert genome.mother.end == genome.father.end == self._end
+                slot = self._new_slot()
+                self._references[slot] = 1
+                haplotype_stops = stops[2 * copied_i:2 * copied_i + 2]
+                self._bounds[2 * slot:2 * slot + 2, 1] = haplotype_stops
+                self._bounds[2 * slot:2 * slot + 2, 0] = \
+                    haplotype_stops - lengths[2 * copied_i:2 * copied_i + 2]
+                self._signatures[slot] = signatures[copied_i]
+                copied_i += 1
+            self._slot_of[node_id] = slot
+        self._size += total
+        self._maybe_compact()
+
+    def __delitem__(self, node_id):
+        if not self._release(node_id):
+            raise KeyError(node_id)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._garbage > 0 and 2 * self._garbage > self._size:
+            self.compact()
+
+    def compact(self):
+        """
+        Move the haplotypes of the slots in use to the front of the
+        arrays, dropping the space of freed slots.
+        """
+        live = np.flatnonzero(self._references[:self._num_slots] > 0)
+        haplotypes = np.stack((2 * live, 2 * live + 1), axis = 1).ravel()
+        starts = self._bounds[haplotypes, 0]
+        lengths = self._bounds[haplotypes, 1] - starts
+        total = int(lengths.sum())
+        # Index of every element of the live haplotypes, in order.
+        new_offsets = np.cumsum(lengths) - lengths
+        index = (np.repeat(starts - new_offsets, lengths)
+                 + np.arange(total, dtype = np.int64))
+        capacity = max(total, _INITIAL_CAPACITY)
+        for attribute in ("_starts", "_founder"):
+            new = np.empty(capacity, dtype = np.uint32)
+            new[:total] = getattr(self, attribute)[index]
+            setattr(self, attribute, new)
+        self._bounds[haplotypes, 0] = new_offsets
+        self._bounds[haplotypes, 1] = new_offsets + lengths
+        self._size = total
+        self._garbage = 0
+        self._views = dict()
+        self._view_slots = dict()
+
+    def clear(self):
+        self.__init__()
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self._slot_of != NO_GENOME).tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self._slot_of != NO_GENOME))
+
+    def __getstate__(self):
+        self.compact()
+        return {"starts": self._starts[:self._size].copy(),
+                "founder": self._founder[:self._size].copy(),
+                "end": self._end,
+                "bounds": self._bounds[:2 * self._num_slots].copy(),
+                "references": self._references[:self._num_slots].copy(),
+                "free_slots": list(self._free_slots),
+                "slot_of": self._slot_of.copy()}
+
+    def __setstate__(self, state):
+        self.__init__(len(state["starts"]))
+        self._size = len(state["starts"])
+        self._starts[:self._size] = state["starts"]
+        self._founder[:self._size] = state["founder"]
+        self._end = state["end"]
+        self._num_slots = len(state["references"])
+        self._reserve_slots(self._num_slots)
+        self._bounds[:2 * self._num_slots] = state["bounds"]
+        self._references[:self._num_slots] = state["references"]
+        self._free_slots = state["free_slots"]
+        self._slot_of = state["slot_of"]
+        # Signatures are derived data, recomputed from the founders.
+        bounds = self._bounds[:2 * self._num_slots]
+        lengths = bounds[:, 1] - bounds[:, 0]
+        rows = np.repeat(np.arange(len(bounds)) // 2, lengths)
+        index = (np.repeat(bounds[:, 0] - (np.cumsum(lengths) - lengths),
+                           lengths)
+                 + np.arange(int(lengths.sum()), dtype = np.int64))
+        self._signatures[:self._num_slots] = signatures_from_founders(
+            self._founder[index], rows, self._num_slots)
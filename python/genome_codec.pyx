@@ -0,0 +1,155 @@
+# cython: language_level=3
+# cython: boundscheck=False
+# cython: wraparound=False
+"""
+Compressed encoding of haplotype tables.
+
+The starts of each haplotype are delta encoded, restarting from 0 at
+every haplotype, and the deltas are written as little endian base 128
+varints. Founder ids are replaced by their index in a dictionary of
+the founders in the table, and the indices are bit packed with a fixed
+number of bits per index, so segment i of the table has its founder
+code at bit i * bits.
+"""
+
+import numpy as np
+
+cimport numpy as np
+cimport cython
+
+from libc.stdint cimport uint8_t, uint32_t, uint64_t, int64_t
+
+def encode_starts(const int64_t[::1] haplotype_offsets,
+                  const uint32_t[::1] starts):
+    """
+    Varint encode the deltas of starts. Returns the encoded bytes and
+    the byte offset of each haplotype.
+    """
+    cdef Py_ssize_t num_haplotypes = haplotype_offsets.shape[0] - 1
+    cdef np.ndarray[np.int64_t, ndim=1] byte_offsets_array = \
+        np.zeros(num_haplotypes + 1, dtype = np.int64)
+    cdef int64_t[::1] byte_offsets = byte_offsets_array
+    cdef Py_ssize_t h, i
+    cdef int64_t size = 0
+    cdef uint32_t previous, delta
+    with nogil:
+        for h in range(num_haplotypes):
+            byte_offsets[h] = size
+            previous = 0
+            for i in range(haplotype_offsets[h], haplotype_offsets[h + 1]):
+                delta = starts[i] - previous
+                previous = starts[i]
+                size += 1
+                delta >>= 7
+                while delta != 0:
+                    size += 1
+                    delta >>= 7
+        byte_offsets[num_haplotypes] = size
+    cdef np.ndarray[np.uint8_t, ndim=1] encoded_array = \
+        np.empty(size, dtype = np.uint8)
+    cdef uint8_t[::1] encoded = encoded_array
+    cdef int64_t out_i = 0
+    with nogil:
+        for h in range(num_haplotypes):
+            previous = 0
+            for i in range(haplotype_offsets[h], haplotype_offsets[h + 1]):
+                delta = starts[i] - previous
+                previous = starts[i]
+                while delta >= 0x80:
+                    encoded[out_i] = (delta & 0x7f) | 0x80
+                    out_i += 1
+                    delta >>= 7
+                encoded[out_i] = delta
+                out_i += 1
+    return (encoded_array, byte_offsets_array)
+
+def pack_codes(const uint32_t[::1] codes, int bits):
+    """
+    Bit pack codes, each of which fits in bits bits.
+    """
+    cdef Py_ssize_t num_codes = codes.shape[0]
+    cdef np.ndarray[np.uint8_t, ndim=1] packed_array = \
+        np.zeros((num_codes * bits + 7) // 8, dtype = np.uint8)
+    cdef uint8_t[::1] packed = packed_array
+    cdef Py_ssize_t i
+    cdef uint64_t position, value
+    with nogil:
+        for i in range(num_codes):
+            position = i * bits
+            value = <uint64_t>codes[i] << (position & 7)
+            position >>= 3
+            while value != 0:
+                packed[position] |= value & 0xff
+                value >>= 8
+                position += 1
+    return packed_array
+
+cdef inline uint32_t _unpack(const uint8_t[::1] packed, uint64_t position,
+                             int bits) nogil:
+    cdef uint64_t value = 0
+    cdef int shift = position & 7
+    cdef Py_ssize_t byte = position >> 3
+    cdef int num_bytes = (shift + bits + 7) >> 3
+    cdef int j
+    for j in range(num_bytes):
+        value |= <uint64_t>packed[byte + j] << (8 * j)
+    return (value >> shift) & ((<uint64_t>1 << bits) - 1)
+
+cdef class HaplotypeDecoder:
+    """
+    Decodes haplotypes of a compressed table. Haplotype h has its
+    varint starts at start_bytes[start_byte_offsets[h]:] and segments
+    [haplotype_offsets[h], haplotype_offsets[h + 1]).
+    """
+    cdef const uint8_t[::1] start_bytes
+    cdef const int64_t[::1] start_byte_offsets
+    cdef const int64_t[::1] haplotype_offsets
+    cdef const uint8_t[::1] founder_codes
+    cdef int bits
+    cdef const uint32_t[::1] dictionary
+
+    def __init__(self, start_bytes, start_byte_offsets, haplotype_offsets,
+                 founder_codes, int bits, dictionary):
+        self.start_bytes = start_bytes
+        self.start_byte_offsets = start_byte_offsets
+        self.haplotype_offsets = haplotype_offsets
+        self.founder_codes = founder_codes
+        self.bits = bits
+        self.dictionary = dictionary
+
+    def decode(self, Py_ssize_t haplotype):
+        """
+        Returns the starts and founder arrays of haplotype.
+        """
+        cdef int64_t first = self.haplotype_offsets[haplotype]
+        cdef Py_ssize_t num_segments = \
+            self.haplotype_offsets[haplotype + 1] - first
+        cdef np.ndarray[np.uint32_t, ndim=1] starts_array = \
+            np.empty(num_segments, dtype = np.uint32)
+        cdef np.ndarray[np.uint32_t, ndim=1] founder_array = \
+            np.empty(num_segments, dtype = np.uint32)
+        cdef uint32_t[::1] starts = starts_array
+        cdef uint32_t[::1] founder = founder_array
+        cdef Py_ssize_t i
+        cdef int64_t in_i = self.start_byte_offsets[haplotype]
+        cdef uint32_t value = 0
+        cdef uint32_t delta
+        cdef int shift
+        cdef uint8_t byte
+        with nogil:
+            for i in range(num_segments):
+                delta = 0
+                shift = 0
+                while True:
+                    byte = self.start_bytes[in_i]
+                    in_i += 1
+                    delta |= <uint32_t>(byte & 0x7f) << shift
+                    if byte < 0x80:
+                        break
+                    shift += 7
+                value += delta
+                starts[i] = value
+                founder[i] = self.dictionary[_unpack(self.founder_codes,
+                                                     (first + i) * self.bits,
+                                                     self.bits)]
+        return (starts_array, founder_array)
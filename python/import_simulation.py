@@ -2,11 +2,11 @@ from argparse import ArgumentParser
 from os.path import isfile
 from pickle import dump, HIGHEST_PROTOCOL
 
-from population import PopulationUnpickler
+from population_file import load_population
 from classify_relationship import classifier_from_directory, classifier_from_file
 
 parser = ArgumentParser(description = "Import simulated data.")
-parser.add_argument("population_file", help = "Pickled file with population")
+parser.add_argument("population_file", help = "Population file (binary or pickled)")
 parser.add_argument("work_dir",
                     help = "Directory to put shared length calculations in.")
 parser.add_argument("--output-pickle", default = "distributions.pickle",
@@ -14,8 +14,7 @@ parser.add_argument("--output-pickle", default = "distributions.pickle",
 args = parser.parse_args()
 
 print("Loading population")
-with open(args.population_file, "rb") as pickle_file:
-    population = PopulationUnpickler(pickle_file).load()
+population = load_population(args.population_file)
 
 print("Importing simulated data")
 if isfile(args.work_dir):
@@ -1,27 +1,29 @@
+import numpy as np
+
+from pedigree import NODE_ID_DTYPE
+
+# Stored in the island column for nodes that are not on any island.
+NO_ISLAND = -1
+ISLAND_DTYPE = np.int16
+
 class IslandNode():
     def __init__(self, switch_probability, members = None):
         """
-        Create a new island node with constituent members.  If is_leaf
-        is true, then members will be individuals (Node objects from
-        node.py that represent people).
+        Create a new island node with the given switch probability.
+        Membership is stored by the IslandModel, members are added to
+        this island when the island model is created.
         """
         self._switch_probability = switch_probability
         if members is None:
             members = set()
-        self._individuals = set(members)
+        self._initial_members = list(members)
 
-    def _add_individual(self, individual):
-        self._individuals.add(individual)
-
-    def _remove_individual(self, individual):
-        self._individuals.remove(individual)
-
-    def __in__(self, individual):
-        return individual in self._individuals
-
-    @property
-    def individuals(self):
-        return self._individuals
+    def __setstate__(self, state):
+        # Islands pickled before membership was stored in the
+        # IslandModel hold a set of individuals.
+        state.pop("_individuals", None)
+        state.setdefault("_initial_members", [])
+        self.__dict__.update(state)
 
     @property
     def switch_probability(self):
@@ -32,44 +34,187 @@ class IslandModel():
     """
     Class to encapsulate switching probabilities in Hierarchical
     island tree model.
+
+    The island of every individual is stored in an array indexed by
+    node id, so the islands of a generation are the island column
+    taken at the generation's ids.
     """
-    def __init__(self, islands):
+    def __init__(self, islands, node_generator = None):
         assert islands is not None
         self._islands = islands
-        self._individual_island = dict()
+        self._node_generator = node_generator
+        self._island_of = np.full(1024, NO_ISLAND, dtype = ISLAND_DTYPE)
         for island in islands:
-            for node in island.individuals:
-                self._individual_island[node] = island
+            for node in island._initial_members:
+                self.add_individual(island, node)
+            island._initial_members = []
+
+    def __setstate__(self, state):
+        individual_island = state.pop("_individual_island", None)
+        self.__dict__.update(state)
+        if individual_island is not None:
+            # Models pickled before islands were stored in an array
+            # map individuals to islands with a dict.
+            self._island_of = np.full(1024, NO_ISLAND, dtype = ISLAND_DTYPE)
+            self._node_generator = None
+            if len(individual_island) > 0:
+                individual = next(iter(individual_island))
+                self._node_generator = getattr(individual, "node_generator",
+                                               None)
+            island_index = self._island_index()
+            self.assign_islands([individual._id for individual
+                                 in individual_island],
+                                [island_index[island] for island
+                                 in individual_island.values()])
+
+    def _island_index(self):
+        return {island: i for i, island in enumerate(self._islands)}
+
+    def _reserve(self, size):
+        capacity = len(self._island_of)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        island_of = np.full(capacity, NO_ISLAND, dtype = ISLAND_DTYPE)
+        island_of[:len(self._island_of)] = self._island_of
+        self._island_of = island_of
 
     def get_island(self, individual):
-        return self._individual_island[individual]
+        island_i = self.island_ids([individual._id])[0]
+        if island_i == NO_ISLAND:
+            raise KeyError(individual)
+        return self._islands[island_i]
+
+    def island_ids(self, node_ids):
+        """
+        Returns the island index of each of node_ids, or NO_ISLAND.
+        """
+        node_ids = np.asarray(node_ids, dtype = NODE_ID_DTYPE)
+        island_ids = np.full(len(node_ids), NO_ISLAND, dtype = ISLAND_DTYPE)
+        known = (node_ids >= 0) & (node_ids < len(self._island_of))
+        island_ids[known] = self._island_of[node_ids[known]]
+        return island_ids
 
     # TODO: Move this method to the island object
     def add_individual(self, island, individual):
-        island._add_individual(individual)
-        self._individual_island[individual] = island
+        if self._node_generator is None:
+            self._node_generator = individual.node_generator
+        self.assign_islands([individual._id],
+                            [self._islands.index(island)])
+
+    def assign_islands(self, node_ids, island_ids):
+        """
+        Place each of node_ids on the island with the corresponding
+        index in island_ids.
+        """
+        node_ids = np.asarray(node_ids, dtype = NODE_ID_DTYPE)
+        if len(node_ids) == 0:
+            return
+        self._reserve(int(node_ids.max()) + 1)
+        self._island_of[node_ids] = island_ids
 
     def move_individual(self, individual, destination_island):
         """
         Remove an individual from their current island and move them
         to destination_island.
         """
-        source_island = self._individual_island[individual]
-        if source_island == destination_island:
+        self.get_island(individual)
+        self.assign_islands([individual._id],
+                            [self._islands.index(destination_island)])
+
+    def migrate(self, node_ids, rng):
+        """
+        Migrate all of node_ids at once. Each individual switches to a
+        uniformly chosen different island with the switch probability
+        of their current island.
+        """
+        node_ids = np.asarray(node_ids, dtype = NODE_ID_DTYPE)
+        num_islands = len(self._islands)
+        if num_islands < 2 or len(node_ids) == 0:
             return
-        source_island._remove_individual(individual)
-        destination_island._add_individual(individual)
-        self._individual_island[individual] = destination_island
-        
+        current = self._island_of[node_ids].astype(np.int64)
+        switch_probabilities = np.array([island.switch_probability for island
+                                         in self._islands])
+        switch = rng.random(len(node_ids)) < switch_probabilities[current]
+        # Adding an offset in [1, num_islands) picks one of the other
+        # islands uniformly.
+        offsets = rng.integers(1, num_islands, size = int(switch.sum()))
+        current[switch] = (current[switch] + offsets) % num_islands
+        self._island_of[node_ids] = current
+
+    def island_index(self, node_ids, sexes):
+        """
+        Returns an IslandIndex over node_ids, using their current
+        islands.
+        """
+        return IslandIndex(node_ids, self.island_ids(node_ids), sexes,
+                           len(self._islands))
+
+    @property
+    def individual_ids(self):
+        return np.flatnonzero(self._island_of != NO_ISLAND).astype(NODE_ID_DTYPE)
 
     @property
     def individuals(self):
-        return list(self._individual_island)
+        if self._node_generator is None:
+            return []
+        node = self._node_generator.node
+        return [node(node_id) for node_id in self.individual_ids.tolist()]
 
     @property
     def islands(self):
         return self._islands
 
+class IslandIndex:
+    """
+    Members of a group of individuals (eg. a generation) grouped by
+    island and sex. Members are stored sorted by the key
+    2 * island + sex, with the start of each key in indptr.
+    """
+    def __init__(self, node_ids, island_ids, sexes, num_islands):
+        node_ids = np.asarray(node_ids, dtype = NODE_ID_DTYPE)
+        keys = 2 * np.asarray(island_ids, dtype = np.int64) + sexes
+        order = np.argsort(keys, kind = "stable")
+        keys = keys[order]
+        self.ids = node_ids[order]
+        self.island_ids = keys // 2
+        self.sexes = keys % 2
+        counts = np.bincount(keys, minlength = 2 * num_islands)
+        self.indptr = np.zeros(2 * num_islands + 1, dtype = np.int64)
+        np.cumsum(counts, out = self.indptr[1:])
+
+    def _bounds(self, island_i, sex):
+        if sex is None:
+            return (self.indptr[2 * island_i], self.indptr[2 * island_i + 2])
+        key = 2 * island_i + sex.value
+        return (self.indptr[key], self.indptr[key + 1])
+
+    def positions(self, island_i, sex = None):
+        """
+        Returns the positions in ids of members on island_i,
+        optionally only those of the given Sex.
+        """
+        return np.arange(*self._bounds(island_i, sex))
+
+    def members(self, island_i, sex = None):
+        """
+        Returns the ids of members on island_i, optionally only those
+        of the given Sex.
+        """
+        start, stop = self._bounds(island_i, sex)
+        return self.ids[start:stop]
+
+    def sample(self, rng, island_ids, sex):
+        """
+        Returns one random member of the given Sex for each entry of
+        island_ids.
+        """
+        keys = 2 * np.asarray(island_ids, dtype = np.int64) + sex.value
+        starts = self.indptr[keys]
+        offsets = rng.integers(self.indptr[keys + 1] - starts)
+        return self.ids[starts + offsets]
+
 def islands_from_string(tree):
     if isinstance(tree, str):
         tree = tree.split("\n")
@@ -0,0 +1,126 @@
+# cython: language_level=3
+# cython: boundscheck=False
+# cython: wraparound=False
+
+import numpy as np
+
+cimport numpy as np
+cimport cython
+
+from libc.stdint cimport uint8_t, uint32_t, int64_t
+
+cdef Py_ssize_t _gamete(const uint32_t[::1] starts,
+                        const uint32_t[::1] founder,
+                        Py_ssize_t first_start, Py_ssize_t first_stop,
+                        Py_ssize_t second_start, Py_ssize_t second_stop,
+                        const uint32_t[::1] crossovers,
+                        Py_ssize_t cross_start, Py_ssize_t cross_stop,
+                        const uint8_t[:] second_chromosome,
+                        const uint32_t[::1] chrom_offsets, uint32_t end,
+                        uint32_t[::1] out_starts, uint32_t[::1] out_founder,
+                        Py_ssize_t out_i, bint write) nogil:
+    """
+    Walk over the starts of both haplotypes of a parent and the
+    crossover locations of one meiosis in a single merge, emitting the
+    starts of the gamete. At every location the gamete follows the
+    haplotype picked for the chromosome, switched to the other
+    haplotype between each (start, stop) pair of crossover locations.
+    Both haplotypes are broken at every crossover location, so those
+    locations are always starts of the gamete. Returns the index after
+    the last start written.
+    """
+    cdef Py_ssize_t i_first = first_start
+    cdef Py_ssize_t i_second = second_start
+    cdef Py_ssize_t i_cross = cross_start
+    cdef Py_ssize_t chrom = 0
+    cdef Py_ssize_t num_chroms = chrom_offsets.shape[0]
+    cdef bint swapped = False
+    cdef bint at_first, at_second, at_cross, use_second
+    cdef uint32_t location
+    while True:
+        location = end
+        if i_first < first_stop and starts[i_first] < location:
+            location = starts[i_first]
+        if i_second < second_stop and starts[i_second] < location:
+            location = starts[i_second]
+        if i_cross < cross_stop and crossovers[i_cross] < location:
+            location = crossovers[i_cross]
+        if location >= end:
+            break
+        at_first = False
+        while i_first < first_stop and starts[i_first] == location:
+            i_first += 1
+            at_first = True
+        at_second = False
+        while i_second < second_stop and starts[i_second] == location:
+            i_second += 1
+            at_second = True
+        at_cross = False
+        while i_cross < cross_stop and crossovers[i_cross] == location:
+            i_cross += 1
+            swapped = not swapped
+            at_cross = True
+        while chrom + 1 < num_chroms and chrom_offsets[chrom + 1] <= location:
+            chrom += 1
+        use_second = (second_chromosome[chrom] != 0) != swapped
+        if use_second:
+            if at_second or at_cross:
+                if write:
+                    out_starts[out_i] = location
+                    out_founder[out_i] = founder[i_second - 1]
+                out_i += 1
+        else:
+            if at_first or at_cross:
+                if write:
+                    out_starts[out_i] = location
+                    out_founder[out_i] = founder[i_first - 1]
+                out_i += 1
+    return out_i
+
+def meiosis_batch(const int64_t[::1] haplotype_offsets,
+                  const uint32_t[::1] starts, const uint32_t[::1] founder,
+                  const int64_t[::1] parents,
+                  const int64_t[::1] crossover_indptr,
+                  const uint32_t[::1] crossovers,
+                  const uint8_t[:, :] second_chromosome,
+                  const uint32_t[::1] chrom_offsets, uint32_t end,
+                  int64_t[::1] out_offsets,
+                  uint32_t[::1] out_starts = None,
+                  uint32_t[::1] out_founder = None):
+    """
+    Produce the gametes of many meioses. The haplotypes of the parent
+    genomes are stored in starts and founder, where haplotype h is
+    [haplotype_offsets[h], haplotype_offsets[h + 1]) and parent p has
+    haplotypes 2p (its mother's) and 2p + 1 (its father's). Meiosis i
+    is in parent parents[i], with crossover locations
+    crossovers[crossover_indptr[i]:crossover_indptr[i + 1]] and takes
+    chromosome c from the parent's father if second_chromosome[i, c]
+    is set.
+
+    If out_starts and out_founder are None, only out_offsets is filled
+    in with the offsets of each gamete, so the caller can allocate
+    buffers of the right size and call again to write the gametes.
+    """
+    cdef Py_ssize_t num_meioses = parents.shape[0]
+    cdef bint write = out_starts is not None
+    cdef uint32_t[::1] dummy = np.empty(0, dtype = np.uint32)
+    if not write:
+        out_starts = dummy
+        out_founder = dummy
+    cdef Py_ssize_t i, first, second
+    cdef Py_ssize_t out_i = 0
+    with nogil:
+        for i in range(num_meioses):
+            out_offsets[i] = out_i
+            first = 2 * parents[i]
+            second = first + 1
+            out_i = _gamete(starts, founder,
+                            haplotype_offsets[first],
+                            haplotype_offsets[first + 1],
+                            haplotype_offsets[second],
+                            haplotype_offsets[second + 1],
+                            crossovers, crossover_indptr[i],
+                            crossover_indptr[i + 1],
+                            second_chromosome[i], chrom_offsets, end,
+                            out_starts, out_founder, out_i, write)
+        out_offsets[num_meioses] = out_i
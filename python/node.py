@@ -1,9 +1,17 @@
+from collections.abc import Mapping
+from numbers import Integral
 from random import choice
 
 from sex import Sex, SEXES
+from pedigree import PedigreeArrays, NO_NODE
 
 STR_BASE = "<Node id = {}, mother = {}, father = {}"
 
+def _id_or_none(node_id):
+    if node_id == NO_NODE:
+        return None
+    return int(node_id)
+
 class NodeGenerator:
     """
     We use a node generator so that nodes point to each other by id
@@ -13,47 +21,82 @@ class NodeGenerator:
     on nodes and populations without overflowing the stack.  The IDs
     are also usefull when using multiprocessing, as just the Node's id
     can be passed from one process to the other.
+
+    The pedigree itself is stored in a PedigreeArrays object owned by
+    the generator. Node objects are thin views of a row in the
+    pedigree, and are created on demand, so they hold no state of
+    their own other than their id. Genomes are stored by the
+    generator, keyed by node id.
     """
-    def __init__(self):
-        self._id = 0
-        self._mapping = dict()
-        
+    def __init__(self, pedigree = None):
+        if pedigree is None:
+            pedigree = PedigreeArrays()
+        self._pedigree = pedigree
+        self._genomes = dict()
+        self._suspected_genomes = dict()
+        self._genome_version = 0
+
+    @property
+    def genome_version(self):
+        """
+        Counter that changes whenever a genome or suspected genome is
+        set or removed, so caches built from genomes can tell when they
+        are stale.
+        """
+        return self._genome_version
+
+    def genomes_changed(self):
+        """
+        Record that genomes were set or removed without going through
+        Node.genome or Node.suspected_genome (eg. by writing to the
+        genome store directly).
+        """
+        self._genome_version += 1
+
     def generate_node(self, father = None, mother = None,
                       suspected_father = None, suspected_mother = None,
                       sex = None, twin = None):
-        node_id = self._id
-        self._id += 1
         if father is not None:
+            assert father.sex == Sex.Male
             father_id = father._id
         else:
-            father_id = None
+            father_id = NO_NODE
         if suspected_father is not None:
             suspected_father_id = suspected_father._id
-        elif father is not None:
-            suspected_father_id = father._id
         else:
-            suspected_father_id = None
-            
+            suspected_father_id = father_id
+
         if mother is not None:
+            assert mother.sex == Sex.Female
             mother_id = mother._id
         else:
-            mother_id = None
+            mother_id = NO_NODE
         if suspected_mother is not None:
             suspected_mother_id = suspected_mother._id
-        elif mother is not None:
-            suspected_mother_id = mother._id
         else:
-            suspected_mother_id = None
+            suspected_mother_id = mother_id
 
         if twin is not None:
             twin_id = twin._id
         else:
-            twin_id = None
+            twin_id = NO_NODE
 
-        node = Node(self, node_id, father_id, mother_id, suspected_father_id,
-                    suspected_mother_id, sex = sex, twin_id = twin_id)
-        self._mapping[node_id] = node
-        return node
+        if not isinstance(sex, Sex):
+            sex = choice(SEXES)
+
+        pedigree = self._pedigree
+        parent_generations = [pedigree._generation[parent_id]
+                              for parent_id in (father_id, mother_id)
+                              if parent_id != NO_NODE]
+        if len(parent_generations) > 0:
+            generation = max(parent_generations) + 1
+        else:
+            generation = 0
+
+        node_id = pedigree.add(father_id, mother_id, suspected_father_id,
+                               suspected_mother_id, sex.value, generation,
+                               twin_id)
+        return Node(self, node_id)
 
     def twin_node(self, template):
         mother = template.mother
@@ -66,10 +109,44 @@ class NodeGenerator:
                                   twin = template)
         template.set_twin(node)
         return node
-    
+
+    def node(self, node_id):
+        """
+        Returns the Node view for the given id.
+        """
+        return Node(self, node_id)
+
+    @property
+    def pedigree(self):
+        return self._pedigree
+
     @property
     def mapping(self):
-        return self._mapping
+        return NodeMapping(self)
+
+class NodeMapping(Mapping):
+    """
+    Read only mapping from node id -> Node, backed by the pedigree.
+    """
+    __slots__ = ("_node_generator",)
+
+    def __init__(self, node_generator):
+        self._node_generator = node_generator
+
+    def __getitem__(self, node_id):
+        if not 0 <= node_id < len(self._node_generator._pedigree):
+            raise KeyError(node_id)
+        return Node(self._node_generator, node_id)
+
+    def __contains__(self, node_id):
+        return (isinstance(node_id, Integral)
+                and 0 <= node_id < len(self._node_generator._pedigree))
+
+    def __iter__(self):
+        return iter(range(len(self._node_generator._pedigree)))
+
+    def __len__(self):
+        return len(self._node_generator._pedigree)
 
 class Node:
     """
@@ -77,169 +154,204 @@ class Node:
     The mother and father properties are the true biological mother and father
 
     The suspected_mother and suspected_father are the individuals the
-  
-  'attacker' thinks are the mother and
+    'attacker' thinks are the mother and
     father. suspected_mother/father may be the true biological mother
     and father, or they may be other nodes in the geneology. They can
     be different due to errors in the records the attacker has, which
     can be caused by non-paternity events or adoption for example.
+
+    A Node is a view of a single row in its generator's pedigree, so
+    two Node objects with the same id compare and hash equal.
     """
-    def __init__(self, node_generator, self_id, father_id = None,
-                 mother_id = None, suspected_father_id = None,
-                 suspected_mother_id = None, sex = None, twin_id = None):
-        self.genome = None
-        self._suspected_genome = None
+    __slots__ = ("_node_generator", "_id")
+
+    def __init__(self, node_generator, self_id):
         self._node_generator = node_generator
-        self._twin_id = twin_id
-        self._mother_id = mother_id
-        if suspected_mother_id is None:
-            self._suspected_mother_id = mother_id
-        else:
-            self._suspected_mother_id = suspected_mother_id
-        if suspected_father_id is None:
-            self._suspected_father_id = father_id
-        else:
-            self._suspected_father_id = suspected_father_id
-        self._father_id = father_id
-        self._id = self_id
-        if isinstance(sex, Sex):
-            self.sex = sex
-        else:
-            self.sex = choice(SEXES)
-        self._children = []
-        self._suspected_children = []
-        self._resolve_parents()
-        if self.mother is not None:
-            assert self.mother.sex == Sex.Female
-            self.mother._children.append(self._id)
-        if self.father is not None:
-            assert self.father.sex == Sex.Male
-            self.father._children.append(self._id)
-        self.set_suspected_mother(self.suspected_mother)
-        self.set_suspected_father(self.suspected_father)
-
-    def __getstate__(self):
-        state = self.__dict__.copy()
-        del state["mother"]
-        del state["father"]
-        del state["suspected_mother"]
-        del state["suspected_father"]
-        del state["twin"]
-        return state
-    
+        # Ids often come from numpy arrays, which don't hash as ints.
+        self._id = int(self_id)
+
+    def __reduce__(self):
+        # Pickle as a lookup on the generator. This keeps pickles of
+        # populations shallow, and avoids referencing the Node class,
+        # which PopulationUnpickler reserves for old style pickles.
+        return (self._node_generator.node, (self._id,))
+
     def __setstate__(self, state):
-        self.__dict__.update(state)
-        if "_suspected_genome" not in state:
-            self._suspected_genome = None #We do this because there are old pickle files that don't have this property
-        # Parents are resolved by PopulationUnpickler after all Node
-        # objects are created
+        raise TypeError("This pickle contains nodes in the old format."
+                        " Load it using population.PopulationUnpickler.")
+
+    def __eq__(self, other):
+        if not isinstance(other, Node):
+            return NotImplemented
+        return (self._id == other._id
+                and self._node_generator is other._node_generator)
+
+    def __ne__(self, other):
+        if not isinstance(other, Node):
+            return NotImplemented
+        return not self == other
+
+    def __hash__(self):
+        return self._id
+
+    def __repr__(self):
+        return str(self)
 
     def __str__(self):
-        to_str = [STR_BASE.format(self._id, self._mother_id, self._father_id)]
-        if self._twin_id is not None:
-            to_str.append(", twin id = {}".format(self._twin_id))
-        if self._suspected_mother_id != self._mother_id:
-            to_str.append(", suspected mother id = {}".format(self._suspected_mother_id))
-        if self._suspected_father_id != self._father_id:
-            to_str.append(", suspected father id = {}".format(self._suspected_father_id))
+        pedigree = self._node_generator._pedigree
+        i = self._id
+        mother_id = _id_or_none(pedigree._mother[i])
+        father_id = _id_or_none(pedigree._father[i])
+        to_str = [STR_BASE.format(i, mother_id, father_id)]
+        twin_id = _id_or_none(pedigree._twin[i])
+        if twin_id is not None:
+            to_str.append(", twin id = {}".format(twin_id))
+        suspected_mother_id = _id_or_none(pedigree._suspected_mother[i])
+        if suspected_mother_id != mother_id:
+            to_str.append(", suspected mother id = {}".format(suspected_mother_id))
+        suspected_father_id = _id_or_none(pedigree._suspected_father[i])
+        if suspected_father_id != father_id:
+            to_str.append(", suspected father id = {}".format(suspected_father_id))
         to_str.append(">")
         return "".join(to_str)
 
+    def _relative(self, column):
+        relative_id = column[self._id]
+        if relative_id == NO_NODE:
+            return None
+        return Node(self._node_generator, relative_id)
 
-    def _resolve_parents(self):
-        """
-        This method resolves the respective parent ids in to objects.
-        This is usually done in the constructor or after unpickling a node
-        object.
-        """
-        mapping = self._node_generator._mapping
+    @property
+    def mother(self):
+        return self._relative(self._node_generator._pedigree._mother)
 
-        if self._twin_id is not None:
-            self.twin = mapping[self._twin_id]
-        else:
-            self.twin = None
+    @property
+    def father(self):
+        return self._relative(self._node_generator._pedigree._father)
 
-        if self._mother_id is not None:
-            self.mother = mapping[self._mother_id]
-        else:
-            self.mother = None
-        if self._father_id is not None:
-            self.father = mapping[self._father_id]
-        else:
-            self.father = None
-            
-        if self._suspected_father_id is not None:
-            self.suspected_father = mapping[self._suspected_father_id]
-        else:
-            self.suspected_father = None
-        if self._suspected_mother_id is not None:
-            self.suspected_mother = mapping[self._suspected_mother_id]
-        else:
-            self.suspected_mother = None
+    @property
+    def twin(self):
+        return self._relative(self._node_generator._pedigree._twin)
+
+    @property
+    def suspected_mother(self):
+        return self._relative(self._node_generator._pedigree._suspected_mother)
+
+    @suspected_mother.setter
+    def suspected_mother(self, suspected_mother):
+        self.set_suspected_mother(suspected_mother)
+
+    @property
+    def suspected_father(self):
+        return self._relative(self._node_generator._pedigree._suspected_father)
+
+    @suspected_father.setter
+    def suspected_father(self, suspected_father):
+        self.set_suspected_father(suspected_father)
+
+    @property
+    def sex(self):
+        return SEXES[self._node_generator._pedigree._sex[self._id]]
+
+    @property
+    def generation(self):
+        return int(self._node_generator._pedigree._generation[self._id])
 
     def set_twin(self, twin):
-        self._twin_id = twin._id
-        self.twin = twin
+        self._node_generator._pedigree.set_twin(self._id, twin._id)
 
-    # TODO: Turn suspected mother and father into @property methods
     def set_suspected_mother(self, suspected_mother):
-        if (self.suspected_mother is not None
-            and self._id in self.suspected_mother._suspected_children):
-            self.suspected_mother._suspected_children.remove(self._id)
-        self.suspected_mother = suspected_mother
         if suspected_mother is not None:
             assert suspected_mother.sex == Sex.Female
-            self._suspected_mother_id = suspected_mother._id
-            suspected_mother._suspected_children.append(self._id)
+            mother_id = suspected_mother._id
         else:
-            self._suspected_mother_id = None
+            mother_id = NO_NODE
+        self._node_generator._pedigree.set_suspected_mother(self._id,
+                                                            mother_id)
 
     def set_suspected_father(self, suspected_father):
-        if (self.suspected_father is not None
-            and self._id in self.suspected_father._suspected_children):
-            self.suspected_father._suspected_children.remove(self._id)
-        self.suspected_father = suspected_father
         if suspected_father is not None:
             assert suspected_father.sex == Sex.Male
-            self._suspected_father_id = suspected_father._id
-            suspected_father._suspected_children.append(self._id)
+            father_id = suspected_father._id
+        else:
+            father_id = NO_NODE
+        self._node_generator._pedigree.set_suspected_father(self._id,
+                                                            father_id)
+
+    @property
+    def genome(self):
+        return self._node_generator._genomes.get(self._id)
+
+    @genome.setter
+    def genome(self, genome):
+        genomes = self._node_generator._genomes
+        if genome is None:
+            # Checked explicitly rather than with pop, so genome
+            # providers don't generate a genome only to remove it.
+            if self._id in genomes:
+                del genomes[self._id]
         else:
-            self._suspected_father_id = None
+            genomes[self._id] = genome
+        self._node_generator.genomes_changed()
+
+    @property
+    def has_genome(self):
+        """
+        Whether this node has a genome, without loading or generating
+        it.
+        """
+        return self._id in self._node_generator._genomes
 
     @property
     def suspected_genome(self):
-        if self._suspected_genome is None:
+        suspected = self._node_generator._suspected_genomes.get(self._id)
+        if suspected is None:
             return self.genome
         else:
-            return self._suspected_genome
+            return suspected
 
     @suspected_genome.setter
     def suspected_genome(self, genome):
-        self._suspected_genome = genome
-            
+        if genome is None:
+            self._node_generator._suspected_genomes.pop(self._id, None)
+        else:
+            self._node_generator._suspected_genomes[self._id] = genome
+        self._node_generator.genomes_changed()
+
     @property
     def mapping(self):
         """
         Returns a the dictionary mapping node id -> node object
         """
-        return self._node_generator._mapping
+        return self._node_generator.mapping
 
     @property
     def children(self):
         """
         The true children of this node
         """
-        return [self._node_generator._mapping[node_id]
-                for node_id in self._children]
+        generator = self._node_generator
+        children = generator._pedigree.children(self._id)
+        return [Node(generator, node_id) for node_id in children.tolist()]
 
     @property
     def suspected_children(self):
         """
         The suspected children of this node
         """
-        return [self._node_generator._mapping[node_id]
-                for node_id in self._suspected_children]
+        generator = self._node_generator
+        children = generator._pedigree.suspected_children(self._id)
+        return [Node(generator, node_id) for node_id in children.tolist()]
 
     @property
     def node_generator(self):
         return self._node_generator
+
+class LegacyNode:
+    """
+    Placeholder for nodes from pickles created before the pedigree was
+    stored in PedigreeArrays. PopulationUnpickler loads old Node
+    objects as LegacyNode and then converts the population.
+    """
+    def __setstate__(self, state):
+        self.__dict__.update(state)
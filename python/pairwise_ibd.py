@@ -0,0 +1,261 @@
+"""
+IBD between all pairs of two sets of nodes.
+
+The pair space is cut into tiles of tile_size x tile_size pairs, which
+are computed by a pool of worker processes. The genomes of the nodes
+are packed into one haplotype table that workers read from shared
+memory, together with the founder signatures used to skip pairs
+without common founders, which are taken from the GenomeArena holding
+the genomes when there is one.
+"""
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse import coo_matrix
+
+from diploid import Diploid
+from founder_signature import founder_signatures, SIGNATURE_WORDS
+from genome_arena import GenomeArena
+from recomb_genome import RecombGenome, read_only
+from simulation import share_array, attach_array
+
+DEFAULT_TILE_SIZE = 256
+
+def _pack_genomes(genomes):
+    """
+    Returns the (starts, founder, haplotype_offsets) table of genomes,
+    where haplotype 2i is the mother and 2i + 1 the father of genome i.
+    """
+    haplotypes = [diploid for genome in genomes
+                  for diploid in (genome.mother, genome.father)]
+    offsets = np.zeros(len(haplotypes) + 1, dtype = np.int64)
+    np.cumsum([len(haplotype.starts) for haplotype in haplotypes],
+              out = offsets[1:])
+    starts = np.concatenate([haplotype.starts for haplotype in haplotypes])
+    founder = np.concatenate([haplotype.founder for haplotype in haplotypes])
+    return (starts.astype(np.uint32, copy = False),
+            founder.astype(np.uint32, copy = False), offsets)
+
+def _unpack_genomes(starts, founder, offsets, end):
+    """
+    Returns the genomes of a table made by _pack_genomes, as read only
+    views of its arrays.
+    """
+    starts = read_only(starts)
+    founder = read_only(founder)
+    bounds = offsets.tolist()
+    diploids = [Diploid(starts[start:stop], end, founder[start:stop])
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+    return [RecombGenome(mother, father)
+            for mother, father in zip(diploids[0::2], diploids[1::2])]
+
+def _signatures(nodes, genomes):
+    """
+    Returns the founder signatures of the genomes of nodes. Signatures
+    kept by a GenomeArena holding the genomes are reused rather than
+    recomputed.
+    """
+    generators = set(getattr(node, "_node_generator", None)
+                     for node in nodes)
+    if len(generators) == 1:
+        store = getattr(generators.pop(), "_genomes", None)
+        if isinstance(store, GenomeArena):
+            return store.founder_signatures([node._id for node in nodes])
+    return founder_signatures(genomes)
+
+def _task_pairs(task, symmetric):
+    """
+    Returns the (rows, columns) index arrays of the pairs of a task,
+    which is either the (row_start, row_stop, column_start,
+    column_stop) bounds of a tile or the (rows, columns) arrays of
+    sampled pairs. Symmetric tiles only have pairs with row < column.
+    """
+    if len(task) == 2:
+        return task
+    row_start, row_stop, column_start, column_stop = task
+    rows, columns = np.meshgrid(np.arange(row_start, row_stop),
+                                np.arange(column_start, column_stop),
+                                indexing = "ij")
+    rows = rows.ravel()
+    columns = columns.ravel()
+    if symmetric and row_start == column_start:
+        upper = rows < columns
+        rows = rows[upper]
+        columns = columns[upper]
+    return (rows, columns)
+
+def _tile_lengths(state, task):
+    """
+    Returns task and the IBD of its pairs.
+    """
+    genomes, signatures, ibd_detector, symmetric, offset_b = state
+    rows, columns = _task_pairs(task, symmetric)
+    columns = columns + offset_b
+    row_list = rows.tolist()
+    column_list = columns.tolist()
+    return (task, ibd_detector.pair_shared_segment_lengths(
+        [genomes[i] for i in row_list], [genomes[j] for j in column_list],
+        signatures[rows], signatures[columns]))
+
+_worker_state = None
+_worker_memory = None
+
+def _init_pairwise_worker(shared_table, end, ibd_detector, symmetric,
+                          offset_b):
+    global _worker_state, _worker_memory
+    _worker_memory = []
+    starts, founder, offsets, signatures = (attach_array(shared,
+                                                         _worker_memory)
+                                            for shared in shared_table)
+    signatures = signatures.reshape(-1, SIGNATURE_WORDS)
+    _worker_state = (_unpack_genomes(starts, founder, offsets, end),
+                     signatures, ibd_detector, symmetric, offset_b)
+
+def _pairwise_worker_tile(task):
+    return _tile_lengths(_worker_state, task)
+
+def _tiles(num_a, num_b, symmetric, tile_size):
+    """
+    Yields the (row_start, row_stop, column_start, column_stop) bounds
+    of the tiles with pairs. Symmetric pair spaces only have tiles on
+    and above the diagonal.
+    """
+    for row_start in range(0, num_a, tile_size):
+        row_stop = min(row_start + tile_size, num_a)
+        first_column = row_start if symmetric else 0
+        for column_start in range(first_column, num_b, tile_size):
+            column_stop = min(column_start + tile_size, num_b)
+            # A diagonal tile of one row has no pair above the diagonal.
+            if (symmetric and row_start == column_start
+                and row_stop - row_start < 2):
+                continue
+            yield (row_start, row_stop, column_start, column_stop)
+
+def _sample_pairs(num_a, num_b, symmetric, sample, seed):
+    """
+    Returns the (rows, columns) of sample distinct pairs drawn
+    uniformly from the pair space.
+    """
+    if symmetric:
+        total = num_a * (num_a - 1) // 2
+    else:
+        total = num_a * num_b
+    sample = min(sample, total)
+    rng = np.random.default_rng(seed)
+    chosen = np.sort(rng.choice(total, size = sample, replace = False))
+    if not symmetric:
+        return (chosen // num_b, chosen % num_b)
+    # Pair number k of row i (with i < j) is k = i * n - i * (i + 1) / 2
+    # + (j - i - 1), so rows are found by searching the row starts.
+    row = np.arange(num_a)
+    row_starts = row * num_a - row * (row + 1) // 2
+    rows = np.searchsorted(row_starts, chosen, side = "right") - 1
+    columns = chosen - row_starts[rows] + rows + 1
+    return (rows, columns)
+
+def pairwise_ibd(ibd_detector, nodes_a, nodes_b = None, processes = 1,
+                 tile_size = DEFAULT_TILE_SIZE, sparse = False,
+                 sample = None, seed = None, progress = None):
+    """
+    IBD in centimorgans measured by ibd_detector (a
+    SharedSegmentDetector) between every node of nodes_a and every
+    node of nodes_b. Without nodes_b, the pairs of distinct nodes of
+    nodes_a are compared.
+
+    Returns a len(nodes_a) x len(nodes_b) matrix, which is a dense
+    array, or a scipy CSR matrix of the nonzero values if sparse is
+    True. Without nodes_b the matrix is symmetric with a zero diagonal.
+
+    If sample is given, only that many pairs, drawn uniformly with
+    seed, are compared, and (rows, columns, lengths) arrays of the
+    sampled pairs are returned instead of a matrix.
+
+    progress is called with the number of pairs done and the total
+    number of pairs after each tile.
+    """
+    symmetric = nodes_b is None
+    nodes_a = list(nodes_a)
+    nodes_b = nodes_a if symmetric else list(nodes_b)
+    if symmetric:
+        nodes = nodes_a
+        offset_b = 0
+    else:
+        nodes = nodes_a + nodes_b
+        offset_b = len(nodes_a)
+    genomes = [node.genome for node in nodes]
+    num_a = len(nodes_a)
+    num_b = len(nodes_b)
+
+    if sample is None:
+        tasks = _tiles(num_a, num_b, symmetric, tile_size)
+        if symmetric:
+            total = num_a * (num_a - 1) // 2
+        else:
+            total = num_a * num_b
+    else:
+        rows, columns = _sample_pairs(num_a, num_b, symmetric, sample, seed)
+        tile_pairs = tile_size * tile_size
+        tasks = [(rows[i:i + tile_pairs], columns[i:i + tile_pairs])
+                 for i in range(0, len(rows), tile_pairs)]
+        total = len(rows)
+
+    # Tiles are written to the output as they complete. Only the
+    # nonzero entries of a sparse result are kept.
+    if sample is not None or sparse:
+        results = []
+    else:
+        matrix = np.zeros((num_a, num_b), dtype = np.float64)
+    done = 0
+    def collect(task_lengths):
+        nonlocal done
+        for task, lengths in task_lengths:
+            rows, columns = _task_pairs(task, symmetric)
+            if sample is not None:
+                results.append((rows, columns, lengths))
+            elif sparse:
+                nonzero = np.flatnonzero(lengths)
+                results.append((rows[nonzero], columns[nonzero],
+                                lengths[nonzero]))
+            else:
+                matrix[rows, columns] = lengths
+                if symmetric:
+                    matrix[columns, rows] = lengths
+            done += len(rows)
+            if progress is not None:
+                progress(done, total)
+
+    signatures = _signatures(nodes, genomes)
+    if processes <= 1 or total == 0:
+        state = (genomes, signatures, ibd_detector, symmetric, offset_b)
+        collect(_tile_lengths(state, task) for task in tasks)
+    else:
+        memory = []
+        try:
+            table = _pack_genomes(genomes) + (signatures.ravel(),)
+            shared_table = [share_array(array, memory) for array in table]
+            end = genomes[0].mother.end
+            with Pool(processes, _init_pairwise_worker,
+                      (shared_table, end, ibd_detector, symmetric,
+                       offset_b)) as pool:
+                collect(pool.imap(_pairwise_worker_tile, tasks))
+        finally:
+            for block in memory:
+                block.close()
+                block.unlink()
+
+    if sample is None and not sparse:
+        return matrix
+    if len(results) > 0:
+        rows, columns, lengths = (np.concatenate(column)
+                                  for column in zip(*results))
+    else:
+        rows = columns = np.empty(0, dtype = np.int64)
+        lengths = np.empty(0, dtype = np.float64)
+    if sample is not None:
+        return (rows, columns, lengths)
+    if symmetric:
+        rows, columns = (np.concatenate((rows, columns)),
+                         np.concatenate((columns, rows)))
+        lengths = np.concatenate((lengths, lengths))
+    return coo_matrix((lengths, (rows, columns)),
+                      shape = (num_a, num_b)).tocsr()
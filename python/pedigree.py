@@ -0,0 +1,412 @@
+import numpy as np
+
+# Sentinel stored in the id columns when a parent or twin is unknown.
+NO_NODE = -1
+NODE_ID_DTYPE = np.int32
+SEX_DTYPE = np.uint8
+GENERATION_DTYPE = np.int16
+
+_INITIAL_CAPACITY = 1024
+_ID_COLUMNS = ("father", "mother", "suspected_father", "suspected_mother",
+               "twin")
+
+class PedigreeArrays:
+    """
+    Columnar storage for the pedigree. Every person is a row indexed
+    by their node id, and relationships are stored as node ids in
+    contiguous numpy arrays rather than as references between python
+    objects. Unknown relationships are stored as NO_NODE.
+
+    Columns grow geometrically as rows are added, so appending is
+    amortized constant time. The column properties return views of
+    the filled portion of each array.
+    """
+    def __init__(self, capacity = _INITIAL_CAPACITY):
+        capacity = max(int(capacity), 1)
+        self._size = 0
+        self._father = np.full(capacity, NO_NODE, dtype = NODE_ID_DTYPE)
+        self._mother = np.full(capacity, NO_NODE, dtype = NODE_ID_DTYPE)
+        self._suspected_father = np.full(capacity, NO_NODE,
+                                         dtype = NODE_ID_DTYPE)
+        self._suspected_mother = np.full(capacity, NO_NODE,
+                                         dtype = NODE_ID_DTYPE)
+        self._twin = np.full(capacity, NO_NODE, dtype = NODE_ID_DTYPE)
+        self._sex = np.zeros(capacity, dtype = SEX_DTYPE)
+        self._generation = np.zeros(capacity, dtype = GENERATION_DTYPE)
+        # Child indexes are derived from the parent columns. They are
+        # set to None whenever the columns change and rebuilt on the
+        # next query.
+        self._child_index = None
+        self._suspected_child_index = None
+        # Ids of nodes whose true or suspected parents were changed,
+        # so the genomes of their descendants can be regenerated.
+        self._edited = set()
+        self._suspected_edited = set()
+
+    @classmethod
+    def from_columns(cls, columns, size = None):
+        """
+        Wrap existing column arrays (eg. memory mapped from a
+        population file) without copying them. columns is a dict from
+        column name to array. If size is given, only the first size
+        rows are in use and the rest of the arrays is free capacity.
+        The arrays are only copied if they run out of capacity.
+        """
+        pedigree = cls(1)
+        if size is None:
+            size = len(columns["father"])
+        pedigree._size = size
+        for name, column in columns.items():
+            setattr(pedigree, "_" + name, column)
+        return pedigree
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._father)
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the column arrays.
+        """
+        return sum(getattr(self, "_" + name).nbytes
+                   for name in _ID_COLUMNS + ("sex", "generation"))
+
+    def _reserve(self, size):
+        capacity = self.capacity
+        if size <= capacity:
+            return
+        capacity = max(capacity, 1)
+        while capacity < size:
+            capacity *= 2
+        for name in _ID_COLUMNS:
+            self._grow_column("_" + name, capacity, NO_NODE)
+        self._grow_column("_sex", capacity, 0)
+        self._grow_column("_generation", capacity, 0)
+
+    def _grow_column(self, attribute, capacity, fill):
+        old = getattr(self, attribute)
+        new = np.full(capacity, fill, dtype = old.dtype)
+        new[:self._size] = old[:self._size]
+        setattr(self, attribute, new)
+
+    def add(self, father = NO_NODE, mother = NO_NODE,
+            suspected_father = NO_NODE, suspected_mother = NO_NODE,
+            sex = 0, generation = 0, twin = NO_NODE):
+        """
+        Append a row to the pedigree and return its node id.
+        """
+        node_id = self._size
+        self._reserve(node_id + 1)
+        self._father[node_id] = father
+        self._mother[node_id] = mother
+        self._suspected_father[node_id] = suspected_father
+        self._suspected_mother[node_id] = suspected_mother
+        self._twin[node_id] = twin
+        self._sex[node_id] = sex
+        self._generation[node_id] = generation
+        self._size += 1
+        self._child_index = None
+        self._suspected_child_index = None
+        return node_id
+
+    def add_many(self, father, mother, suspected_father = None,
+                 suspected_mother = None, sex = 0, generation = 0,
+                 twin = NO_NODE):
+        """
+        Append len(father) rows to the pedigree in one step and return
+        their node ids. Arguments are arrays, or scalars that are
+        broadcast to every new row. Suspected parents default to the
+        true parents.
+        """
+        count = len(father)
+        if suspected_father is None:
+            suspected_father = father
+        if suspected_mother is None:
+            suspected_mother = mother
+        start = self._size
+        stop = start + count
+        self._reserve(stop)
+        self._father[start:stop] = father
+        self._mother[start:stop] = mother
+        self._suspected_father[start:stop] = suspected_father
+        self._suspected_mother[start:stop] = suspected_mother
+        self._twin[start:stop] = twin
+        self._sex[start:stop] = sex
+        self._generation[start:stop] = generation
+        self._size = stop
+        self._child_index = None
+        self._suspected_child_index = None
+        return np.arange(start, stop, dtype = NODE_ID_DTYPE)
+
+    def set_twins(self, node_ids, twin_ids):
+        """
+        Mark node_ids and twin_ids as twins of each other.
+        """
+        self._twin[np.asarray(node_ids)] = twin_ids
+        self._twin[np.asarray(twin_ids)] = node_ids
+
+    @property
+    def father(self):
+        return self._father[:self._size]
+
+    @property
+    def mother(self):
+        return self._mother[:self._size]
+
+    @property
+    def suspected_father(self):
+        return self._suspected_father[:self._size]
+
+    @property
+    def suspected_mother(self):
+        return self._suspected_mother[:self._size]
+
+    @property
+    def twin(self):
+        return self._twin[:self._size]
+
+    @property
+    def sex(self):
+        return self._sex[:self._size]
+
+    @property
+    def generation(self):
+        return self._generation[:self._size]
+
+    def set_twin(self, node_id, twin_id):
+        self._twin[node_id] = twin_id
+
+    def set_suspected_father(self, node_id, father_id):
+        self._suspected_father[node_id] = father_id
+        self._suspected_child_index = None
+        self._suspected_edited.add(int(node_id))
+
+    def set_suspected_mother(self, node_id, mother_id):
+        self._suspected_mother[node_id] = mother_id
+        self._suspected_child_index = None
+        self._suspected_edited.add(int(node_id))
+
+    def set_suspected_parents(self, node_ids, father_ids = None,
+                              mother_ids = None):
+        """
+        Batched re-parenting. Sets the suspected father and/or mother
+        of every node in node_ids. The suspected child index is
+        rebuilt once, when it is next queried.
+        """
+        node_ids = np.asarray(node_ids, dtype = NODE_ID_DTYPE)
+        if father_ids is not None:
+            self.suspected_father[node_ids] = father_ids
+        if mother_ids is not None:
+            self.suspected_mother[node_ids] = mother_ids
+        self._suspected_child_index = None
+        self._suspected_edited.update(node_ids.tolist())
+
+    def set_parents(self, node_ids, father_ids = None, mother_ids = None):
+        """
+        Batched re-parenting in the true genealogy. Sets the father
+        and/or mother of every node in node_ids. Suspected parents are
+        left alone.
+        """
+        node_ids = np.asarray(node_ids, dtype = NODE_ID_DTYPE)
+        if father_ids is not None:
+            self.father[node_ids] = father_ids
+        if mother_ids is not None:
+            self.mother[node_ids] = mother_ids
+        self._child_index = None
+        self._edited.update(node_ids.tolist())
+
+    def suspected_overlay(self):
+        """
+        Returns the current suspected genealogy as a SuspectedOverlay.
+        """
+        return SuspectedOverlay.from_pedigree(self)
+
+    def apply_overlay(self, overlay):
+        """
+        Replace the suspected parent columns with the true parents
+        plus the rows stored in overlay.
+        """
+        old_father = self.suspected_father.copy()
+        old_mother = self.suspected_mother.copy()
+        self.suspected_father[:] = self.father
+        self.suspected_mother[:] = self.mother
+        self.suspected_father[overlay.node_ids] = overlay.suspected_father
+        self.suspected_mother[overlay.node_ids] = overlay.suspected_mother
+        self._suspected_child_index = None
+        changed = np.flatnonzero((old_father != self.suspected_father)
+                                 | (old_mother != self.suspected_mother))
+        self._suspected_edited.update(changed.tolist())
+
+    def take_edited_ids(self, suspected = False):
+        """
+        Returns a sorted array with the ids of the nodes whose true (or
+        suspected) parents were changed since the last call, and clears
+        that list.
+        """
+        if suspected:
+            edited = self._suspected_edited
+            self._suspected_edited = set()
+        else:
+            edited = self._edited
+            self._edited = set()
+        return np.array(sorted(edited), dtype = NODE_ID_DTYPE)
+
+    def child_index(self, suspected = False):
+        """
+        Returns the ChildIndex for the true or suspected genealogy,
+        building it if the pedigree has changed since it was last
+        built.
+        """
+        if suspected:
+            if self._suspected_child_index is None:
+                self._suspected_child_index = ChildIndex.from_parents(
+                    self.suspected_father, self.suspected_mother)
+            return self._suspected_child_index
+        if self._child_index is None:
+            self._child_index = ChildIndex.from_parents(self.father,
+                                                        self.mother)
+        return self._child_index
+
+    def children(self, node_id):
+        """
+        Returns the node ids of the true children of node_id.
+        """
+        return self.child_index(False).children(node_id)
+
+    def suspected_children(self, node_id):
+        """
+        Returns the node ids of the suspected children of node_id.
+        """
+        return self.child_index(True).children(node_id)
+
+    def sibling_ids(self, node_id, suspected = False):
+        """
+        Returns the ids of node_id and its full siblings, or None if
+        either parent is unknown.
+        """
+        if suspected:
+            father = self._suspected_father[node_id]
+            mother = self._suspected_mother[node_id]
+        else:
+            father = self._father[node_id]
+            mother = self._mother[node_id]
+        if father == NO_NODE or mother == NO_NODE:
+            return None
+        index = self.child_index(suspected)
+        return np.intersect1d(index.children(father), index.children(mother),
+                              assume_unique = True)
+
+    def rebuild_suspected_children(self):
+        """
+        Invalidate the suspected ChildIndex. It is rebuilt from the
+        suspected parent columns on the next child_index(True) call.
+        """
+        self._suspected_child_index = None
+
+    def descendant_ids(self, node_ids, suspected = False):
+        """
+        Returns a sorted array with node_ids and all of their
+        descendants.
+        """
+        index = self.child_index(suspected)
+        frontier = np.unique(np.asarray(node_ids, dtype = NODE_ID_DTYPE))
+        found = [frontier]
+        while len(frontier) > 0:
+            frontier = np.unique(index.children_of_many(frontier))
+            found.append(frontier)
+        return np.unique(np.concatenate(found))
+
+    def __getstate__(self):
+        # Only pickle the filled portion of the columns. Child indexes
+        # are derived data and are rebuilt on demand.
+        state = {name: getattr(self, name).copy()
+                 for name in _ID_COLUMNS + ("sex", "generation")}
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(len(state["father"]))
+        self._size = len(state["father"])
+        for name, column in state.items():
+            getattr(self, "_" + name)[:self._size] = column
+
+class SuspectedOverlay:
+    """
+    A suspected genealogy stored relative to the true pedigree. Only
+    the rows where the suspected father or mother differs from the
+    true parent are stored, so an overlay for a population with a few
+    percent of errors is small compared to the full columns.
+    """
+    def __init__(self, node_ids, suspected_father, suspected_mother):
+        self.node_ids = np.asarray(node_ids, dtype = NODE_ID_DTYPE)
+        self.suspected_father = np.asarray(suspected_father,
+                                           dtype = NODE_ID_DTYPE)
+        self.suspected_mother = np.asarray(suspected_mother,
+                                           dtype = NODE_ID_DTYPE)
+
+    @classmethod
+    def from_pedigree(cls, pedigree):
+        node_ids = np.flatnonzero((pedigree.suspected_father != pedigree.father)
+                                  | (pedigree.suspected_mother != pedigree.mother))
+        return cls(node_ids, pedigree.suspected_father[node_ids],
+                   pedigree.suspected_mother[node_ids])
+
+    def __len__(self):
+        return len(self.node_ids)
+
+class ChildIndex:
+    """
+    Compressed sparse row index from parent id to child ids. The
+    children of node i are children[indptr[i]:indptr[i + 1]], in
+    ascending id order.
+    """
+    def __init__(self, indptr, children):
+        self.indptr = indptr
+        self.children_ids = children
+
+    @classmethod
+    def from_parents(cls, *parent_columns):
+        """
+        Build the index in one vectorized pass from parent id columns,
+        where parent_column[child_id] is the parent of child_id or
+        NO_NODE.
+        """
+        num_nodes = len(parent_columns[0])
+        parents = np.concatenate(parent_columns)
+        child_ids = np.tile(np.arange(num_nodes, dtype = NODE_ID_DTYPE),
+                            len(parent_columns))
+        known = parents != NO_NODE
+        parents = parents[known]
+        child_ids = child_ids[known]
+        # A stable sort keeps the children of each parent in id order.
+        order = np.argsort(parents, kind = "stable")
+        counts = np.bincount(parents, minlength = num_nodes)
+        indptr = np.zeros(num_nodes + 1, dtype = np.int64)
+        np.cumsum(counts, out = indptr[1:])
+        return cls(indptr, child_ids[order])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def num_children(self, node_id):
+        return int(self.indptr[node_id + 1] - self.indptr[node_id])
+
+    def children(self, node_id):
+        return self.children_ids[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    def children_of_many(self, node_ids):
+        """
+        Returns the concatenated children of all of node_ids.
+        """
+        starts = self.indptr[node_ids]
+        counts = self.indptr[np.asarray(node_ids) + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype = NODE_ID_DTYPE)
+        # Offset of each output element within its parent's slice.
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts,
+                                               counts)
+        return self.children_ids[np.repeat(starts, counts) + offsets]
@@ -1,30 +1,37 @@
-from random import shuffle, uniform, choice, sample
 from itertools import chain
-from types import GeneratorType
 from pickle import Unpickler
 
+import numpy as np
+
 from generation import Generation
-from sex import Sex
+from node import NodeGenerator, LegacyNode
+from island_model import IslandIndex
+from pedigree import PedigreeArrays, SuspectedOverlay, NO_NODE
+from sex import Sex, SEXES
 
 class Population:
     def __init__(self, initial_generation = None):
         self._generations = []
         self._kinship_coefficients = None
-        self._node_to_generation = (None, -1)
         # The last n generations with genomes defined
         self._generations_with_genomes = None
         if initial_generation is not None:
             self._generations.append(initial_generation)
 
+    @property
+    def node_generator(self):
+        """
+        Returns the NodeGenerator shared by all members.
+        """
+        return self._generations[0].node_generator
+
     @property
     def id_mapping(self):
         """
         Returns the node_id -> node mapping.
         Assumes all nodes use the same mapping
         """
-        # Return any nodes mapping, because they should all share the
-        # same mapping
-        return self._generations[0].members[0].mapping
+        return self.node_generator.mapping
         
 
     @property
@@ -46,24 +53,89 @@ class Population:
         Maps nodes in this population to their generation.
         Higher numbered generations are more recent.
         """
-        # Cache the results of this function so it only needs to be
-        # computed when new generations are added.
-        cached = self._node_to_generation
-        if cached[0] is not None and cached[1] == len(self._generations):
-            return cached[0]        
-        generations = [generation.members for generation in self._generations]
-        node_to_generation = dict()
-        for generation_num, members in enumerate(generations):
-            for node in members:
-                node_to_generation[node] = generation_num
-        self._node_to_generation = (node_to_generation, len(self._generations))
-        return node_to_generation
+        return NodeGenerationMap(self.node_generator.pedigree)
+
+    def error_scenario(self, non_paternity_rate = 0, adoption_rate = 0,
+                       unknown_mother_rate = 0, unknown_father_rate = 0,
+                       seed = None):
+        """
+        Draw a new set of pedigree errors for the existing population,
+        with the same semantics as the rates of new_generation. The
+        population itself is not changed; the scenario is returned as
+        a SuspectedOverlay that can be applied with apply_overlay.
+        Twins get the same suspected parents as their sibling.
+        """
+        rng = np.random.default_rng(seed)
+        pedigree = self.node_generator.pedigree
+        scenario_ids = []
+        scenario_fathers = []
+        scenario_mothers = []
+        for generation_number in range(1, len(self._generations)):
+            ids = self._generations[generation_number].ids
+            twins = pedigree.twin[ids]
+            # The twin with the larger id copies its sibling.
+            is_copy = (twins != NO_NODE) & (twins < ids)
+            children = ids[~is_copy]
+            fathers = pedigree.father[children]
+            mothers = pedigree.mother[children]
+            suspected = _suspected_parents(rng,
+                                           self._parent_index(generation_number),
+                                           fathers, mothers,
+                                           self._birth_islands(fathers, mothers),
+                                           non_paternity_rate, adoption_rate,
+                                           unknown_mother_rate,
+                                           unknown_father_rate)
+            copies = ids[is_copy]
+            order = np.argsort(children)
+            template_positions = order[np.searchsorted(children, twins[is_copy],
+                                                       sorter = order)]
+            scenario_ids.extend([children, copies])
+            scenario_fathers.extend([suspected[0],
+                                     suspected[0][template_positions]])
+            scenario_mothers.extend([suspected[1],
+                                     suspected[1][template_positions]])
+        if len(scenario_ids) == 0:
+            return SuspectedOverlay([], [], [])
+        node_ids = np.concatenate(scenario_ids)
+        fathers = np.concatenate(scenario_fathers)
+        mothers = np.concatenate(scenario_mothers)
+        changed = ((fathers != pedigree.father[node_ids])
+                   | (mothers != pedigree.mother[node_ids]))
+        return SuspectedOverlay(node_ids[changed], fathers[changed],
+                                mothers[changed])
+
+    def _parent_index(self, generation_number):
+        """
+        Returns an IslandIndex of the parents of generation
+        generation_number, which wrong suspected parents are drawn
+        from. Without islands every parent is on island 0.
+        """
+        parents = self._generations[generation_number - 1].ids
+        sexes = self.node_generator.pedigree.sex[parents]
+        return IslandIndex(parents, np.zeros(len(parents), dtype = np.int64),
+                           sexes, 1)
+
+    def _birth_islands(self, fathers, mothers):
+        return np.zeros(len(fathers), dtype = np.int64)
+
+    @property
+    def suspected_overlay(self):
+        """
+        The suspected genealogy currently applied to the population.
+        """
+        return self.node_generator.pedigree.suspected_overlay()
+
+    def apply_overlay(self, overlay):
+        """
+        Switch the suspected genealogy to overlay. Genomes are not
+        affected, so several overlays can share one set of genomes.
+        """
+        self.node_generator.pedigree.apply_overlay(overlay)
 
     def clean_genomes(self):
         for person in self.members:
             person.genome = None
 
-
     @property
     def num_generations(self):
         """
@@ -90,44 +162,59 @@ class IslandPopulation(Population):
     locality. Individuals exists on "islands", and will search for
     mates from a different island with a given switching probability.
     """
-    def __init__(self, island_model, *args, **kwargs):
+    def __init__(self, island_model, *args, seed = None, **kwargs):
         super().__init__(*args, **kwargs)
         self._island_model = island_model
+        # All random draws for mate selection and migration come from
+        # this generator, so passing a seed makes generations
+        # reproducible.
+        self._rng = np.random.default_rng(seed)
+        self._island_indexes = dict()
         # Assume existing members of the tree are a part of the founders
-        if len(island_model.individuals) > 0:
+        founder_ids = island_model.individual_ids
+        if len(founder_ids) > 0:
             assert len(self._generations) is 0
-            self._generations.append(Generation(island_model.individuals))
+            self._generations.append(Generation.from_ids(island_model._node_generator,
+                                                         founder_ids))
 
 
-    def _pick_island(self, individual):
-        current_island = self._island_model.get_island(individual)
-        if uniform(0, 1) < current_island.switch_probability:
-            candidate_islands = set(self._island_model.islands)
-            candidate_islands.remove(current_island)
-            return choice(tuple(candidate_islands))
-        return current_island
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "_rng" not in state:
+            self._rng = np.random.default_rng()
+        self._island_indexes = dict()
 
-    def _island_members(self, generation_members):
+    def island_index(self, generation_number = -1):
         """
-        Returns a dictionary mapping islands to sets of individuals
-        from generation_members.
+        Returns the IslandIndex of the given generation, which groups
+        its members by island and sex. Indexes are cached until the
+        generation migrates.
         """
-        if isinstance(generation_members, GeneratorType):
-            generation_members = list(generation_members)
-        members = dict()
-        for leaf in self._island_model.islands:
-            m = leaf.individuals.intersection(generation_members)
-            members[leaf] = m
-        return members
+        generation_number %= len(self._generations)
+        if generation_number not in self._island_indexes:
+            generation = self._generations[generation_number]
+            pedigree = generation.node_generator.pedigree
+            index = self._island_model.island_index(generation.ids,
+                                                    pedigree.sex[generation.ids])
+            self._island_indexes[generation_number] = index
+        return self._island_indexes[generation_number]
+
+    def _parent_index(self, generation_number):
+        return self.island_index(generation_number - 1)
+
+    def _birth_islands(self, fathers, mothers):
+        # Each generation migrates once, just before choosing mates,
+        # so a parent's current island is the island their children
+        # were born on.
+        parents = np.where(fathers != NO_NODE, fathers, mothers)
+        return self._island_model.island_ids(parents).astype(np.int64)
 
     def migrate_generation(self, generation):
         """
         Cause all members of the population to migrate.
         """
-        for member in generation.members:
-            island = self._pick_island(member)
-            self._island_model.move_individual(member, island)
-            
+        self._island_model.migrate(generation.ids, self._rng)
+        self._island_indexes = dict()
 
     def new_generation(self, node_generator, size = None,
                        non_paternity_rate = 0, adoption_rate = 0,
@@ -137,136 +224,158 @@ class IslandPopulation(Population):
         Generates a new generation of individuals from the previous
         generation. If size is not passed, the new generation will be
         the same size as the previous generation.
+
+        All parent pairs are drawn at once for the whole generation,
+        and the children are added to the pedigree in bulk.
         """
         assert 0.0 <= monogamy_rate <= 1.0
         if size is None:
             size = self._generations[-1].size
-        self.migrate_generation(self._generations[-1])
-        previous_generation = set(self._generations[-1].members)
-
-        monogamous_map = dict()
-        random_map = dict()
-        for island in self._island_model.islands:
-            members = list(previous_generation.intersection(island.individuals))
-            shuffle(members)
-            men = [x for x in members if x.sex == Sex.Male]
-            women = [x for x in members if x.sex == Sex.Female]
-
+        rng = self._rng
+        pedigree = node_generator.pedigree
+        islands = self._island_model.islands
+        previous_generation = self._generations[-1]
+        self.migrate_generation(previous_generation)
+
+        # Parents are referred to by their position in the island
+        # index of the previous generation, which groups them by
+        # island and sex.
+        index = self.island_index(-1)
+        parent_ids = index.ids
+        parent_islands = index.island_ids
+        parent_sexes = index.sexes
+        male = Sex.Male.value
+
+        # partner holds the position of the monogamous partner of each
+        # parent, or NO_NODE. Non-monogamous parents of each island
+        # and sex form a pool of candidate mates, stored concatenated
+        # and keyed by 2 * island + sex.
+        partner = np.full(len(parent_ids), NO_NODE, dtype = np.int64)
+        pools = []
+        for island_i in range(len(islands)):
+            men = rng.permutation(index.positions(island_i, Sex.Male))
+            women = rng.permutation(index.positions(island_i, Sex.Female))
             monogamy_cutoff = min(int(monogamy_rate * len(men)),
                                   int(monogamy_rate * len(women)))
-            monogamous_men = men[:monogamy_cutoff]
-            non_monogamous_men = men[monogamy_cutoff:]
-
+            partner[men[:monogamy_cutoff]] = women[:monogamy_cutoff]
+            partner[women[:monogamy_cutoff]] = men[:monogamy_cutoff]
+            pool_by_sex = {Sex.Male: men[monogamy_cutoff:],
+                           Sex.Female: women[monogamy_cutoff:]}
+            pools.extend(pool_by_sex[sex] for sex in SEXES)
+        pool_sizes = np.array([len(pool) for pool in pools], dtype = np.int64)
+        pool_starts = np.cumsum(pool_sizes) - pool_sizes
+        pool_members = np.concatenate(pools)
+
+        # Parents without a monogamous partner or any candidate mates
+        # can't have children.
+        mate_pool = 2 * parent_islands + (1 - parent_sexes)
+        eligible = np.flatnonzero((partner != NO_NODE)
+                                  | (pool_sizes[mate_pool] > 0))
+        if len(eligible) == 0:
+            raise ValueError("No individuals in the previous generation can find a mate.")
 
-            monogamous_women = women[:monogamy_cutoff]
-            non_monogamous_women = women[monogamy_cutoff:]
-
-            for male, female in zip(monogamous_men, monogamous_women):
-                monogamous_map[male] = female
-                monogamous_map[female] = male
-
-            for male in non_monogamous_men:
-                random_map[male] = non_monogamous_women
-
-            for female in non_monogamous_women:
-                random_map[female] = non_monogamous_men
-
-        new_nodes = []
         num_twins = int(0.003 * size)
-        pre_twins_size = size - num_twins
-        previous_generation_list = list(previous_generation)
-        while len(new_nodes) < pre_twins_size:
-            parent_a = choice(previous_generation_list)
-            if parent_a in monogamous_map:
-                parent_b = monogamous_map[parent_a]
-            else:
-                candidate_parents = random_map[parent_a]
-                if len(candidate_parents) == 0:
-                    continue
-                parent_b = choice(candidate_parents)
-
-            father, mother = _sort_sex(parent_a, parent_b)
-            child = node_generator.generate_node(father, mother)
-            island = self._island_model.get_island(father)
-            self._island_model.add_individual(island, child)
-            new_nodes.append(child)
-        
-        apportioned = apportion(new_nodes, non_paternity_rate, adoption_rate)
-        non_paternity, adopted = apportioned
-        already_error = non_paternity.union(adopted)
-        no_error = list(set(new_nodes) - already_error)
-
-        # We don't use apportion here, because they are not mutually exclusive
-        unknown_mother = sample(no_error,
-                                int(unknown_mother_rate * len(new_nodes)))
-        unknown_father = sample(no_error,
-                                int(unknown_father_rate * len(new_nodes)))
-        for node in unknown_mother:
-            node.set_suspected_mother(None)
-        for node in unknown_father:
-            node.set_suspected_father(None)
-
-        men_by_island = self._island_members(self._generations[-1].men)
-        men_by_island = {island: list(men) for island, men
-                         in men_by_island.items()}
-        for node in non_paternity:
-            child_island = self._island_model.get_island(node)
-            suspected_father = choice(men_by_island[child_island])
-            node.set_suspected_father(suspected_father)
-
-        women_by_island = self._island_members(self._generations[-1].women)
-        women_by_island = {island: list(women) for island, women
-                           in women_by_island.items()}
-        for node in adopted:
-            child_island = self._island_model.get_island(node)
-            suspected_father = choice(men_by_island[child_island])
-            node.set_suspected_father(suspected_father)
-            suspected_mother = choice(women_by_island[child_island])
-            node.set_suspected_mother(suspected_mother)
+        num_children = size - num_twins
+        parent_a = eligible[rng.integers(len(eligible), size = num_children)]
+        parent_b = partner[parent_a]
+        random_mate = np.flatnonzero(parent_b == NO_NODE)
+        random_pools = mate_pool[parent_a[random_mate]]
+        offsets = rng.integers(pool_sizes[random_pools])
+        parent_b[random_mate] = pool_members[pool_starts[random_pools]
+                                             + offsets]
+        a_is_father = parent_sexes[parent_a] == male
+        father_positions = np.where(a_is_father, parent_a, parent_b)
+        mother_positions = np.where(a_is_father, parent_b, parent_a)
+        fathers = parent_ids[father_positions]
+        mothers = parent_ids[mother_positions]
+        sexes = rng.integers(len(SEXES), size = num_children)
+        generations = np.maximum(pedigree.generation[fathers],
+                                 pedigree.generation[mothers]) + 1
+        # Children live on the island of their father.
+        child_islands = parent_islands[father_positions]
+
+        suspected_fathers, suspected_mothers = _suspected_parents(
+            rng, index, fathers, mothers, child_islands, non_paternity_rate,
+            adoption_rate, unknown_mother_rate, unknown_father_rate)
+
+        child_ids = pedigree.add_many(fathers, mothers, suspected_fathers,
+                                      suspected_mothers, sexes, generations)
 
         # Generate twins. Twins will essentially be copies of their sibling
-        for template_node in sample(new_nodes, num_twins):
-            twin = node_generator.twin_node(template_node)
-            island = self._island_model.get_island(template_node)
-            self._island_model.add_individual(island, twin)
-            new_nodes.append(twin)
+        templates = rng.choice(num_children, num_twins, replace = False)
+        twin_ids = pedigree.add_many(fathers[templates], mothers[templates],
+                                     suspected_fathers[templates],
+                                     suspected_mothers[templates],
+                                     sexes[templates], generations[templates])
+        pedigree.set_twins(child_ids[templates], twin_ids)
 
+        new_ids = np.concatenate([child_ids, twin_ids])
+        new_islands = np.concatenate([child_islands, child_islands[templates]])
+        self._island_model.assign_islands(new_ids, new_islands)
 
-                
         SIZE_ERROR = "Generation generated is not correct size. Expected {}, got {}."
-        assert len(new_nodes) == size, SIZE_ERROR.format(size, len(new_nodes))
-        self._generations.append(Generation(new_nodes))
+        assert len(new_ids) == size, SIZE_ERROR.format(size, len(new_ids))
+        self._generations.append(Generation.from_ids(node_generator, new_ids))
 
     @property
     def island_tree(self):
         return self._island_tree
 
-def apportion(original, *rates):
-    remainder = list(original)
-    assigned = set()
-    length = len(original)
-    subsets = []
-    for rate in rates:
-        assert int(length * rate) < len(remainder)
-        if rate == 0:
-            current_group = set()
-        else:
-            current_group = set(sample(remainder, int(length * rate)))
-        assigned.update(current_group)
-        subsets.append(current_group)
-        if 0 < len(current_group):
-            remainder = [node for node in original if node not in assigned]
-        
-    return tuple(subsets)
-
-def _sort_sex(a, b):
-    if a.sex == Sex.Male:
-        assert b.sex == Sex.Female
-        return (a, b)
-    else:
-        assert b.sex == Sex.Male
-        return (b, a)
-        
+def _suspected_parents(rng, parent_index, fathers, mothers, child_islands,
+                       non_paternity_rate = 0, adoption_rate = 0,
+                       unknown_mother_rate = 0, unknown_father_rate = 0):
+    """
+    Draw the suspected parents of a batch of children. parent_index is
+    the IslandIndex of the parents' generation, and child_islands are
+    the islands the children were born on. Returns arrays of suspected
+    fathers and mothers.
+    """
+    num_children = len(fathers)
+    # Non-paternity and adoption are mutually exclusive, unknown
+    # parents are only assigned to children without either error.
+    num_non_paternity = int(non_paternity_rate * num_children)
+    num_adopted = int(adoption_rate * num_children)
+    assert num_non_paternity < num_children
+    assert num_non_paternity + num_adopted < num_children
+    order = rng.permutation(num_children)
+    non_paternity = order[:num_non_paternity]
+    adopted = order[num_non_paternity:num_non_paternity + num_adopted]
+    no_error = order[num_non_paternity + num_adopted:]
+
+    suspected_fathers = np.array(fathers)
+    suspected_mothers = np.array(mothers)
+    unknown_mother = rng.choice(no_error,
+                                int(unknown_mother_rate * num_children),
+                                replace = False)
+    unknown_father = rng.choice(no_error,
+                                int(unknown_father_rate * num_children),
+                                replace = False)
+    suspected_mothers[unknown_mother] = NO_NODE
+    suspected_fathers[unknown_father] = NO_NODE
+
+    # Wrong suspected parents are picked from the previous
+    # generation on the child's island.
+    misattributed = np.concatenate([non_paternity, adopted])
+    suspected_fathers[misattributed] = parent_index.sample(rng,
+                                                           child_islands[misattributed],
+                                                           Sex.Male)
+    suspected_mothers[adopted] = parent_index.sample(rng, child_islands[adopted],
+                                                     Sex.Female)
+    return (suspected_fathers, suspected_mothers)
+
+class NodeGenerationMap:
+    """
+    Maps nodes to their generation number using the generation column
+    of the pedigree.
+    """
+    def __init__(self, pedigree):
+        self._pedigree = pedigree
+
+    def __getitem__(self, node):
+        return int(self._pedigree.generation[node._id])
+
+    def __contains__(self, node):
+        return 0 <= node._id < len(self._pedigree)
 
 def fix_twin_parents(population):
     """
@@ -275,19 +384,79 @@ def fix_twin_parents(population):
     of suspected children. This didn't impact performance, as the
     children property is mostly for easy of analysis and debugging.
 
-    This method sets all members suspected children list to what is
-    indicated by each nodes suspected mother/father property.
+    Suspected children are now derived from the suspected parent
+    columns of the pedigree, so this only forces the suspected child
+    index to be rebuilt on its next use.
     """
-    for member in population.members:
-        member._suspected_children = []
-        member.set_suspected_mother(member.suspected_mother)
-        member.set_suspected_father(member.suspected_father)
+    population.node_generator.pedigree.rebuild_suspected_children()
                     
 
 class PopulationUnpickler(Unpickler):
-    
+    """
+    Unpickler for populations. Populations pickled before the pedigree
+    was stored in PedigreeArrays contain Node objects that reference
+    each other. These are loaded as LegacyNode objects and converted.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._legacy = False
+
+    def find_class(self, module, name):
+        # Current pickles never reference the Node class directly, see
+        # Node.__reduce__
+        if module == "node" and name == "Node":
+            self._legacy = True
+            return LegacyNode
+        return super().find_class(module, name)
+
     def load(self):
         result = super().load()
-        for member in result.members:
-            member._resolve_parents()
+        if self._legacy:
+            _convert_legacy_population(result)
         return result
+
+def _legacy_id(node_id):
+    if node_id is None:
+        return NO_NODE
+    return node_id
+
+def _convert_legacy_population(population):
+    """
+    Replace the LegacyNode objects in an unpickled population with
+    views of a new NodeGenerator.
+    """
+    generations = population._generations
+    legacy_generator = generations[0]._legacy_members[0]._node_generator
+    legacy_mapping = legacy_generator.__dict__["_mapping"]
+    num_nodes = max(legacy_mapping) + 1
+    generation_of = np.zeros(num_nodes, dtype = np.int64)
+    for generation_num, generation in enumerate(generations):
+        for member in generation._legacy_members:
+            generation_of[member._id] = generation_num
+
+    pedigree = PedigreeArrays(num_nodes)
+    for node_id in range(num_nodes):
+        legacy = legacy_mapping[node_id]
+        pedigree.add(_legacy_id(legacy._father_id),
+                     _legacy_id(legacy._mother_id),
+                     _legacy_id(legacy._suspected_father_id),
+                     _legacy_id(legacy._suspected_mother_id),
+                     legacy.sex.value, generation_of[node_id],
+                     _legacy_id(legacy._twin_id))
+
+    node_generator = NodeGenerator(pedigree)
+    for node_id, legacy in legacy_mapping.items():
+        if legacy.__dict__.get("genome") is not None:
+            node_generator._genomes[node_id] = legacy.genome
+        if legacy.__dict__.get("_suspected_genome") is not None:
+            node_generator._suspected_genomes[node_id] = legacy._suspected_genome
+
+    for i, generation in enumerate(generations):
+        ids = [member._id for member in generation._legacy_members]
+        generations[i] = Generation.from_ids(node_generator, ids)
+
+    island_model = getattr(population, "_island_model", None)
+    if island_model is not None:
+        # Island membership was converted to node ids when the island
+        # model was unpickled.
+        island_model._node_generator = node_generator
@@ -0,0 +1,625 @@
+"""
+Binary population file format.
+
+A population file stores the pedigree columns, generation membership,
+island assignments and genomes as flat arrays, so the file can be
+opened with mmap instead of being unpickled. The layout is
+
+    magic (8 bytes) | version (uint32) | reserved (uint32)
+    header length (uint64) | JSON header | arrays
+
+Every array starts at an offset that is a multiple of ALIGNMENT bytes.
+The JSON header records the offset, dtype and shape of each array
+along with the scalar metadata needed to rebuild the population.
+
+Genomes are stored either as plain starts and founder arrays, or
+compressed (see genome_codec). Files with compressed genomes have
+version COMPRESSED_VERSION, so older readers reject them.
+"""
+import json
+import os
+from collections.abc import MutableMapping
+from shutil import copyfileobj
+from struct import pack, unpack
+from tempfile import TemporaryFile, mkstemp
+
+import numpy as np
+
+from generation import Generation
+from genome_codec import encode_starts, pack_codes, HaplotypeDecoder
+from genome_arena import NO_GENOME
+from island_model import IslandNode, IslandModel, ISLAND_DTYPE, NO_ISLAND
+from node import NodeGenerator
+from pedigree import PedigreeArrays, NODE_ID_DTYPE, SEX_DTYPE, GENERATION_DTYPE, NO_NODE
+from population import Population, IslandPopulation, PopulationUnpickler, fix_twin_parents
+from recomb_genome import RecombGenome
+from diploid import Diploid
+
+MAGIC = b"GTPOPUL\0"
+VERSION = 1
+COMPRESSED_VERSION = 2
+ALIGNMENT = 64
+_PREAMBLE_FORMAT = "<8sIIQ"
+_PREAMBLE_SIZE = 24
+
+_PEDIGREE_COLUMNS = ("father", "mother", "suspected_father",
+                     "suspected_mother", "twin", "sex", "generation")
+# Space reserved for the JSON header of files written by
+# PopulationFileWriter, which only knows the header once all
+# generations have been written.
+_RESERVED_HEADER_SIZE = 1 << 16
+
+class PopulationFileError(Exception):
+    pass
+
+def is_population_file(filename):
+    with open(filename, "rb") as population_file:
+        return population_file.read(len(MAGIC)) == MAGIC
+
+def save_population(population, filename, compress_genomes = False):
+    """
+    Write population to filename in the binary population format. If
+    compress_genomes is True genomes are stored compressed.
+    """
+    generator = population.node_generator
+    pedigree = generator.pedigree
+    num_nodes = len(pedigree)
+    arrays = dict()
+    for name in _PEDIGREE_COLUMNS:
+        arrays[name] = getattr(pedigree, name)
+
+    generations = population.generations
+    arrays["generation_ids"] = np.concatenate([generation.ids for generation
+                                               in generations])
+    generation_offsets = np.zeros(len(generations) + 1, dtype = np.int64)
+    np.cumsum([generation.size for generation in generations],
+              out = generation_offsets[1:])
+    arrays["generation_offsets"] = generation_offsets
+
+    header = {"num_nodes": num_nodes,
+              "population_class": type(population).__name__}
+
+    island_model = getattr(population, "_island_model", None)
+    if island_model is not None:
+        node_island = island_model.island_ids(np.arange(num_nodes))
+        arrays["island"] = node_island
+        header["islands"] = [island.switch_probability for island
+                             in island_model.islands]
+
+    genome_table = _GenomeTableBuilder()
+    arrays["genome_slot"] = genome_table.add_all(generator._genomes,
+                                                 num_nodes)
+    arrays["suspected_genome_slot"] = genome_table.add_all(generator._suspected_genomes,
+                                                           num_nodes)
+    genome_arrays = genome_table.arrays()
+    header["genome_end"] = genome_table.end
+    version = VERSION
+    if compress_genomes:
+        genome_arrays, founder_bits = _compress_arrays(genome_arrays)
+        header["founder_bits"] = founder_bits
+        version = COMPRESSED_VERSION
+    arrays.update(genome_arrays)
+    _write_arrays(filename, header, arrays, version)
+
+def load_population(filename, mmap = True):
+    """
+    Load a population from filename. Binary population files are
+    opened with mmap unless mmap is False. Pickled populations are
+    loaded with PopulationUnpickler.
+    """
+    if not is_population_file(filename):
+        with open(filename, "rb") as pickle_file:
+            population = PopulationUnpickler(pickle_file).load()
+        fix_twin_parents(population)
+        return population
+
+    header, arrays = _read_arrays(filename, mmap)
+    pedigree = PedigreeArrays.from_columns({name: arrays[name] for name
+                                            in _PEDIGREE_COLUMNS})
+    generator = NodeGenerator(pedigree)
+    if "founder_bits" in header:
+        table = CompressedGenomeTable(arrays["haplotype_offsets"],
+                                      arrays["start_bytes"],
+                                      arrays["start_byte_offsets"],
+                                      arrays["founder_codes"],
+                                      header["founder_bits"],
+                                      arrays["founder_dictionary"],
+                                      header["genome_end"])
+    else:
+        table = GenomeTable(arrays["haplotype_offsets"], arrays["starts"],
+                            arrays["founder"], header["genome_end"])
+    generator._genomes = MappedGenomes(arrays["genome_slot"], table)
+    generator._suspected_genomes = MappedGenomes(arrays["suspected_genome_slot"],
+                                                 table)
+
+    generation_ids = arrays["generation_ids"]
+    offsets = arrays["generation_offsets"].tolist()
+    generations = [Generation.from_ids(generator, generation_ids[start:stop])
+                   for start, stop in zip(offsets, offsets[1:])]
+
+    if header["population_class"] == IslandPopulation.__name__:
+        islands = [IslandNode(rate) for rate in header["islands"]]
+        island_model = IslandModel(islands, generator)
+        # Individuals are added after the population is created, as
+        # IslandPopulation treats existing individuals as founders.
+        population = IslandPopulation(island_model)
+        island_model.assign_islands(np.arange(len(pedigree)),
+                                    arrays["island"])
+    else:
+        population = Population()
+    population._generations = generations
+    return population
+
+def convert_pickle(pickle_filename, output_filename,
+                   compress_genomes = False):
+    """
+    Convert a pickled population to the binary population format.
+    """
+    with open(pickle_filename, "rb") as pickle_file:
+        population = PopulationUnpickler(pickle_file).load()
+    fix_twin_parents(population)
+    save_population(population, output_filename, compress_genomes)
+
+def compress_genomes(population):
+    """
+    Replace the genomes and suspected genomes of population with a
+    compressed copy. Genomes are decoded each time they are requested,
+    so only the compressed table stays in memory. Returns the
+    CompressedGenomeTable.
+    """
+    generator = population.node_generator
+    num_nodes = len(generator.pedigree)
+    genome_table = _GenomeTableBuilder()
+    genome_slots = genome_table.add_all(generator._genomes, num_nodes)
+    suspected_slots = genome_table.add_all(generator._suspected_genomes,
+                                           num_nodes)
+    genome_arrays, founder_bits = _compress_arrays(genome_table.arrays())
+    table = CompressedGenomeTable(genome_arrays["haplotype_offsets"],
+                                  genome_arrays["start_bytes"],
+                                  genome_arrays["start_byte_offsets"],
+                                  genome_arrays["founder_codes"],
+                                  founder_bits,
+                                  genome_arrays["founder_dictionary"],
+                                  genome_table.end)
+    generator._genomes = MappedGenomes(genome_slots, table)
+    generator._suspected_genomes = MappedGenomes(suspected_slots, table)
+    return table
+
+def _compress_arrays(genome_arrays):
+    """
+    Compress the arrays of a genome table. Returns the compressed
+    arrays and the number of bits per founder code.
+    """
+    offsets = genome_arrays["haplotype_offsets"]
+    start_bytes, start_byte_offsets = encode_starts(offsets,
+                                                    genome_arrays["starts"])
+    dictionary, codes = np.unique(genome_arrays["founder"],
+                                  return_inverse = True)
+    founder_bits = max(int(len(dictionary) - 1).bit_length(), 1)
+    founder_codes = pack_codes(codes.astype(np.uint32), founder_bits)
+    arrays = {"haplotype_offsets": offsets,
+              "start_bytes": start_bytes,
+              "start_byte_offsets": start_byte_offsets,
+              "founder_codes": founder_codes,
+              "founder_dictionary": dictionary.astype(np.uint32)}
+    return (arrays, founder_bits)
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def _write_arrays(filename, header, arrays, version = VERSION):
+    arrays = {name: np.ascontiguousarray(array)
+              for name, array in arrays.items()}
+    # Offsets are relative to the start of the data section, which
+    # begins at the first aligned offset after the header.
+    table = dict()
+    offset = 0
+    for name, array in arrays.items():
+        table[name] = {"offset": offset,
+                       "dtype": array.dtype.str,
+                       "shape": list(array.shape)}
+        offset = _aligned(offset + array.nbytes)
+    header = dict(header, arrays = table)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _aligned(_PREAMBLE_SIZE + len(header_bytes))
+    with open(filename, "wb") as population_file:
+        population_file.write(pack(_PREAMBLE_FORMAT, MAGIC, version, 0,
+                                   len(header_bytes)))
+        population_file.write(header_bytes)
+        for name, array in arrays.items():
+            population_file.seek(data_start + table[name]["offset"])
+            array.tofile(population_file)
+        # Make sure the file covers the padding of the last array.
+        population_file.truncate(data_start + offset)
+
+def _read_arrays(filename, mmap):
+    with open(filename, "rb") as population_file:
+        preamble = population_file.read(_PREAMBLE_SIZE)
+        magic, version, _, header_length = unpack(_PREAMBLE_FORMAT, preamble)
+        if magic != MAGIC:
+            raise PopulationFileError("{} is not a population file.".format(filename))
+        if version not in (VERSION, COMPRESSED_VERSION):
+            raise PopulationFileError("Unsupported population file version {}.".format(version))
+        header = json.loads(population_file.read(header_length).decode("utf-8"))
+        data_start = _aligned(_PREAMBLE_SIZE + header_length)
+        arrays = dict()
+        for name, entry in header["arrays"].items():
+            dtype = np.dtype(entry["dtype"])
+            shape = tuple(entry["shape"])
+            offset = data_start + entry["offset"]
+            if 0 in shape:
+                arrays[name] = np.empty(shape, dtype = dtype)
+            elif mmap:
+                # Pedigree columns may be edited (eg. clearing
+                # suspected parents), so they are mapped copy on
+                # write. Pages are shared between processes until
+                # they are written to.
+                arrays[name] = np.memmap(filename, dtype = dtype, mode = "c",
+                                         offset = offset, shape = shape)
+            else:
+                population_file.seek(offset)
+                count = int(np.prod(shape))
+                arrays[name] = np.fromfile(population_file, dtype = dtype,
+                                           count = count).reshape(shape)
+    return (header, arrays)
+
+class PopulationFileWriter:
+    """
+    Writes a population file one generation at a time, so populations
+    larger than memory can be generated.
+
+    The pedigree, island and generation columns are allocated in the
+    output file up front for num_nodes rows and memory mapped. The
+    NodeGenerator and IslandModel of the writer use these columns
+    directly, so finished generations are written back to disk by the
+    OS rather than held in RAM. Genomes are appended to temporary files
+    as each generation is finished, and are copied to the end of the
+    population file by close.
+
+    The file is written under a temporary name in the same directory
+    and only moved to filename by close, so a failed run doesn't leave
+    a partial population file behind.
+    """
+    def __init__(self, filename, num_nodes, islands):
+        self._filename = filename
+        directory = os.path.dirname(os.path.abspath(filename))
+        handle, self._temp_filename = mkstemp(dir = directory,
+                                              suffix = ".tmp")
+        os.close(handle)
+        self._capacity = num_nodes
+        self._islands = islands
+        columns = [("father", NODE_ID_DTYPE, NO_NODE),
+                   ("mother", NODE_ID_DTYPE, NO_NODE),
+                   ("suspected_father", NODE_ID_DTYPE, NO_NODE),
+                   ("suspected_mother", NODE_ID_DTYPE, NO_NODE),
+                   ("twin", NODE_ID_DTYPE, NO_NODE),
+                   ("sex", SEX_DTYPE, 0),
+                   ("generation", GENERATION_DTYPE, 0),
+                   ("island", ISLAND_DTYPE, NO_ISLAND),
+                   ("generation_ids", NODE_ID_DTYPE, NO_NODE),
+                   ("genome_slot", np.int32, NO_GENOME),
+                   ("suspected_genome_slot", np.int32, NO_GENOME)]
+        self._data_start = _aligned(_PREAMBLE_SIZE + _RESERVED_HEADER_SIZE)
+        self._offsets = dict()
+        offset = 0
+        specs = [(name, dtype, num_nodes, fill)
+                 for name, dtype, fill in columns]
+        specs.append(("haplotype_offsets", np.int64, 2 * num_nodes + 1, 0))
+        for name, dtype, length, _ in specs:
+            self._offsets[name] = offset
+            offset = _aligned(offset + np.dtype(dtype).itemsize * length)
+        self._variable_start = offset
+        with open(self._temp_filename, "wb") as population_file:
+            population_file.truncate(self._data_start + offset)
+        self._arrays = dict()
+        for name, dtype, length, fill in specs:
+            array = np.memmap(self._temp_filename, dtype = dtype, mode = "r+",
+                              offset = self._data_start + self._offsets[name],
+                              shape = (length,))
+            if fill != 0:
+                array.fill(fill)
+            self._arrays[name] = array
+
+        pedigree = PedigreeArrays.from_columns({name: self._arrays[name]
+                                                for name in _PEDIGREE_COLUMNS},
+                                               size = 0)
+        self.node_generator = NodeGenerator(pedigree)
+        self.island_model = IslandModel(islands, self.node_generator)
+        self.island_model._island_of = self._arrays["island"]
+
+        self._starts_file = TemporaryFile(dir = directory)
+        self._founder_file = TemporaryFile(dir = directory)
+        self._num_haplotypes = 0
+        self._genome_end = None
+        self._generation_offsets = [0]
+
+    def finish_generation(self, generation, write_genomes = True):
+        """
+        Record generation, which must be the latest generation added
+        to the population, and write its genomes if write_genomes is
+        True. The generation's ids are replaced by a view of the
+        memory mapped column.
+        """
+        start = self._generation_offsets[-1]
+        stop = start + generation.size
+        generation_ids = self._arrays["generation_ids"]
+        generation_ids[start:stop] = generation.ids
+        generation._ids = generation_ids[start:stop]
+        self._generation_offsets.append(stop)
+        if write_genomes:
+            self._write_genomes(generation.ids)
+        for array in self._arrays.values():
+            array.flush()
+
+    def _write_genomes(self, node_ids):
+        genomes = self.node_generator._genomes
+        genome_slots = self._arrays["genome_slot"]
+        haplotype_offsets = self._arrays["haplotype_offsets"]
+        # Twins share a genome object, which is only written once.
+        slots = dict()
+        for node_id in node_ids.tolist():
+            genome = genomes.get(node_id)
+            if genome is None:
+                continue
+            key = id(genome)
+            if key not in slots:
+                slots[key] = self._num_haplotypes // 2
+                for haplotype in (genome.mother, genome.father):
+                    if self._genome_end is None:
+                        self._genome_end = int(haplotype.end)
+                    assert haplotype.end == self._genome_end
+                    starts = np.asarray(haplotype.starts, dtype = np.uint32)
+                    founder = np.asarray(haplotype.founder, dtype = np.uint32)
+                    starts.tofile(self._starts_file)
+                    founder.tofile(self._founder_file)
+                    haplotype_offsets[self._num_haplotypes + 1] = \
+                        haplotype_offsets[self._num_haplotypes] + len(starts)
+                    self._num_haplotypes += 1
+            genome_slots[node_id] = slots[key]
+
+    def close(self, population):
+        """
+        Write the header and the genome arrays, close the file and
+        move it to its final name.
+        """
+        num_nodes = len(self.node_generator.pedigree)
+        assert num_nodes <= self._capacity
+        num_generation_ids = self._generation_offsets[-1]
+        shapes = {name: num_nodes for name in _PEDIGREE_COLUMNS}
+        shapes.update({"island": num_nodes,
+                       "generation_ids": num_generation_ids,
+                       "genome_slot": num_nodes,
+                       "suspected_genome_slot": num_nodes,
+                       "haplotype_offsets": self._num_haplotypes + 1})
+        table = {name: {"offset": self._offsets[name],
+                        "dtype": self._arrays[name].dtype.str,
+                        "shape": [shape]}
+                 for name, shape in shapes.items()}
+
+        num_values = int(self._arrays["haplotype_offsets"][self._num_haplotypes])
+        generation_offsets = np.array(self._generation_offsets,
+                                      dtype = np.int64)
+        offset = self._variable_start
+        variable = [("generation_offsets", generation_offsets.dtype,
+                     len(generation_offsets)),
+                    ("starts", np.dtype(np.uint32), num_values),
+                    ("founder", np.dtype(np.uint32), num_values)]
+        for name, dtype, length in variable:
+            table[name] = {"offset": offset, "dtype": dtype.str,
+                           "shape": [length]}
+            offset = _aligned(offset + dtype.itemsize * length)
+
+        header = {"num_nodes": num_nodes,
+                  "population_class": type(population).__name__,
+                  "islands": [island.switch_probability for island
+                              in self._islands],
+                  "genome_end": self._genome_end,
+                  "arrays": table}
+        header_bytes = json.dumps(header).encode("utf-8")
+        assert len(header_bytes) <= _RESERVED_HEADER_SIZE
+        # Pad the header with whitespace to fill the reserved space.
+        header_bytes = header_bytes.ljust(_RESERVED_HEADER_SIZE)
+
+        for array in self._arrays.values():
+            array.flush()
+        with open(self._temp_filename, "r+b") as population_file:
+            population_file.write(pack(_PREAMBLE_FORMAT, MAGIC, VERSION, 0,
+                                       len(header_bytes)))
+            population_file.write(header_bytes)
+            population_file.seek(self._data_start
+                                 + table["generation_offsets"]["offset"])
+            generation_offsets.tofile(population_file)
+            for name, spill in (("starts", self._starts_file),
+                                ("founder", self._founder_file)):
+                spill.seek(0)
+                population_file.seek(self._data_start + table[name]["offset"])
+                copyfileobj(spill, population_file)
+                spill.close()
+            population_file.truncate(self._data_start + offset)
+        os.replace(self._temp_filename, self._filename)
+
+    def discard(self):
+        """
+        Remove the partially written file if close was not called.
+        """
+        if os.path.exists(self._temp_filename):
+            os.remove(self._temp_filename)
+
+class _GenomeTableBuilder:
+    """
+    Accumulates genomes into a flat haplotype table while saving. A
+    genome object shared by several nodes (eg. twins) is only stored
+    once.
+    """
+    def __init__(self):
+        self._slots = dict()
+        self._genomes = []
+        self.end = None
+
+    def add_all(self, genomes, num_nodes):
+        slots = np.full(num_nodes, NO_GENOME, dtype = np.int32)
+        for node_id, genome in genomes.items():
+            slots[node_id] = self._add(genome)
+        return slots
+
+    def _add(self, genome):
+        key = id(genome)
+        if key not in self._slots:
+            self._slots[key] = len(self._genomes)
+            self._genomes.append(genome)
+            if self.end is None:
+                self.end = int(genome.mother.end)
+            assert genome.mother.end == genome.father.end == self.end
+        return self._slots[key]
+
+    def arrays(self):
+        haplotypes = [haplotype for genome in self._genomes
+                      for haplotype in (genome.mother, genome.father)]
+        offsets = np.zeros(len(haplotypes) + 1, dtype = np.int64)
+        np.cumsum([len(haplotype.starts) for haplotype in haplotypes],
+                  out = offsets[1:])
+        if len(haplotypes) > 0:
+            starts = np.concatenate([haplotype.starts
+                                     for haplotype in haplotypes])
+            founder = np.concatenate([haplotype.founder
+                                      for haplotype in haplotypes])
+        else:
+            starts = np.empty(0, dtype = np.uint32)
+            founder = np.empty(0, dtype = np.uint32)
+        return {"haplotype_offsets": offsets,
+                "starts": starts.astype(np.uint32, copy = False),
+                "founder": founder.astype(np.uint32, copy = False)}
+
+class GenomeTable:
+    """
+    Genomes stored as concatenated starts and founder arrays. Genome
+    slot i has its mother haplotype at haplotype index 2i and its
+    father haplotype at 2i + 1.
+    """
+    cache_genomes = True
+
+    def __init__(self, haplotype_offsets, starts, founder, end):
+        self._offsets = haplotype_offsets
+        self._starts = starts
+        self._founder = founder
+        self._end = end
+
+    def _haplotype(self, haplotype_i):
+        start = self._offsets[haplotype_i]
+        stop = self._offsets[haplotype_i + 1]
+        return Diploid(self._starts[start:stop], self._end,
+                       self._founder[start:stop])
+
+    def genome(self, slot):
+        return RecombGenome(self._haplotype(2 * slot),
+                            self._haplotype(2 * slot + 1))
+
+class CompressedGenomeTable(GenomeTable):
+    """
+    GenomeTable whose starts are varint coded deltas and whose founders
+    are bit packed indices into founder_dictionary. Haplotypes are
+    decoded each time they are requested.
+    """
+    # Decoded genomes are copies, so MappedGenomes doesn't keep them.
+    cache_genomes = False
+
+    def __init__(self, haplotype_offsets, start_bytes, start_byte_offsets,
+                 founder_codes, founder_bits, founder_dictionary, end):
+        self._offsets = haplotype_offsets
+        self._start_bytes = start_bytes
+        self._start_byte_offsets = start_byte_offsets
+        self._founder_codes = founder_codes
+        self._founder_bits = founder_bits
+        self._founder_dictionary = founder_dictionary
+        self._end = end
+        self._decoder = HaplotypeDecoder(start_bytes, start_byte_offsets,
+                                         haplotype_offsets, founder_codes,
+                                         founder_bits, founder_dictionary)
+
+    def __reduce__(self):
+        return (CompressedGenomeTable,
+                (self._offsets, self._start_bytes, self._start_byte_offsets,
+                 self._founder_codes, self._founder_bits,
+                 self._founder_dictionary, self._end))
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the compressed arrays.
+        """
+        return sum(array.nbytes for array in (self._offsets,
+                                              self._start_bytes,
+                                              self._start_byte_offsets,
+                                              self._founder_codes,
+                                              self._founder_dictionary))
+
+    def _haplotype(self, haplotype_i):
+        starts, founder = self._decoder.decode(haplotype_i)
+        return Diploid(starts, self._end, founder)
+
+class MappedGenomes(MutableMapping):
+    """
+    Mapping from node id -> genome for genomes stored in a GenomeTable.
+    Genome objects are created the first time they are requested and
+    reused afterwards, so nodes sharing a slot (twins) share a genome
+    object, unless the table decodes a new copy on every request.
+    Genomes can be replaced or removed; the table itself is never
+    modified.
+    """
+    def __init__(self, slots, table):
+        self._slots = slots
+        self._table = table
+        self._by_slot = dict()
+        self._assigned = dict()
+        self._removed = set()
+
+    def _stored_slot(self, node_id):
+        if node_id in self._removed or not 0 <= node_id < len(self._slots):
+            return NO_GENOME
+        return int(self._slots[node_id])
+
+    def __getitem__(self, node_id):
+        if node_id in self._assigned:
+            return self._assigned[node_id]
+        slot = self._stored_slot(node_id)
+        if slot == NO_GENOME:
+            raise KeyError(node_id)
+        if not self._table.cache_genomes:
+            return self._table.genome(slot)
+        if slot not in self._by_slot:
+            self._by_slot[slot] = self._table.genome(slot)
+        return self._by_slot[slot]
+
+    def __contains__(self, node_id):
+        return (node_id in self._assigned
+                or self._stored_slot(node_id) != NO_GENOME)
+
+    def __setitem__(self, node_id, genome):
+        self._assigned[node_id] = genome
+        self._removed.add(node_id)
+
+    def __delitem__(self, node_id):
+        found = self._assigned.pop(node_id, None) is not None
+        if self._stored_slot(node_id) != NO_GENOME:
+            self._removed.add(node_id)
+            found = True
+        if not found:
+            raise KeyError(node_id)
+
+    def _stored_ids(self):
+        return (node_id for node_id
+                in np.flatnonzero(self._slots != NO_GENOME).tolist()
+                if node_id not in self._removed)
+
+    def __iter__(self):
+        yield from self._stored_ids()
+        yield from self._assigned
+
+    def __len__(self):
+        return sum(1 for _ in self._stored_ids()) + len(self._assigned)
+
+    def clear(self):
+        self._slots = np.empty(0, dtype = np.int32)
+        self._by_slot = dict()
+        self._assigned = dict()
+        self._removed = set()
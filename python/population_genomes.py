@@ -1,27 +1,35 @@
 from bisect import bisect_left
-from collections import deque
-from random import random
+from collections import deque, OrderedDict, defaultdict
+from collections.abc import MutableMapping
+from multiprocessing import Pool
 
 import numpy as np
 
 from sex import Sex
-from recomb_genome import RecombGenome, Diploid, CHROMOSOME_ORDER
+from generation import Generation
+from pedigree import NO_NODE
+from meiosis import meiosis_batch
+from genome_arena import GenomeArena
+from recomb_genome import (RecombGenome, Diploid, CHROMOSOME_ORDER,
+                           NUM_CHROMS, MeiosisRandom, MATERNAL_MEIOSIS,
+                           PATERNAL_MEIOSIS, read_only)
 
-def _pick_chroms_for_diploid(genome, recombinator):
+def _pick_chroms_for_diploid(genome, recombinator, rng = np.random):
     """
     Takes a genome and returns a diploid chromosome that is the result
     of recombination events and randomly picking a diploid for each
-    autosome.
+    autosome. Randomness is drawn from rng.
     """
-    recomb_genome = recombinator.recombination(genome)
+    recomb_genome = recombinator.recombination(genome, rng)
     mother = recomb_genome.mother
     father = recomb_genome.father
     starts = []
     founder = []
     offsets = recombinator._chrom_start_offset
     chrom_stop = 0
-    for chrom_name in CHROMOSOME_ORDER:
-        if random() < 0.5:
+    from_mother = rng.random(NUM_CHROMS) < 0.5
+    for chrom_name, pick_mother in zip(CHROMOSOME_ORDER, from_mother):
+        if pick_mother:
             tmp_diploid = mother
         else:
             tmp_diploid = father
@@ -40,16 +48,99 @@ def _pick_chroms_for_diploid(genome, recombinator):
                    np.array(founder, dtype = np.uint32))
 
 
-def mate(mother, father, mother_recombinator, father_recombinator):
+def mate(mother, father, mother_recombinator, father_recombinator,
+         meiosis_random = None, node_id = None):
     """
-    Takes a mother and father, and returns a genome for a child
+    Takes a mother and father, and returns a genome for a child. If
+    meiosis_random is given, the randomness of both meioses is keyed
+    by the child's node_id, so the child's genome does not depend on
+    the order in which genomes are generated. Otherwise the global
+    np.random state is used.
     """
     assert mother is not None
     assert father is not None
-    from_mother = _pick_chroms_for_diploid(mother, mother_recombinator)
-    from_father = _pick_chroms_for_diploid(father, father_recombinator)
+    if meiosis_random is None:
+        from_mother = _pick_chroms_for_diploid(mother, mother_recombinator)
+        from_father = _pick_chroms_for_diploid(father, father_recombinator)
+    else:
+        assert node_id is not None
+        rng = meiosis_random.stream(node_id, MATERNAL_MEIOSIS)
+        from_mother = _pick_chroms_for_diploid(mother, mother_recombinator,
+                                               rng)
+        rng = meiosis_random.stream(node_id, PATERNAL_MEIOSIS)
+        from_father = _pick_chroms_for_diploid(father, father_recombinator,
+                                               rng)
     return RecombGenome(from_mother, from_father)
 
+def _gametes(parents, node_ids, meiosis, recombinator, meiosis_random):
+    """
+    Returns the gamete (Diploid) of each parent genome in parents for
+    the given meiosis of the children node_ids, using the batched
+    meiosis kernel. The gametes share one starts and one founder
+    array.
+    """
+    crossovers, crossover_indptr, from_mother = recombinator.sample_crossovers(
+        (meiosis_random.stream(node_id, meiosis) for node_id in node_ids),
+        chromosome_choices = True)
+    # Pack each distinct parent genome once, haplotype 2p is the
+    # mother's and 2p + 1 the father's of parent p.
+    parent_slots = dict()
+    haplotypes = []
+    parent_index = np.empty(len(parents), dtype = np.int64)
+    for i, genome in enumerate(parents):
+        slot = parent_slots.get(id(genome))
+        if slot is None:
+            slot = len(parent_slots)
+            parent_slots[id(genome)] = slot
+            haplotypes.append(genome.mother)
+            haplotypes.append(genome.father)
+        parent_index[i] = slot
+    haplotype_offsets = np.zeros(len(haplotypes) + 1, dtype = np.int64)
+    np.cumsum([len(haplotype.starts) for haplotype in haplotypes],
+              out = haplotype_offsets[1:])
+    starts = np.concatenate([haplotype.starts for haplotype in haplotypes])
+    founder = np.concatenate([haplotype.founder for haplotype in haplotypes])
+    chrom_offsets = np.array([recombinator._chrom_start_offset[chrom]
+                              for chrom in CHROMOSOME_ORDER],
+                             dtype = np.uint32)
+    end = parents[0].mother.end
+    arguments = (haplotype_offsets, starts.astype(np.uint32, copy = False),
+                 founder.astype(np.uint32, copy = False), parent_index,
+                 crossover_indptr, crossovers,
+                 np.logical_not(from_mother).view(np.uint8), chrom_offsets,
+                 end)
+    offsets = np.empty(len(parents) + 1, dtype = np.int64)
+    # The first call only counts, so the output is allocated exactly.
+    meiosis_batch(*arguments, offsets)
+    gamete_starts = np.empty(offsets[-1], dtype = np.uint32)
+    gamete_founder = np.empty(offsets[-1], dtype = np.uint32)
+    meiosis_batch(*arguments, offsets, gamete_starts, gamete_founder)
+    # The gametes of all children are views of these arrays.
+    read_only(gamete_starts)
+    read_only(gamete_founder)
+    bounds = offsets.tolist()
+    return [Diploid(gamete_starts[start:stop], end,
+                    gamete_founder[start:stop])
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def mate_generation(node_ids, pairs, recombinators, meiosis_random):
+    """
+    Returns the genomes of the children node_ids, where pairs holds the
+    (mother genome, father genome) of each child. The result is the
+    same as calling mate with meiosis_random for each child, but all
+    meioses are done by one call to the native meiosis kernel.
+    """
+    if len(pairs) == 0:
+        return []
+    from_mother = _gametes([mother for mother, _ in pairs], node_ids,
+                           MATERNAL_MEIOSIS, recombinators[Sex.Female],
+                           meiosis_random)
+    from_father = _gametes([father for _, father in pairs], node_ids,
+                           PATERNAL_MEIOSIS, recombinators[Sex.Male],
+                           meiosis_random)
+    return [RecombGenome(mother, father)
+            for mother, father in zip(from_mother, from_father)]
+
 def generate_genomes_ancestors(root_nodes, generator, recombinators):
     queue = deque(root_nodes)
     visited = set()
@@ -69,41 +160,563 @@ def generate_genomes_ancestors(root_nodes, generator, recombinators):
         queue.extend(person.children)
         visited.add(person)
 
+def replicate_genomes(nodes, generator, recombinators, replicates,
+                      seed = None):
+    """
+    Generate replicates independent sets of genomes for the small
+    pedigree made up of nodes, without assigning them to the nodes.
+    Every parent of a node must be in nodes, and nodes without parents
+    are founders, which have the same genome in every replicate.
+
+    The children of the same depth in all replicates are mated by one
+    call to mate_generation, with meioses keyed by replicate and node,
+    so the result only depends on seed. Returns a dict mapping node id
+    to the list of its genomes, one per replicate.
+    """
+    nodes = list(nodes)
+    index = {node._id: i for i, node in enumerate(nodes)}
+    depth = dict()
+    remaining = list(nodes)
+    while len(remaining) > 0:
+        waiting = []
+        for node in remaining:
+            mother, father = node.mother, node.father
+            if mother is None:
+                assert father is None
+                depth[node._id] = 0
+            elif mother._id in depth and father._id in depth:
+                depth[node._id] = max(depth[mother._id],
+                                      depth[father._id]) + 1
+            else:
+                assert mother._id in index and father._id in index
+                waiting.append(node)
+        assert len(waiting) < len(remaining), "Pedigree has a cycle."
+        remaining = waiting
+
+    genomes = dict()
+    by_depth = defaultdict(list)
+    for node in nodes:
+        if depth[node._id] == 0:
+            genome = generator.founder_genome(index[node._id])
+            genomes[node._id] = [genome] * replicates
+        else:
+            by_depth[depth[node._id]].append(node)
+    meiosis_random = MeiosisRandom(seed)
+    for level in sorted(by_depth):
+        children = by_depth[level]
+        node_ids = []
+        pairs = []
+        for replicate in range(replicates):
+            for child in children:
+                node_ids.append(replicate * len(nodes) + index[child._id])
+                pairs.append((genomes[child.mother._id][replicate],
+                              genomes[child.father._id][replicate]))
+        child_genomes = mate_generation(node_ids, pairs, recombinators,
+                                        meiosis_random)
+        for i, child in enumerate(children):
+            genomes[child._id] = child_genomes[i::len(children)]
+    return genomes
+
+def replicate_sharing(nodes, pairs, generator, recombinators, ibd_detector,
+                      replicates, seed = None):
+    """
+    Simulate replicates genome realizations of the pedigree made up of
+    nodes, as replicate_genomes does, and return a (replicates,
+    len(pairs)) array with the IBD measured by ibd_detector between
+    each pair of nodes in pairs in each replicate.
+    """
+    genomes = replicate_genomes(nodes, generator, recombinators, replicates,
+                                seed)
+    sharing = np.empty((replicates, len(pairs)), dtype = np.float64)
+    for pair_i, (node_a, node_b) in enumerate(pairs):
+        genomes_a = genomes[node_a._id]
+        genomes_b = genomes[node_b._id]
+        for replicate in range(replicates):
+            sharing[replicate, pair_i] = ibd_detector.shared_segment_length(
+                genomes_a[replicate], genomes_b[replicate])
+    return sharing
+
+# Number of children mated per task when genomes are generated in
+# parallel.
+MATE_CHUNK_SIZE = 256
+
+_worker_recombinators = None
+_worker_meiosis_random = None
+
+def _init_mate_worker(recombinators, seed):
+    global _worker_recombinators, _worker_meiosis_random
+    _worker_recombinators = recombinators
+    _worker_meiosis_random = MeiosisRandom(seed)
+
+def _mate_chunk(task):
+    node_ids, pairs = task
+    return mate_generation(node_ids, pairs, _worker_recombinators,
+                           _worker_meiosis_random)
+
+class MatePool:
+    """
+    Runs mate for many children, split into chunks that are processed
+    by a pool of worker processes. The meioses of each child are keyed
+    by its node id with MeiosisRandom, so the genomes only depend on
+    the seed, not on the number of processes. With processes = 1 the
+    chunks are processed in this process.
+    """
+    def __init__(self, recombinators, processes = 1, seed = None):
+        self._recombinators = recombinators
+        self.meiosis_random = MeiosisRandom(seed)
+        if processes > 1:
+            self._pool = Pool(processes, _init_mate_worker,
+                              (recombinators, self.meiosis_random.seed))
+        else:
+            self._pool = None
+
+    def mate_all(self, node_ids, pairs):
+        """
+        Returns a list with the genome of each child in node_ids,
+        where pairs holds the (mother genome, father genome) of each
+        child.
+        """
+        if self._pool is None:
+            return mate_generation(node_ids, pairs, self._recombinators,
+                                   self.meiosis_random)
+        tasks = [(node_ids[i:i + MATE_CHUNK_SIZE],
+                  pairs[i:i + MATE_CHUNK_SIZE])
+                 for i in range(0, len(pairs), MATE_CHUNK_SIZE)]
+        results = self._pool.map(_mate_chunk, tasks)
+        return [genome for chunk in results for genome in chunk]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _parent_genomes(person, generator, true_genealogy):
+    """
+    Returns the (mother, father) genomes of person, generating a new
+    founder genome for an unknown parent, or None if both parents are
+    unknown.
+    """
+    if true_genealogy:
+        mother = person.mother
+        father = person.father
+    else:
+        mother = person.suspected_mother
+        father = person.suspected_father
+
+    if mother is None and father is None:
+        return None
+    if mother is None:
+        mother_genome = generator.generate()
+    else:
+        mother_genome = mother.genome
+    if father is None:
+        father_genome = generator.generate()
+    else:
+        father_genome = father.genome
+
+    assert mother_genome is not None
+    assert father_genome is not None
+    return (mother_genome, father_genome)
+
+def generate_generation_genomes(generation, generator, recombinators,
+                                true_genealogy = True, mate_pool = None):
+    """
+    Assign genomes to the members of generation that don't have one
+    yet. Parents must already have their genomes. Children are mated
+    in one batch by mate_pool; without one, a single process MatePool
+    with a random seed is used. Twins are assigned the same genome
+    object, which is safe as genomes are never changed in place (see
+    recomb_genome.writable_genome).
+    """
+    if mate_pool is None:
+        with MatePool(recombinators) as mate_pool:
+            _generate_generation_genomes_pooled(generation, generator,
+                                                true_genealogy, mate_pool)
+        return
+    _generate_generation_genomes_pooled(generation, generator,
+                                        true_genealogy, mate_pool)
+
+def _generate_generation_genomes_pooled(generation, generator,
+                                        true_genealogy, mate_pool):
+    # Founder genomes are generated here, as the genome generator
+    # numbers them sequentially. Only mating is done by the pool.
+    children = []
+    pairs = []
+    scheduled = set()
+    twins = []
+    for person in generation.members:
+        if person.genome is not None:
+            continue
+        twin = person.twin
+        if twin is not None and (twin.genome is not None
+                                 or twin._id in scheduled):
+            twins.append(person)
+            continue
+        parent_genomes = _parent_genomes(person, generator, true_genealogy)
+        if parent_genomes is None:
+            person.genome = generator.generate()
+            continue
+        children.append(person)
+        pairs.append(parent_genomes)
+        scheduled.add(person._id)
+
+    node_ids = [child._id for child in children]
+    genomes = mate_pool.mate_all(node_ids, pairs)
+    store = generation.node_generator._genomes
+    if isinstance(store, GenomeArena):
+        store.set_many(node_ids, genomes)
+        generation.node_generator.genomes_changed()
+    else:
+        for child, genome in zip(children, genomes):
+            child.genome = genome
+    for person in twins:
+        person.genome = person.twin.genome
+
+def clear_generation_genomes(generation):
+    genomes = generation.node_generator._genomes
+    for node_id in generation.ids.tolist():
+        if node_id in genomes:
+            del genomes[node_id]
+    generation.node_generator.genomes_changed()
+
 def generate_genomes(population, generator, recombinators, keep_last = None,
-                     true_genealogy = True):
+                     true_genealogy = True, processes = None, seed = None):
+    """
+    Generate genomes for every generation of population. Each
+    generation is mated in one batch by a MatePool with that many
+    worker processes (1 by default), so the meioses of each child are
+    keyed by seed and the child's node id. Without seed a random one is
+    drawn.
+    """
     assert keep_last is None or keep_last > 0
+    if processes is None:
+        processes = 1
+    with MatePool(recombinators, processes, seed) as mate_pool:
+        _generate_genomes(population, generator, recombinators, keep_last,
+                          true_genealogy, mate_pool)
+
+def use_genome_arena(population):
+    """
+    Move the genomes of population into a GenomeArena, unless they are
+    already in one or generated lazily. Nodes sharing a genome object
+    (eg. twins) share it in the arena. Returns the genome store.
+    """
+    node_generator = population.node_generator
+    genomes = node_generator._genomes
+    if isinstance(genomes, (GenomeArena, LazyGenomes)):
+        return genomes
+    arena = GenomeArena()
+    first_node = dict()
+    shared = []
+    for node_id in list(genomes):
+        genome = genomes[node_id]
+        if id(genome) in first_node:
+            shared.append((node_id, first_node[id(genome)]))
+        else:
+            first_node[id(genome)] = node_id
+    arena.set_many(first_node.values(),
+                   [genomes[node_id] for node_id in first_node.values()])
+    for node_id, first_id in shared:
+        arena[node_id] = arena[first_id]
+    node_generator._genomes = arena
+    return arena
+
+def _generate_genomes(population, generator, recombinators, keep_last,
+                      true_genealogy, mate_pool):
+    use_genome_arena(population)
     for generation_num, generation in enumerate(population.generations):
-        for person in generation.members:
-            if person.genome is not None:
-                continue
-            if person.twin is not None and person.twin.genome is not None:
-                person.genome = person.twin.genome
+        generate_generation_genomes(generation, generator, recombinators,
+                                    true_genealogy, mate_pool)
+        if keep_last is not None and keep_last <= generation_num:
+            to_delete = population.generations[generation_num - keep_last]
+            clear_generation_genomes(to_delete)
+
+def affected_ids(pedigree, node_ids, true_genealogy = True):
+    """
+    Returns a sorted array with node_ids and every node whose genome
+    depends on the genome of one of them: their descendants along the
+    true or suspected genealogy, their twins, and the descendants of
+    those twins.
+    """
+    suspected = not true_genealogy
+    affected = pedigree.descendant_ids(node_ids, suspected)
+    while True:
+        twins = pedigree.twin[affected]
+        twins = np.setdiff1d(twins[twins != NO_NODE], affected)
+        if len(twins) == 0:
+            return affected
+        affected = np.union1d(affected,
+                              pedigree.descendant_ids(twins, suspected))
+
+def regenerate_genomes(population, generator, recombinators, node_ids,
+                       true_genealogy = True, processes = None, seed = None):
+    """
+    Regenerate the genomes of node_ids, eg. nodes whose parents were
+    changed in the genealogy selected by true_genealogy (see
+    PedigreeArrays.take_edited_ids with suspected = not
+    true_genealogy), and of every node returned by affected_ids for
+    them. The genomes of all other nodes
+    are reused, and the parents of regenerated nodes must have genomes.
+
+    Nodes are mated generation by generation as with generate_genomes,
+    so with the same seed the result is the same as generating every
+    genome of the edited pedigree again, except for founder genomes of
+    unknown parents. Only nodes that had a genome keep their new one,
+    so generations cleared by keep_last stay cleared. Returns the ids
+    of the nodes with new genomes.
+    """
+    node_generator = population.node_generator
+    pedigree = node_generator.pedigree
+    affected = affected_ids(pedigree, node_ids, true_genealogy)
+    if true_genealogy:
+        parents = np.concatenate((pedigree.mother[affected],
+                                  pedigree.father[affected]))
+    else:
+        parents = np.concatenate((pedigree.suspected_mother[affected],
+                                  pedigree.suspected_father[affected]))
+    parents = np.setdiff1d(parents[parents != NO_NODE], affected)
+    genomes = node_generator._genomes
+    missing = [parent for parent in parents.tolist() if parent not in genomes]
+    if len(missing) > 0:
+        raise ValueError("Nodes {} have no genomes to regenerate their children from.".format(missing))
+
+    had_genome = []
+    for node_id in affected.tolist():
+        if node_id in genomes:
+            had_genome.append(node_id)
+            del genomes[node_id]
+    node_generator.genomes_changed()
+    mate_pool = MatePool(recombinators,
+                         1 if processes is None else processes, seed)
+    try:
+        for generation in population.generations:
+            ids = generation.ids
+            ids = ids[np.isin(ids, affected)]
+            if len(ids) == 0:
                 continue
-            if true_genealogy:
-                mother = person.mother
-                father = person.father
-            else:
-                mother = person.suspected_mother
-                father = person.suspected_father
-            
-            if mother is None and father is None:
-                person.genome = generator.generate()
+            generate_generation_genomes(Generation.from_ids(node_generator,
+                                                            ids),
+                                        generator, recombinators,
+                                        true_genealogy, mate_pool)
+    finally:
+        mate_pool.close()
+    for node_id in np.setdiff1d(affected, had_genome).tolist():
+        if node_id in genomes:
+            del genomes[node_id]
+    node_generator.genomes_changed()
+    return np.array(had_genome, dtype = affected.dtype)
+
+# Default byte budget of the LazyGenomes cache.
+DEFAULT_GENOME_CACHE_BYTES = 2 ** 30
+
+def genome_nbytes(genome):
+    """
+    Number of bytes used by the arrays of a RecombGenome.
+    """
+    return (genome.mother.starts.nbytes + genome.mother.founder.nbytes
+            + genome.father.starts.nbytes + genome.father.founder.nbytes)
+
+class LazyGenomes(MutableMapping):
+    """
+    Mapping from node id -> genome that regenerates genomes on demand
+    instead of storing them. It can be used in place of the genome dict
+    of a NodeGenerator.
+
+    The genome of a node is computed from the genomes of its true
+    parents with mate, keyed by the node id with MeiosisRandom, so it
+    is the same whenever it is regenerated. Founders (nodes without
+    parents) get founder number equal to their node id, and twins use
+    the genome of the twin with the smaller id. This gives the same
+    genomes as generate_genomes with the same seed for populations
+    whose founders are nodes 0, 1, ...
+
+    Only nodes with a generation of at least first_generation are in
+    the mapping. Genomes of their ancestors are generated as needed.
+    Generated genomes are kept in a cache of at most max_bytes, with
+    the least recently used genomes evicted first. Pinned genomes (eg.
+    anchors) are never evicted and don't count towards the budget.
+    Genomes can be assigned explicitly, in which case they are stored
+    until removed.
+    """
+    def __init__(self, pedigree, genome_generator, recombinators,
+                 seed = None, max_bytes = DEFAULT_GENOME_CACHE_BYTES,
+                 first_generation = 0):
+        self._pedigree = pedigree
+        self._genome_generator = genome_generator
+        self._recombinators = recombinators
+        self.meiosis_random = MeiosisRandom(seed)
+        self.max_bytes = max_bytes
+        self.first_generation = first_generation
+        self._cache = OrderedDict()
+        self._nbytes = 0
+        self._pinned_ids = set()
+        self._pinned = dict()
+        self._assigned = dict()
+        self._removed = set()
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the cached (not pinned) genomes.
+        """
+        return self._nbytes
+
+    def _source_id(self, node_id):
+        twin = self._pedigree._twin[node_id]
+        if twin != NO_NODE and twin < node_id:
+            return int(twin)
+        return int(node_id)
+
+    def _exposed(self, node_id):
+        return (0 <= node_id < len(self._pedigree)
+                and node_id not in self._removed
+                and self._pedigree._generation[node_id] >= self.first_generation)
+
+    def _lookup(self, node_id):
+        genome = self._pinned.get(node_id)
+        if genome is not None:
+            return genome
+        genome = self._cache.get(node_id)
+        if genome is not None:
+            self._cache.move_to_end(node_id)
+        return genome
+
+    def _store(self, node_id, genome):
+        if node_id in self._pinned_ids:
+            self._pinned[node_id] = genome
+            return
+        self._cache[node_id] = genome
+        self._nbytes += genome_nbytes(genome)
+        while self._nbytes > self.max_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last = False)
+            self._nbytes -= genome_nbytes(evicted)
+
+    def _materialize(self, node_id):
+        node_id = self._source_id(node_id)
+        genome = self._lookup(node_id)
+        if genome is not None:
+            return genome
+        pedigree = self._pedigree
+        female = self._recombinators[Sex.Female]
+        male = self._recombinators[Sex.Male]
+        # Genomes generated by this call are held here until it
+        # returns, so ancestors evicted from the cache while their
+        # other descendants are generated are not regenerated.
+        held = dict()
+        stack = [node_id]
+        while len(stack) > 0:
+            current = stack[-1]
+            if current in held:
+                stack.pop()
                 continue
-            if mother is None:
-                mother_genome = generator.generate()
-            else:
-                mother_genome = mother.genome
-            if father is None:
-                father_genome = generator.generate()
+            mother = pedigree._mother[current]
+            father = pedigree._father[current]
+            if mother == NO_NODE and father == NO_NODE:
+                genome = self._genome_generator.founder_genome(current)
+            elif mother == NO_NODE or father == NO_NODE:
+                raise ValueError("Node {} has only one known parent, its genome can't be regenerated.".format(current))
             else:
-                father_genome = father.genome
-                
-            assert mother_genome is not None
-            assert father_genome is not None
-            person.genome = mate(mother_genome, father_genome,
-                                 recombinators[Sex.Female],
-                                 recombinators[Sex.Male])
-        if keep_last is not None and keep_last <= generation_num:
-            to_delete = population.generations[generation_num - keep_last]
-            for person in to_delete.members:
-                person.genome = None
+                parents = []
+                missing = []
+                for parent_id in (self._source_id(mother),
+                                  self._source_id(father)):
+                    parent_genome = held.get(parent_id)
+                    if parent_genome is None:
+                        parent_genome = self._lookup(parent_id)
+                    if parent_genome is None:
+                        missing.append(parent_id)
+                    else:
+                        held[parent_id] = parent_genome
+                    parents.append(parent_genome)
+                if len(missing) > 0:
+                    stack.extend(missing)
+                    continue
+                genome = mate(parents[0], parents[1], female, male,
+                              self.meiosis_random, current)
+            held[current] = genome
+            self._store(current, genome)
+            stack.pop()
+        return held[node_id]
+
+    def pin(self, node_ids):
+        """
+        Keep the genomes of node_ids once they are generated, regardless
+        of the cache budget.
+        """
+        for node_id in node_ids:
+            node_id = self._source_id(node_id)
+            self._pinned_ids.add(node_id)
+            genome = self._cache.pop(node_id, None)
+            if genome is not None:
+                self._nbytes -= genome_nbytes(genome)
+                self._pinned[node_id] = genome
+
+    def unpin(self, node_ids):
+        """
+        Return the genomes of node_ids to the cache.
+        """
+        for node_id in node_ids:
+            node_id = self._source_id(node_id)
+            self._pinned_ids.discard(node_id)
+            genome = self._pinned.pop(node_id, None)
+            if genome is not None:
+                self._store(node_id, genome)
+
+    def __getitem__(self, node_id):
+        if node_id in self._assigned:
+            return self._assigned[node_id]
+        if not self._exposed(node_id):
+            raise KeyError(node_id)
+        return self._materialize(node_id)
+
+    def __contains__(self, node_id):
+        return node_id in self._assigned or self._exposed(node_id)
+
+    def __setitem__(self, node_id, genome):
+        self._assigned[node_id] = genome
+
+    def __delitem__(self, node_id):
+        if self._assigned.pop(node_id, None) is not None:
+            self._removed.add(node_id)
+        elif self._exposed(node_id):
+            self._removed.add(node_id)
+        else:
+            raise KeyError(node_id)
+
+    def _exposed_ids(self):
+        ids = np.flatnonzero(self._pedigree.generation >= self.first_generation)
+        return (node_id for node_id in ids.tolist()
+                if node_id not in self._removed
+                and node_id not in self._assigned)
+
+    def __iter__(self):
+        yield from self._exposed_ids()
+        yield from self._assigned
+
+    def __len__(self):
+        return sum(1 for _ in self._exposed_ids()) + len(self._assigned)
+
+def use_lazy_genomes(population, genome_generator, recombinators,
+                     seed = None, max_bytes = DEFAULT_GENOME_CACHE_BYTES,
+                     keep_last = None):
+    """
+    Replace the genomes of population with a LazyGenomes provider and
+    return it. If keep_last is given only the last keep_last
+    generations have genomes, as with generate_genomes.
+    """
+    pedigree = population.node_generator.pedigree
+    if keep_last is None or keep_last >= population.num_generations:
+        first_generation = 0
+    else:
+        ids = population.generations[-keep_last].ids
+        first_generation = int(pedigree.generation[ids].min())
+    genomes = LazyGenomes(pedigree, genome_generator, recombinators, seed,
+                          max_bytes, first_generation)
+    population.node_generator._genomes = genomes
+    return genomes
@@ -1,23 +1,25 @@
 import re
 import csv
+import json
 
-from itertools import tee
-from os import listdir
-from os.path import isfile, join
-from random import uniform
-from bisect import bisect_left
+from os import listdir, stat, replace, remove, fdopen
+from os.path import isfile, join, basename
 from collections import defaultdict, namedtuple
 from itertools import chain
+from tempfile import mkstemp
+from zipfile import BadZipFile
 
 import numpy as np
 # import pyximport; pyximport.install()
 
 from sex import Sex
 from diploid import Diploid
-from recomb_helper import new_sequence
+from recomb_helper import crossover
 
 MEGABASE = 10 ** 6
 DECODE_FILENAME = "decode_recombination_data.tab"
+# Parsed hapmap files are cached in this file in the hapmap directory.
+RECOMBINATION_CACHE_FILENAME = "recombination_maps.npz"
 CHROMOSOME_ORDER = list(range(1, 23))
 NUM_CHROMS = len(CHROMOSOME_ORDER)
 
@@ -28,6 +30,24 @@ def recomb_genome_hash(self):
     return hash(id(self))
 RecombGenome.__hash__ = recomb_genome_hash
 
+def read_only(array):
+    """
+    Mark array as read only and return it.
+    """
+    array.flags.writeable = False
+    return array
+
+def writable_genome(genome):
+    """
+    Returns a copy of genome with arrays that can be modified in
+    place. Genome arrays are shared between twins, founders and the
+    genome store and must be treated as immutable, so a genome is
+    copied with this before it is changed (copy on write).
+    """
+    return RecombGenome(*(Diploid(diploid.starts.copy(), diploid.end,
+                                  diploid.founder.copy())
+                          for diploid in genome))
+
 class RecombGenomeGenerator():
     def __init__(self, chromosome_lengths):
         self._chromosome_lengths = chromosome_lengths
@@ -38,21 +58,36 @@ class RecombGenomeGenerator():
                                             ordered_cum_bases[:-1]))
         self._chrom_start_offset[1] = 0
         self._genome_id = 0
+        # Every founder haplotype starts at the chromosome boundaries,
+        # so all founders share one read only starts array.
+        self._founder_starts = read_only(np.fromiter(
+            (self._chrom_start_offset[chrom] for chrom in CHROMOSOME_ORDER),
+            dtype = np.uint32, count = NUM_CHROMS))
 
     def generate(self):
-        starts = np.fromiter((self._chrom_start_offset[chrom]
-                              for chrom in CHROMOSOME_ORDER),
-                             dtype = np.uint32, count = NUM_CHROMS)
-        mother_founder = np.empty(NUM_CHROMS, dtype = np.uint32)
-        mother_founder.fill(self._genome_id)
-        father_founder = np.empty(NUM_CHROMS, dtype = np.uint32)
-        father_founder.fill(self._genome_id + 1)
-        mother = Diploid(starts, self._total_length, mother_founder)
-        # XXX: Can the start array be shared across some individuals?
-        father = Diploid(np.array(starts, dtype = np.uint32),
-                         self._total_length, father_founder)
-        
+        genome = self.founder_genome(self._genome_id // 2)
         self._genome_id += 2
+        return genome
+
+    def founder_genome(self, founder_number):
+        """
+        Returns the genome of the given founder, whose haplotypes have
+        founder ids 2 * founder_number and 2 * founder_number + 1.
+        Unlike generate, this does not depend on how many genomes were
+        generated before.
+
+        The arrays of the genome are read only. Both haplotypes share
+        the starts array of every founder, and their founder ids are
+        views of one allocation.
+        """
+        founder = read_only(np.repeat(np.array([2 * founder_number,
+                                                2 * founder_number + 1],
+                                               dtype = np.uint32),
+                                      NUM_CHROMS))
+        mother = Diploid(self._founder_starts, self._total_length,
+                         founder[:NUM_CHROMS])
+        father = Diploid(self._founder_starts, self._total_length,
+                         founder[NUM_CHROMS:])
         return RecombGenome(mother, father)
 
     def reset(self):
@@ -79,11 +114,12 @@ def recombinators_from_directory(directory):
     http://hapmap.ncbi.nlm.nih.gov/downloads/recombination/
     Sex based centimorgan lengths are from decode doi:10.1038/ng917.
     """
-    chromosomes = hapmap_filenames(directory)
     decode_file = join(directory, DECODE_FILENAME)
+    sex_data = None
     if isfile(decode_file):
         sex_data = read_sex_lengths(decode_file)
-    return recombinators_from_hapmap_files(chromosomes, sex_data)
+    return recombinators_from_maps(read_recombination_maps(directory),
+                                   sex_data)
 
 def recombinators_from_hapmap_files(hapmap_files, sex_lengths = None):
     """
@@ -93,6 +129,14 @@ def recombinators_from_hapmap_files(hapmap_files, sex_lengths = None):
     chrom_data = dict()
     for chrom, filename in hapmap_files.items():
         chrom_data[chrom] = _read_recombination_file(filename)
+    return recombinators_from_maps(chrom_data, sex_lengths)
+
+def recombinators_from_maps(chrom_data, sex_lengths = None):
+    """
+    chrom_data is a dict from chromosomes to the rows of their hapmap
+    file, as returned by _read_recombination_file or
+    read_recombination_maps.
+    """
     if not sex_lengths:
         return Recombinator(chrom_data)
 
@@ -125,9 +169,74 @@ def _adjust_centimorgans(rows, multiplier = 1.0):
     b 0.2 0.1
     c 0.1 0.3
     """
+    if isinstance(rows, np.ndarray):
+        return rows * np.array([1.0, multiplier, multiplier])
     return [(bp, rate * multiplier, distance * multiplier)
             for bp, rate, distance in rows]
 
+def _hapmap_sources(hapmap_files):
+    """
+    Returns the name, size and modification time of each hapmap file,
+    which a cache must match to be used.
+    """
+    sources = []
+    for chrom in sorted(hapmap_files):
+        file_stat = stat(hapmap_files[chrom])
+        sources.append([chrom, basename(hapmap_files[chrom]),
+                        file_stat.st_size, file_stat.st_mtime_ns])
+    return sources
+
+def read_recombination_maps(directory):
+    """
+    Returns a dict mapping each chromosome with a hapmap file in
+    directory to an (n, 3) float64 array of its rows (position, cM /
+    Mb, cumulative cM).
+
+    The parsed rows are cached in RECOMBINATION_CACHE_FILENAME in
+    directory, which is used as long as the name, size and
+    modification time of every hapmap file are unchanged. A cache that
+    can't be read (eg. a truncated file) is rebuilt, and if the cache
+    can't be written, the files are parsed every time.
+    """
+    hapmap_files = hapmap_filenames(directory)
+    sources = json.dumps(_hapmap_sources(hapmap_files))
+    cache_file = join(directory, RECOMBINATION_CACHE_FILENAME)
+    if isfile(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                if str(cache["sources"]) == sources:
+                    offsets = cache["offsets"]
+                    rows = cache["rows"]
+                    return {int(chrom): rows[start:stop]
+                            for chrom, start, stop
+                            in zip(cache["chromosomes"], offsets, offsets[1:])}
+        except (OSError, ValueError, KeyError, EOFError, BadZipFile):
+            pass
+
+    chromosomes = sorted(hapmap_files)
+    chrom_data = {chrom: np.array(_read_recombination_file(hapmap_files[chrom]),
+                                  dtype = np.float64).reshape(-1, 3)
+                  for chrom in chromosomes}
+    offsets = np.zeros(len(chromosomes) + 1, dtype = np.int64)
+    np.cumsum([len(chrom_data[chrom]) for chrom in chromosomes],
+              out = offsets[1:])
+    rows = np.concatenate([chrom_data[chrom] for chrom in chromosomes]
+                          or [np.empty((0, 3))])
+    # Write to a temporary file of our own first, so neither a
+    # concurrent reader nor a concurrent writer sees a partial cache.
+    temp_file = None
+    try:
+        handle, temp_file = mkstemp(dir = directory, suffix = ".npz")
+        with fdopen(handle, "wb") as temp:
+            np.savez(temp, sources = np.array(sources),
+                     chromosomes = np.array(chromosomes, dtype = np.int64),
+                     offsets = offsets, rows = rows)
+        replace(temp_file, cache_file)
+    except OSError:
+        if temp_file is not None and isfile(temp_file):
+            remove(temp_file)
+    return chrom_data
+
 def _read_recombination_file(filename):
     """
     Reads a recombination file and returns the rows, with columns
@@ -166,15 +275,6 @@ def read_sex_lengths(filename):
             female_lengths[chromosome] = female_length
     return {Sex.Male: male_lengths, Sex.Female: female_lengths}
 
-def pairwise(iterable):
-    """
-    From https://docs.python.org/3.4/library/itertools.html#itertools-recipes
-    "s -> (s0,s1), (s1,s2), (s2, s3), ..."
-    """
-    a, b = tee(iterable)
-    next(b, None)
-    return zip(a, b)
-        
 class Recombinator():
     def __init__(self, recombination_data):
         """
@@ -185,99 +285,209 @@ class Recombinator():
         self._num_bases = dict()
         # Maps chromosome to the number of centimorgans in the chromosome
         self._num_centimorgans = dict()
-        # The end points of each contiguous segment of bases that
-        # share a recombination rate, measured in cumulative
-        # centimorgans.
-        # For example if the chromosome file has the lines
-        # 554484 0.0015000000 0.0007230750
-        # 555296 0.0015000000 0.0007242930
-        # Then the end point for 554484-555296 will be 0.0007242930
-        self._end_points = dict()
-        # Maps end points to their ranges.
-        self._end_point_range  = dict()
         for chrom, data in recombination_data.items():
-            self._num_bases[chrom] = data[-1][0]
-            self._num_centimorgans[chrom] = data[-1][2]
-            end_points = [row[2] for row in data[1:]]
-            self._end_points[chrom] = end_points
-            range_lookup = dict()
-            for l_1, l_2 in pairwise(data):
-                pos_1 = l_1[0]
-                pos_2 = l_2[0]
-                end_point = l_2[2]
-                range_lookup[end_point] = (pos_1, pos_2)
-            self._end_point_range[chrom] = range_lookup
+            self._num_bases[chrom] = int(data[-1][0])
+            self._num_centimorgans[chrom] = float(data[-1][2])
         ordered_cum_bases = np.cumsum([self._num_bases[chrom]
                                        for chrom in CHROMOSOME_ORDER])
         self._chrom_start_offset = dict(zip(CHROMOSOME_ORDER[1:],
                                             ordered_cum_bases[:-1]))
         self._chrom_start_offset[1] = 0
+        self._build_global_map(recombination_data)
+
+    def _build_global_map(self, recombination_data):
+        """
+        Concatenate the genetic maps of all chromosomes into one map
+        over the whole genome, stored as numpy arrays, so that
+        crossover locations for every chromosome of many meioses can
+        be converted to base pairs at once.
+
+        The map is piecewise linear between the rows of the hapmap
+        file. For example if the chromosome file has the lines
+        554484 0.0015000000 0.0007230750
+        555296 0.0015000000 0.0007242930
+        Then a crossover at 0.0007236840 cM is placed halfway between
+        bases 554484 and 555296. The first row of each chromosome is
+        placed at 0 cM.
+        """
+        bases = np.array([self._num_bases[chrom] for chrom in CHROMOSOME_ORDER],
+                         dtype = np.int64)
+        centimorgans = np.array([self._num_centimorgans[chrom]
+                                 for chrom in CHROMOSOME_ORDER],
+                                dtype = np.float64)
+        cm_offsets = np.concatenate(([0.0], np.cumsum(centimorgans)[:-1]))
+        base_offsets = np.concatenate(([0], np.cumsum(bases)[:-1]))
+        map_centimorgans = []
+        map_bases = []
+        for i, chrom in enumerate(CHROMOSOME_ORDER):
+            data = np.asarray(recombination_data[chrom], dtype = np.float64)
+            chrom_centimorgans = data[:, 2].copy()
+            chrom_centimorgans[0] = 0.0
+            map_centimorgans.append(chrom_centimorgans + cm_offsets[i])
+            map_bases.append(data[:, 0] + base_offsets[i])
+        # Number of bases and crossover probability per base, in
+        # CHROMOSOME_ORDER.
+        self._chrom_bases = bases
+        self._chrom_crossover_p = (centimorgans * 0.01) / bases
+        self._chrom_cm_offsets = cm_offsets
+        self._chrom_cm_ends = cm_offsets + centimorgans
+        self._chrom_ends = base_offsets + bases
+        # Knots of the genome wide genetic map. Chromosome boundaries
+        # appear twice, with the end of one chromosome and the start
+        # of the next.
+        self._map_centimorgans = np.concatenate(map_centimorgans)
+        self._map_bases = np.concatenate(map_bases)
 
-    def _recombination_locations(self, chrom):
+    def _draw_crossovers(self, rng):
         """
-        Given a chromosome name, returns a list of locations where
-        recombination events could happen based on monte carlo
-        methods.
-
-        This is done by first sampling from a binomial distribution to
-        determine the number of recombination events, then repeatedly
-        selecting values uniformly from 0 to the number of
-        centimorgans in a chromosome to determine where the
-        recombination events occur.
+        Draws the crossovers of one meiosis. The number of events per
+        chromosome is sampled from a binomial distribution, then each
+        event is placed uniformly between 0 and the number of
+        centimorgans in its chromosome. Returns the chromosome index
+        and genome wide centimorgan location of each event.
         """
-        bases = self._num_bases[chrom]
-        centimorgans = self._num_centimorgans[chrom]
-        recomb_events = np.random.binomial(bases,
-                                           (centimorgans * 0.01)/ bases)
-        if recomb_events is 0:
-            return []
-        recomb_locations = [uniform(0, centimorgans)
-                            for _ in range(recomb_events)]
-        recomb_locations.sort()
-        loci = []
-        # TODO: Can interp1d be used here?
-        for location in recomb_locations:
-            index = bisect_left(self._end_points[chrom], location)
-            end_point = self._end_points[chrom][index]
-            start, stop = self._end_point_range[chrom][end_point]
-            if index == 0:
-                start_point = 0.0
-            else:
-                start_point = self._end_points[chrom][index - 1]
-            assert location > start_point
-            # fraction_in is the fraction of the way into this region
-            # the recombination event occurs.
-            fraction_in = (location - start_point) / (end_point - start_point)
-            recomb_spot = int((stop - start) * fraction_in + start)
-            if len(loci) == 0 or recomb_spot != loci[-1]:
-                loci.append(recomb_spot)
-        return loci
-
-    def recombination(self, genome):
+        counts = rng.binomial(self._chrom_bases, self._chrom_crossover_p)
+        chroms = np.repeat(np.arange(NUM_CHROMS), counts)
+        locations = rng.uniform(self._chrom_cm_offsets[chroms],
+                                self._chrom_cm_ends[chroms])
+        return (chroms, locations)
+
+    def sample_crossovers(self, rngs, chromosome_choices = False):
+        """
+        Samples the crossovers of one meiosis per random generator in
+        rngs (numpy Generators, or the np.random module). The draws
+        for each meiosis are made from its generator before the next
+        generator is requested, so rngs can be a generator expression
+        over MeiosisRandom.stream.
+
+        Returns (locations, indptr) where
+        locations[indptr[i]:indptr[i + 1]] are the sorted genome wide
+        base pair locations of meiosis i. Consecutive locations form
+        the (start, stop) pairs that are swapped between the two
+        haplotypes; a chromosome with an odd number of events is
+        swapped up to its end.
+
+        If chromosome_choices is True, it also draws which haplotype
+        each chromosome of the gamete is taken from, after the
+        crossovers of each meiosis, and returns (locations, indptr,
+        from_mother), where from_mother[i, c] is True if chromosome c
+        of meiosis i is taken from the first (mother's) haplotype.
+        """
+        meioses = []
+        chroms = []
+        locations = []
+        choices = []
+        num_meioses = 0
+        for rng in rngs:
+            meiosis_chroms, meiosis_locations = self._draw_crossovers(rng)
+            meioses.append(np.full(len(meiosis_chroms), num_meioses))
+            chroms.append(meiosis_chroms)
+            locations.append(meiosis_locations)
+            if chromosome_choices:
+                choices.append(rng.random(NUM_CHROMS) < 0.5)
+            num_meioses += 1
+        if num_meioses == 0:
+            crossovers = (np.empty(0, dtype = np.uint32),
+                          np.zeros(1, dtype = np.int64))
+        else:
+            crossovers = self._crossover_positions(num_meioses,
+                                                   np.concatenate(meioses),
+                                                   np.concatenate(chroms),
+                                                   np.concatenate(locations))
+        if not chromosome_choices:
+            return crossovers
+        from_mother = np.array(choices, dtype = bool).reshape(num_meioses,
+                                                               NUM_CHROMS)
+        return crossovers + (from_mother,)
+
+    def _crossover_positions(self, num_meioses, meioses, chroms, locations):
+        order = np.lexsort((locations, meioses))
+        meioses = meioses[order]
+        chroms = chroms[order]
+        spots = np.interp(locations[order], self._map_centimorgans,
+                          self._map_bases).astype(np.int64)
+        # Drop events that land on the same base pair as the previous
+        # event of the chromosome.
+        keys = meioses * NUM_CHROMS + chroms
+        keep = np.ones(len(spots), dtype = bool)
+        keep[1:] = (spots[1:] != spots[:-1]) | (keys[1:] != keys[:-1])
+        spots = spots[keep]
+        meioses = meioses[keep]
+        odd = np.flatnonzero(np.bincount(keys[keep],
+                                         minlength = num_meioses * NUM_CHROMS)
+                             % 2 == 1)
+        spots = np.concatenate((spots, self._chrom_ends[odd % NUM_CHROMS]))
+        meioses = np.concatenate((meioses, odd // NUM_CHROMS))
+        order = np.lexsort((spots, meioses))
+        indptr = np.zeros(num_meioses + 1, dtype = np.int64)
+        np.cumsum(np.bincount(meioses, minlength = num_meioses),
+                  out = indptr[1:])
+        return (spots[order].astype(np.uint32), indptr)
+
+    def recombination(self, genome, rng = np.random):
         """
         Given a RecombGenome, returns a new RecombGenome object that
         is the product of recombination on the given RecombGenome.
+        Randomness is drawn from rng, which is a numpy Generator (eg.
+        from MeiosisRandom) or the global np.random state.
         """
         assert genome is not None
-        global_locations = []
-        for chrom_name in CHROMOSOME_ORDER:
-            locations = self._recombination_locations(chrom_name)
-            if len(locations) % 2 == 1:
-                locations.append(self._num_bases[chrom_name])
-            # Adjust the locations for our global genome
-            offset = self._chrom_start_offset[chrom_name]
-            global_locations.extend(location + offset
-                                    for location in locations)
+        global_locations, _ = self.sample_crossovers([rng])
         if len(global_locations) == 0:
             return genome
             
-        mother, father = _swap_at_locations(genome.mother,
-                                            genome.father,
-                                            zip(global_locations[::2],
-                                                global_locations[1::2]))
+        mother, father = crossover(genome.mother, genome.father,
+                                   global_locations)
                 
         return RecombGenome(mother, father)
 
+# Meiosis numbers for MeiosisRandom. A child's genome is the product of
+# one meiosis in its mother and one in its father.
+MATERNAL_MEIOSIS = 0
+PATERNAL_MEIOSIS = 1
+
+class MeiosisRandom:
+    """
+    Counter-based random streams for meioses. The stream for a meiosis
+    is a Philox generator keyed by (seed, child node id, meiosis) with
+    its counter starting at 0, so the gametes of any node can be
+    regenerated independently of every other node, in any order and
+    in any process.
+
+    A single generator is rekeyed for each stream rather than
+    constructing a new one, which is much cheaper.
+    """
+    def __init__(self, seed = None):
+        if seed is None:
+            seed = np.random.SeedSequence().generate_state(1, np.uint64)[0]
+        self.seed = int(seed) % 2 ** 64
+        self._key = np.array([self.seed, 0], dtype = np.uint64)
+        self._counter = np.zeros(4, dtype = np.uint64)
+        self._bit_generator = np.random.Philox(key = self._key)
+        self._generator = np.random.Generator(self._bit_generator)
+
+    def stream(self, node_id, meiosis):
+        """
+        Returns the numpy Generator for the given meiosis of node_id.
+        The generator is reused, so it is only valid until the next
+        call to stream.
+        """
+        self._key[1] = 2 * int(node_id) + meiosis
+        self._bit_generator.state = {"bit_generator": "Philox",
+                                     "state": {"counter": self._counter,
+                                               "key": self._key},
+                                     "buffer": self._counter,
+                                     "buffer_pos": 4,
+                                     "has_uint32": 0,
+                                     "uinteger": 0}
+        return self._generator
+
+    def __getstate__(self):
+        return {"seed": self.seed}
+
+    def __setstate__(self, state):
+        self.__init__(state["seed"])
+
 def _swap_at_locations(mother, father, locations):
     """
     Swap elements at the given (start, stop) locations in locations.
@@ -288,31 +498,7 @@ def _swap_at_locations(mother, father, locations):
     flat_locations = np.fromiter(chain.from_iterable(locations),
                                  count = len(locations) * 2,
                                  dtype = np.uint32)
-    new_mother = new_sequence(mother, flat_locations)
-    new_father = new_sequence(father, flat_locations)
-    for start, stop in locations:
-        mother_start_i = bisect_left(new_mother.starts, start)
-        mother_stop_i = bisect_left(new_mother.starts, stop, mother_start_i)
-        father_start_i = bisect_left(new_father.starts, start)
-        father_stop_i = bisect_left(new_father.starts, stop, father_start_i)
-        temp_mother = new_mother.starts[mother_start_i:mother_stop_i]
-        temp_father = new_father.starts[father_start_i:father_stop_i]
-        new_mother.starts[mother_start_i:mother_stop_i], \
-            new_father.starts[father_start_i:father_stop_i] = (temp_father,
-                                                               temp_mother)
-
-        temp_mother = new_mother.founder[mother_start_i:mother_stop_i]
-        temp_father = new_father.founder[father_start_i:father_stop_i]
-        new_mother.founder[mother_start_i:mother_stop_i], \
-            new_father.founder[father_start_i:father_stop_i] = (temp_father,
-                                                                temp_mother)
-    return_mother = Diploid(np.array(new_mother.starts, dtype = np.uint32),
-                            mother.end,
-                            np.array(new_mother.founder, dtype = np.uint32))
-    return_father = Diploid(np.array(new_father.starts, dtype = np.uint32),
-                            father.end,
-                            np.array(new_father.founder, dtype = np.uint32))
-    return (return_mother, return_father)
+    return crossover(mother, father, flat_locations)
         
 def _check_diploid_bounds(diploid):
     """This a useful function for finding bugs in diploid generation."""
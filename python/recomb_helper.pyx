@@ -58,3 +58,116 @@ def new_sequence(diploid, np.ndarray[np.uint32_t, ndim=1] locations):
             starts_i += 1
             locations_i += 1
     return Diploid(new_starts, diploid.end, new_founder)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _crossover(const np.uint32_t[::1] mother_starts,
+                           const np.uint32_t[::1] mother_founder,
+                           const np.uint32_t[::1] father_starts,
+                           const np.uint32_t[::1] father_founder,
+                           const np.uint32_t[::1] locations,
+                           np.uint32_t end,
+                           np.uint32_t[::1] new_mother_starts,
+                           np.uint32_t[::1] new_mother_founder,
+                           np.uint32_t[::1] new_father_starts,
+                           np.uint32_t[::1] new_father_founder,
+                           Py_ssize_t *father_len, bint write) nogil:
+    cdef Py_ssize_t mother_i = 0, father_i = 0, locations_i = 0
+    cdef Py_ssize_t mother_len = mother_starts.shape[0]
+    cdef Py_ssize_t father_starts_len = father_starts.shape[0]
+    cdef Py_ssize_t locations_len = locations.shape[0]
+    cdef Py_ssize_t new_mother_i = 0, new_father_i = 0
+    cdef bint swapped = False
+    cdef bint at_mother, at_father, at_location
+    cdef np.uint32_t location
+    while True:
+        location = end
+        if mother_i < mother_len and mother_starts[mother_i] < location:
+            location = mother_starts[mother_i]
+        if father_i < father_starts_len and father_starts[father_i] < location:
+            location = father_starts[father_i]
+        if (locations_i < locations_len
+            and locations[locations_i] < location):
+            location = locations[locations_i]
+        if location >= end:
+            break
+        at_mother = False
+        while mother_i < mother_len and mother_starts[mother_i] == location:
+            mother_i += 1
+            at_mother = True
+        at_father = False
+        while father_i < father_starts_len and father_starts[father_i] == location:
+            father_i += 1
+            at_father = True
+        at_location = False
+        while (locations_i < locations_len
+               and locations[locations_i] == location):
+            locations_i += 1
+            swapped = not swapped
+            at_location = True
+        # Both sequences are broken at every location, and take each
+        # other's runs between the (start, stop) location pairs.
+        if swapped:
+            if at_father or at_location:
+                if write:
+                    new_mother_starts[new_mother_i] = location
+                    new_mother_founder[new_mother_i] = father_founder[father_i - 1]
+                new_mother_i += 1
+            if at_mother or at_location:
+                if write:
+                    new_father_starts[new_father_i] = location
+                    new_father_founder[new_father_i] = mother_founder[mother_i - 1]
+                new_father_i += 1
+        else:
+            if at_mother or at_location:
+                if write:
+                    new_mother_starts[new_mother_i] = location
+                    new_mother_founder[new_mother_i] = mother_founder[mother_i - 1]
+                new_mother_i += 1
+            if at_father or at_location:
+                if write:
+                    new_father_starts[new_father_i] = location
+                    new_father_founder[new_father_i] = father_founder[father_i - 1]
+                new_father_i += 1
+    father_len[0] = new_father_i
+    return new_mother_i
+
+def crossover(mother, father, locations):
+    """
+    Returns new (mother, father) diploids where the runs of founders in
+    the intervals [start, stop) of each consecutive (start, stop) pair
+    in the sorted array locations are swapped between mother and
+    father. Both diploids are broken at every location, as with
+    new_sequence. This is done in one merge pass over the starts of
+    both diploids and the locations, writing straight into the result
+    arrays.
+    """
+    cdef const np.uint32_t[::1] mother_starts = np.ascontiguousarray(mother.starts, dtype = np.uint32)
+    cdef const np.uint32_t[::1] mother_founder = np.ascontiguousarray(mother.founder, dtype = np.uint32)
+    cdef const np.uint32_t[::1] father_starts = np.ascontiguousarray(father.starts, dtype = np.uint32)
+    cdef const np.uint32_t[::1] father_founder = np.ascontiguousarray(father.founder, dtype = np.uint32)
+    cdef const np.uint32_t[::1] breaks = np.ascontiguousarray(locations, dtype = np.uint32)
+    cdef np.uint32_t end = mother.end
+    cdef np.uint32_t[::1] empty = np.empty(0, dtype = np.uint32)
+    cdef Py_ssize_t mother_len, father_len
+    # The first pass only counts, so the results are allocated exactly.
+    with nogil:
+        mother_len = _crossover(mother_starts, mother_founder,
+                                father_starts, father_founder, breaks, end,
+                                empty, empty, empty, empty, &father_len,
+                                False)
+    new_mother_starts = np.empty(mother_len, dtype = np.uint32)
+    new_mother_founder = np.empty(mother_len, dtype = np.uint32)
+    new_father_starts = np.empty(father_len, dtype = np.uint32)
+    new_father_founder = np.empty(father_len, dtype = np.uint32)
+    cdef np.uint32_t[::1] mother_starts_view = new_mother_starts
+    cdef np.uint32_t[::1] mother_founder_view = new_mother_founder
+    cdef np.uint32_t[::1] father_starts_view = new_father_starts
+    cdef np.uint32_t[::1] father_founder_view = new_father_founder
+    with nogil:
+        _crossover(mother_starts, mother_founder, father_starts,
+                   father_founder, breaks, end, mother_starts_view,
+                   mother_founder_view, father_starts_view,
+                   father_founder_view, &father_len, True)
+    return (Diploid(new_mother_starts, mother.end, new_mother_founder),
+            Diploid(new_father_starts, father.end, new_father_founder))
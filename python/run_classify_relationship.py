@@ -5,17 +5,19 @@ from random import sample
 from itertools import chain
 from pickle import dump
 from os import listdir
-from os.path import dirname, join, abspath
+from os.path import dirname, join, abspath, exists
 
-from population import PopulationUnpickler, fix_twin_parents
+from population_file import load_population
 from sex import Sex
-from classify_relationship import generate_classifier, related_pairs
+from classify_relationship import (generate_classifier, related_pairs,
+                                   SIMULATION_FILENAME)
+from read_binary_simulation import BinarySimulationDeserializer
 from recomb_genome import recombinators_from_directory, RecombGenomeGenerator
 from cm import centimorgan_data_from_directory
 from to_json import to_json
 
 parser = ArgumentParser(description = "Generate a classifier which can (hopefully) identify individuals in a population.")
-parser.add_argument("population_file", help = "Pickled file with population")
+parser.add_argument("population_file", help = "Population file (binary or pickled)")
 parser.add_argument("work_dir",
                     help = "Directory to put shared length calculations in.")
 parser.add_argument("num_iterations", type = int, default = 1000,
@@ -31,15 +33,17 @@ parser.add_argument("--output_pickle", default = "distributions.pickle",
                     help = "File to store distributions in. Pickle format will be used. Default is 'distributions.pickle'")
 parser.add_argument("--non_paternity", "-np", type = float, default = 0.0,
                     help = "Non paternity rate for the adversary to assume.")
+parser.add_argument("--processes", type = int, default = 1,
+                    help = "Number of worker processes running simulation iterations.")
+parser.add_argument("--seed", type = int, default = None,
+                    help = "Seed for the simulated genomes. The seed is recorded next to the simulation, so --recover resumes with it.")
 parser.add_argument("--to_json", default = None,
                     help = "If this flag is present, will instead store the population as json for faster computation in another language")
 
 args = parser.parse_args()
 
 print("Loading population")
-with open(args.population_file, "rb") as pickle_file:
-    population = PopulationUnpickler(pickle_file).load()
-fix_twin_parents(population)
+population = load_population(args.population_file)
 
 if not args.recover:
     potentially_labeled = list(chain.from_iterable([generation.members
@@ -52,8 +56,13 @@ if not args.recover:
     labeled_nodes = sample(potentially_labeled, num_labeled_nodes)
 else:
     print("Recovering run")
-    labeled_nodes = [population.id_mapping[int(filename)]
-                     for filename in listdir(args.work_dir)]
+    simulation_file = join(args.work_dir, SIMULATION_FILENAME)
+    if exists(simulation_file):
+        anchors = BinarySimulationDeserializer(simulation_file).anchors
+        labeled_nodes = [population.id_mapping[anchor] for anchor in anchors]
+    else:
+        labeled_nodes = [population.id_mapping[int(filename)]
+                         for filename in listdir(args.work_dir)]
 
 if args.to_json:
     num_generations = population.num_generations
@@ -61,9 +70,7 @@ if args.to_json:
     to_clear = population.generations[clear_index].members
     for node in to_clear:
         node.suspected_mother = None
-        node.suspected_mother_id = None
         node.suspected_father = None
-        node.suspected_father_id = None
     unlabeled_nodes = set(chain.from_iterable(generation.members
                                           for generation
                                           in population.generations[-3:]))
@@ -93,7 +100,9 @@ classifier = generate_classifier(population, labeled_nodes,
                                  clobber = clobber,
                                  generations_back_shared = args.gen_back,
                                  min_segment_length = 5000000,
-                                 non_paternity = args.non_paternity)
+                                 non_paternity = args.non_paternity,
+                                 processes = args.processes,
+                                 seed = args.seed)
 
 del recombinators
 del labeled_nodes
@@ -2,58 +2,40 @@ from itertools import combinations
 from random import sample
 from time import perf_counter
 
-import threading
-import pdb
-
 import numpy as np
 # import pyximport; pyximport.install()
 
-from population import PopulationUnpickler
-from classify_relationship import shared_segment_length_genomes
+from population_file import load_population
+from founder_signature import founder_signatures
+from pairwise_ibd import pairwise_ibd
+from shared_segment_detector import SharedSegmentDetector
+from cm import centimorgan_data_from_directory
 
 print("Loading population")
-with open("population_10000.pickle", "rb") as pickle_file:
-    population = PopulationUnpickler(pickle_file).load()
-
-
-def calculate_to_list(pairs, lengths):
-    lengths.extend(shared_segment_length_genomes(node_a.genome, node_b.genome,
-                                                 0)
-                   for node_a, node_b in pairs)
-
-                   
-# print("Comparing pairs.")
-# nodes = population.generations[-1].members
-# nodes = sample(nodes, 1500)
-# pairs = list(combinations(nodes, 2))
-# lengths = []
-# start = perf_counter()
-# boundary = len(pairs) // 2
-# thread_1 = threading.Thread(target=calculate_to_list,
-#                             args = (pairs[:boundary], lengths))
-# thread_2 = threading.Thread(target=calculate_to_list,
-#                             args = (pairs[boundary:], lengths))
-# thread_1.start()
-# thread_2.start()
-# thread_1.join()
-# thread_2.join()
-# stop = perf_counter()
-# print(stop - start)
+population = load_population("population_10000.pickle")
+
+recomb_data = centimorgan_data_from_directory("../data/recombination_rates/")
+ibd_detector = SharedSegmentDetector(recomb_data, 0)
 
 print("Comparing pairs.")
 nodes = population.generations[-1].members
 nodes = sample(nodes, 1500)
 start = perf_counter()
-lengths = [shared_segment_length_genomes(node_a.genome, node_b.genome, 0)
+lengths = [ibd_detector.shared_segment_length(node_a.genome, node_b.genome)
            for node_a, node_b in combinations(nodes, 2)]
 stop = perf_counter()
 print(stop - start)
 
-# import pdb
-# pdb.set_trace()
-# shared = [len(np.flatnonzero(np.unpackbits(a.genome._founder_bits & b.genome._founder_bits)))
-#           for a, b in combinations(nodes, 2)]
+for processes in (1, 2, 4):
+    start = perf_counter()
+    matrix = pairwise_ibd(ibd_detector, nodes, processes = processes)
+    stop = perf_counter()
+    print(processes, stop - start)
+
+signatures = founder_signatures(node.genome for node in nodes)
+shared = [int(np.unpackbits((signatures[a] & signatures[b]).view(np.uint8)).sum())
+          for a, b in combinations(range(len(nodes)), 2)]
 
-# print(np.average(shared))
-# print(np.std(shared))
-# print(max(lengths))
+print(np.average(shared))
+print(np.std(shared))
+print(max(lengths))
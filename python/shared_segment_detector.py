@@ -1,7 +1,9 @@
 import numpy as np
 
-from common_segments import common_segment_ibd
+from common_segments import common_segment_ibd, SegmentFilter
 from cm import cm_lengths
+from founder_index import FounderIndex
+from founder_signature import founder_signatures, share_founders
 
 
 class SharedSegmentDetector:
@@ -16,6 +18,20 @@ class SharedSegmentDetector:
         self.minimum_base_length = minimum_base_length
         self.minimum_cm_length = float(minimum_cm_length)
         self.recomb_data = recomb_data
+        self._native_filter = None
+
+    def _segment_filter_native(self):
+        # Detectors pickled before the native filter existed lack it.
+        if getattr(self, "_native_filter", None) is None:
+            self._native_filter = SegmentFilter(self.recomb_data,
+                                                self.minimum_base_length,
+                                                self.minimum_cm_length)
+        return self._native_filter
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_native_filter"] = None
+        return state
 
     def _segment_filter(self, segments):
         if len(segments) == 0:
@@ -39,10 +55,61 @@ class SharedSegmentDetector:
                 if boolean]
 
     def shared_segment_length(self, genome_a, genome_b):
-        segments = common_segment_ibd(genome_a, genome_b, self._segment_filter)
-        if len(segments) == 0:
-            return 0.0
-        starts, stops = list(zip(*segments))
-        np_starts = np.array(starts, dtype = np.uint32)
-        np_stops = np.array(stops, dtype = np.uint32)
-        return float(np.sum(cm_lengths(starts, stops, self.recomb_data)))
+        """
+        Centimorgans genome_a and genome_b share IBD in segments that
+        pass the detection cutoffs, computed by the fused native
+        kernel. ibd_segments returns the segments themselves.
+        """
+        return self._segment_filter_native().shared_segment_length(genome_a,
+                                                                   genome_b)
+
+    def ibd_segments(self, genome_a, genome_b):
+        """
+        List of the (start, stop) IBD segments counted by
+        shared_segment_length, for debugging.
+        """
+        return common_segment_ibd(genome_a, genome_b, self._segment_filter)
+
+    def shared_segment_lengths(self, genome, genomes):
+        """
+        Returns a float64 array with the centimorgans genome shares
+        IBD with each genome in genomes, as shared_segment_length
+        would. The genomes are compared in one native loop, with the
+        base and centimorgan cutoffs applied by the kernel.
+
+        genomes can be a FounderIndex, in which case IBD is only
+        computed for the genomes that carry a founder of genome over
+        an overlapping interval, and is zero for the rest.
+        """
+        native_filter = self._segment_filter_native()
+        if not isinstance(genomes, FounderIndex):
+            return native_filter.shared_segment_lengths(genome, list(genomes))
+        shared = np.zeros(len(genomes), dtype = np.float64)
+        candidates = genomes.candidates(genome)
+        shared[candidates] = native_filter.shared_segment_lengths(
+            genome, [genomes.genome(i) for i in candidates.tolist()])
+        return shared
+
+    def pair_shared_segment_lengths(self, genomes_a, genomes_b,
+                                    signatures_a = None, signatures_b = None):
+        """
+        Returns a float64 array with the centimorgans genomes_a[i] and
+        genomes_b[i] share IBD for each i. Pairs whose founder
+        signatures have no bit in common are 0 without running the
+        kernel. Signatures (eg. from GenomeArena.founder_signatures)
+        are computed if they aren't given.
+        """
+        genomes_a = list(genomes_a)
+        genomes_b = list(genomes_b)
+        assert len(genomes_a) == len(genomes_b)
+        if signatures_a is None:
+            signatures_a = founder_signatures(genomes_a)
+        if signatures_b is None:
+            signatures_b = founder_signatures(genomes_b)
+        shared = np.zeros(len(genomes_a), dtype = np.float64)
+        native_filter = self._segment_filter_native()
+        for i in np.flatnonzero(share_founders(signatures_a,
+                                               signatures_b)).tolist():
+            shared[i] = native_filter.shared_segment_length(genomes_a[i],
+                                                            genomes_b[i])
+        return shared
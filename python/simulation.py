@@ -0,0 +1,261 @@
+"""
+Simulation of the empirical IBD distributions of related pairs.
+
+Each iteration regenerates the genomes of the population along the
+suspected genealogy and records the IBD of every (unlabeled, labeled)
+pair. Results are written in the layout read by
+BinarySimulationDeserializer, which is also written by the Rust
+simulator:
+
+    header length in bytes (uint64)
+    (labeled id, unlabeled id) pairs (uint32, uint32), sorted
+    one row of float64 IBD values per iteration, in header order
+
+All values are little endian.
+"""
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from os import SEEK_END
+from os.path import exists
+from struct import pack, unpack
+
+import numpy as np
+
+from generation import Generation
+from genome_arena import GenomeArena
+from node import NodeGenerator
+from pedigree import PedigreeArrays
+from population import Population
+from population_genomes import generate_genomes
+
+FLOAT_SIZE = 8
+_PAIR_DTYPE = np.dtype("<u4")
+_SHARED_COLUMNS = ("father", "mother", "suspected_father", "suspected_mother",
+                   "twin", "sex", "generation")
+
+class SimulationFileError(Exception):
+    pass
+
+class SimulationSerializer:
+    """
+    Appends one row of IBD values per iteration to a simulation file.
+    If the file exists and clobber is False, its header must match
+    pairs, and a partially written last row is dropped, so an
+    interrupted simulation can be resumed from completed_iterations.
+    """
+    def __init__(self, filename, pairs, clobber = False):
+        """
+        pairs is a list of (labeled id, unlabeled id) pairs, in the
+        order of the values of each row.
+        """
+        self._pairs = np.array(pairs, dtype = _PAIR_DTYPE).reshape(-1, 2)
+        header = self._pairs.tobytes()
+        if clobber or not exists(filename):
+            self._file = open(filename, "wb")
+            self._file.write(pack("<Q", len(header)))
+            self._file.write(header)
+            self._file.flush()
+            self.completed_iterations = 0
+            return
+        self._file = open(filename, "r+b")
+        header_length = unpack("<Q", self._file.read(8))[0]
+        if self._file.read(header_length) != header:
+            self._file.close()
+            raise SimulationFileError("{} was written for different pairs.".format(filename))
+        data_start = 8 + header_length
+        row_size = FLOAT_SIZE * len(self._pairs)
+        self._file.seek(0, SEEK_END)
+        data_size = self._file.tell() - data_start
+        if row_size == 0:
+            self.completed_iterations = 0
+        else:
+            self.completed_iterations = data_size // row_size
+        self._file.truncate(data_start + self.completed_iterations * row_size)
+        self._file.seek(0, SEEK_END)
+
+    def write(self, shared):
+        """
+        Write the IBD values of one iteration, in the order of pairs.
+        """
+        shared = np.asarray(shared, dtype = "<f8")
+        assert shared.shape == (len(self._pairs),)
+        self._file.write(shared.tobytes())
+        self._file.flush()
+        self.completed_iterations += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def seed_filename(filename):
+    """
+    Name of the file next to a simulation file that records the seed
+    its iterations were generated with.
+    """
+    return filename + ".seed"
+
+def _simulation_seed(filename, seed, resuming):
+    """
+    Returns the seed of the simulation in filename, recording it next
+    to the file. A resumed simulation continues with its recorded
+    seed, so it can't be resumed with a different one, or without one
+    if none was recorded.
+    """
+    seed_file = seed_filename(filename)
+    recorded = None
+    if resuming and exists(seed_file):
+        with open(seed_file) as seed_input:
+            recorded = int(seed_input.read())
+    if resuming and recorded is None and seed is None:
+        raise SimulationFileError("No seed is recorded for {}, the seed it was started with must be given to resume it.".format(filename))
+    if recorded is not None and seed is not None and recorded != seed:
+        raise SimulationFileError("{} was started with seed {}.".format(filename, recorded))
+    if recorded is not None:
+        return recorded
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1, np.uint64)[0])
+    with open(seed_file, "w") as seed_output:
+        seed_output.write(str(seed))
+    return seed
+
+def iteration_seed(seed, iteration):
+    """
+    Seed of the genomes generated in the given iteration.
+    """
+    return int(np.random.SeedSequence([seed, iteration]).generate_state(1, np.uint64)[0])
+
+def _simulation_population(pedigree, generation_ids):
+    """
+    Returns a population over pedigree with its own genome store, so
+    simulated genomes don't replace the genomes of the population the
+    pedigree came from.
+    """
+    generator = NodeGenerator(pedigree)
+    generator._genomes = GenomeArena()
+    population = Population()
+    population._generations = [Generation.from_ids(generator, ids)
+                               for ids in generation_ids]
+    return population
+
+def _simulate_iteration(state, iteration):
+    population, pairs, genome_generator, recombinators, ibd_detector, \
+        keep_last, seed = state
+    population.node_generator._genomes.clear()
+    genome_generator.reset()
+    generate_genomes(population, genome_generator, recombinators, keep_last,
+                     true_genealogy = False,
+                     seed = iteration_seed(seed, iteration))
+    genomes = population.node_generator._genomes
+    labeled_ids = pairs[:, 0]
+    unlabeled_ids = pairs[:, 1]
+    # The arena already holds the founder signatures of its genomes.
+    return np.asarray(ibd_detector.pair_shared_segment_lengths(
+        [genomes[node_id] for node_id in unlabeled_ids.tolist()],
+        [genomes[node_id] for node_id in labeled_ids.tolist()],
+        genomes.founder_signatures(unlabeled_ids),
+        genomes.founder_signatures(labeled_ids)), dtype = np.float64)
+
+_worker_state = None
+_worker_memory = None
+
+def _init_simulation_worker(shared_columns, generation_bounds, pairs,
+                            genome_generator, recombinators, ibd_detector,
+                            keep_last, seed):
+    global _worker_state, _worker_memory
+    _worker_memory = []
+    columns = {name: attach_array(shared, _worker_memory)
+               for name, shared in shared_columns.items()}
+    generation_ids = columns.pop("generation_ids")
+    pedigree = PedigreeArrays.from_columns(columns)
+    population = _simulation_population(pedigree,
+                                        [generation_ids[start:stop]
+                                         for start, stop in generation_bounds])
+    _worker_state = (population, pairs, genome_generator, recombinators,
+                     ibd_detector, keep_last, seed)
+
+def _simulate_worker_iteration(iteration):
+    return _simulate_iteration(_worker_state, iteration)
+
+def share_array(array, memory):
+    """
+    Copy a 1-D array into a new block of shared memory, which is
+    appended to memory. Returns the description of the block that
+    attach_array takes.
+    """
+    array = np.ascontiguousarray(array)
+    block = SharedMemory(create = True, size = max(array.nbytes, 1))
+    memory.append(block)
+    np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[:] = array
+    return (block.name, array.dtype.str, len(array))
+
+def attach_array(shared, memory):
+    """
+    Returns the array shared by share_array, given its description.
+    The attached block is appended to memory, and must be kept open
+    while the array is used.
+    """
+    memory_name, dtype, length = shared
+    block = SharedMemory(memory_name)
+    memory.append(block)
+    return np.ndarray(length, dtype = dtype, buffer = block.buf)
+
+def simulate(population, pairs, genome_generator, recombinators,
+             ibd_detector, filename, iterations, processes = 1,
+             seed = None, keep_last = 3, clobber = False):
+    """
+    Run iterations of the simulation for pairs, a list of (unlabeled
+    node, labeled node) pairs, writing the IBD measured by
+    ibd_detector to filename. Genomes are generated along the
+    suspected genealogy, keeping only the last keep_last generations.
+
+    Iteration i uses genomes seeded by seed and i. The seed (drawn at
+    random if not given) is recorded in seed_filename(filename), so an
+    interrupted simulation resumes where it stopped with the same
+    seed, and the result doesn't depend on the number of processes. Worker processes
+    share the pedigree through shared memory. Returns the number of
+    completed iterations.
+    """
+    id_pairs = sorted(set((labeled._id, unlabeled._id)
+                          for unlabeled, labeled in pairs))
+    with SimulationSerializer(filename, id_pairs, clobber) as serializer:
+        seed = _simulation_seed(filename, seed,
+                                serializer.completed_iterations > 0)
+        remaining = range(serializer.completed_iterations, iterations)
+        if len(remaining) == 0:
+            return serializer.completed_iterations
+        id_pairs = np.array(id_pairs, dtype = np.int64).reshape(-1, 2)
+        pedigree = population.node_generator.pedigree
+        generation_ids = [generation.ids for generation in population.generations]
+        if processes <= 1:
+            state = (_simulation_population(pedigree, generation_ids),
+                     id_pairs, genome_generator, recombinators, ibd_detector,
+                     keep_last, seed)
+            for iteration in remaining:
+                serializer.write(_simulate_iteration(state, iteration))
+            return serializer.completed_iterations
+
+        memory = []
+        try:
+            shared_columns = {name: share_array(getattr(pedigree, name)[:len(pedigree)],
+                                                 memory)
+                              for name in _SHARED_COLUMNS}
+            shared_columns["generation_ids"] = share_array(np.concatenate(generation_ids),
+                                                            memory)
+            bounds = np.cumsum([0] + [len(ids) for ids in generation_ids]).tolist()
+            generation_bounds = list(zip(bounds[:-1], bounds[1:]))
+            with Pool(processes, _init_simulation_worker,
+                      (shared_columns, generation_bounds, id_pairs,
+                       genome_generator, recombinators, ibd_detector,
+                       keep_last, seed)) as pool:
+                for shared in pool.imap(_simulate_worker_iteration, remaining):
+                    serializer.write(shared)
+        finally:
+            for block in memory:
+                block.close()
+                block.unlink()
+        return serializer.completed_iterations
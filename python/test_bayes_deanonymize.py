@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from bayes_deanonymize import BayesDeanonymize
+from classify_relationship import LengthClassifier
+from data_logging import stop_logging, start_logging
+from population_genomes import generate_genomes
+from recomb_genome import RecombGenomeGenerator
+from sex import Sex
+from shared_segment_detector import SharedSegmentDetector
+from fixtures import (uniform_recombinators, uniform_cm_data,
+                      founder_population)
+
+class RecordingDetector(SharedSegmentDetector):
+    """
+    SharedSegmentDetector that keeps the lengths of the last
+    shared_segment_lengths call.
+    """
+    def shared_segment_lengths(self, genome, genomes):
+        self.shared = super().shared_segment_lengths(genome, genomes)
+        return self.shared
+
+class TestIdentify(unittest.TestCase):
+    def setUp(self):
+        stop_logging()
+        self.addCleanup(start_logging)
+        self.population = founder_population(1, num_founders = 10, size = 20,
+                                             num_generations = 1)
+        recombinators = uniform_recombinators()
+        generator = RecombGenomeGenerator(recombinators[Sex.Male]._num_bases)
+        generate_genomes(self.population, generator, recombinators, seed = 1)
+        self.members = self.population.generations[-1].members
+        self.anchor_ids = sorted(node._id for node in self.members[:6])
+        classifier = LengthClassifier(dict(), list(self.anchor_ids))
+        self.bayes = BayesDeanonymize(self.population, classifier,
+                                      probability_logging = False)
+        self.detector = RecordingDetector(uniform_cm_data(), 0)
+
+    def _expected(self, genome):
+        id_map = self.population.id_mapping
+        return [self.detector.shared_segment_length(genome,
+                                                    id_map[anchor_id].suspected_genome)
+                for anchor_id in self.anchor_ids]
+
+    def test_reassigned_suspected_genome(self):
+        unlabeled = self.members[10]
+        genome = unlabeled.genome
+        self.bayes.identify(genome, unlabeled, self.detector)
+        np.testing.assert_allclose(self.detector.shared,
+                                   self._expected(genome))
+        # An anchor whose suspected genome is the query genome shares
+        # all of it, which a stale anchor index would miss.
+        anchor = self.population.id_mapping[self.anchor_ids[2]]
+        anchor.suspected_genome = genome
+        self.bayes.identify(genome, unlabeled, self.detector)
+        expected = self._expected(genome)
+        np.testing.assert_allclose(self.detector.shared, expected)
+        self.assertEqual(np.argmax(self.detector.shared), 2)
+        anchor.suspected_genome = None
+        self.bayes.identify(genome, unlabeled, self.detector)
+        np.testing.assert_allclose(self.detector.shared,
+                                   self._expected(genome))
+
+if __name__ == '__main__':
+    unittest.main()
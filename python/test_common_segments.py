@@ -8,7 +8,11 @@ import numpy as np
 # import pyximport; pyximport.install()
 from common_segments import common_homolog_segments, _consolidate_sequence, merge_overlaps, subtract_region, size_of_overlap, remove_inbreeding
 
-from cm import cm_lengths, cumulative_cm
+from cm import cm_lengths, cumulative_cm, CentimorganData
+from founder_index import FounderIndex
+from founder_signature import founder_signatures, share_founders
+from shared_segment_detector import SharedSegmentDetector
+from fixtures import related_genomes
 
 uint32 = np.uint32
 
@@ -405,6 +409,86 @@ class TestRemoveInbreeding(unittest.TestCase):
                                            [(10, 20), (20, 30)], [(10, 20)]),
                          [(10, 20), (20, 30)])
 
-    
+class TestSharedSegmentLengths(unittest.TestCase):
+    def setUp(self):
+        self.genomes = related_genomes()
+        # Map points every megabase with uneven rates.
+        rng = np.random.RandomState(5)
+        bases = np.arange(0, 220000001, 1000000, dtype = np.uint32)
+        cm = np.concatenate(([0.0], np.cumsum(rng.uniform(0.1, 2.0,
+                                                          len(bases) - 1))))
+        rates = np.append(np.diff(cm) / 1000000, 0.0)
+        self.cm_data = CentimorganData(bases, cm, rates)
+
+    def _list_length(self, detector, genome_a, genome_b):
+        segments = detector.ibd_segments(genome_a, genome_b)
+        if len(segments) == 0:
+            return 0.0
+        starts, stops = zip(*segments)
+        return float(np.sum(cm_lengths(starts, stops, self.cm_data)))
+
+    def test_matches_segment_lists(self):
+        for base_cutoff, cm_cutoff in ((0, 0.0), (5000000, 0.0),
+                                       (1000000, 3.0)):
+            detector = SharedSegmentDetector(self.cm_data, base_cutoff,
+                                             cm_cutoff)
+            for genome in self.genomes[-4:]:
+                expected = [self._list_length(detector, genome, other)
+                            for other in self.genomes]
+                single = [detector.shared_segment_length(genome, other)
+                          for other in self.genomes]
+                np.testing.assert_allclose(single, expected, atol = 1e-9)
+                shared = detector.shared_segment_lengths(genome, self.genomes)
+                self.assertEqual(shared.dtype, np.float64)
+                np.testing.assert_allclose(shared, expected, atol = 1e-9)
+                self.assertGreater(np.count_nonzero(shared), 0)
+
+    def test_founder_index(self):
+        detector = SharedSegmentDetector(self.cm_data, 0)
+        index = FounderIndex(self.genomes)
+        for genome in self.genomes:
+            shared = detector.shared_segment_lengths(genome, self.genomes)
+            candidates = index.candidates(genome)
+            self.assertTrue(set(np.flatnonzero(shared)) <= set(candidates))
+            self.assertLess(len(candidates), len(self.genomes))
+            np.testing.assert_array_equal(
+                detector.shared_segment_lengths(genome, index), shared)
+        # Founder 0 is the mother haplotype of the first founder and
+        # is carried by its children.
+        owners, haplotypes, starts, stops = index.postings(0)
+        self.assertIn(0, owners[haplotypes == 0].tolist())
+        self.assertEqual(len(starts), len(stops))
+        self.assertEqual(len(FounderIndex([]).candidates(self.genomes[0])), 0)
+        # Genomes can be looked up instead of being kept by the index.
+        lookup = FounderIndex(iter(self.genomes), self.genomes.__getitem__)
+        self.assertEqual(len(lookup), len(self.genomes))
+        self.assertIs(lookup.genome(3), self.genomes[3])
+        np.testing.assert_array_equal(
+            detector.shared_segment_lengths(self.genomes[-1], lookup),
+            detector.shared_segment_lengths(self.genomes[-1], self.genomes))
+
+    def test_pair_lengths(self):
+        detector = SharedSegmentDetector(self.cm_data, 0)
+        pairs = [(a, b) for a in range(len(self.genomes))
+                 for b in range(a, len(self.genomes))]
+        genomes_a = [self.genomes[a] for a, _ in pairs]
+        genomes_b = [self.genomes[b] for _, b in pairs]
+        shared = detector.pair_shared_segment_lengths(genomes_a, genomes_b)
+        expected = [detector.shared_segment_length(a, b)
+                    for a, b in zip(genomes_a, genomes_b)]
+        np.testing.assert_array_equal(shared, expected)
+        # Founders 0 to 3 share no founders.
+        self.assertEqual(shared[1], 0.0)
+        self.assertFalse(share_founders(founder_signatures([genomes_a[1]]),
+                                        founder_signatures([genomes_b[1]]))[0])
+
+    def test_past_end_of_map(self):
+        cm_data = CentimorganData(self.cm_data.bases[:10],
+                                  self.cm_data.cm[:10],
+                                  self.cm_data.rates[:10])
+        detector = SharedSegmentDetector(cm_data, 0)
+        with self.assertRaises(ValueError):
+            detector.shared_segment_lengths(self.genomes[0], self.genomes[:1])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import pickle
+import unittest
+
+import numpy as np
+
+from diploid import Diploid
+from founder_signature import founder_signatures, share_founders
+from genome_arena import GenomeArena, NO_GENOME
+from recomb_genome import RecombGenome, writable_genome
+
+def _genome(mother_starts, mother_founder, father_starts, father_founder,
+            end = 100):
+    return RecombGenome(Diploid(np.array(mother_starts, dtype = np.uint32),
+                                end,
+                                np.array(mother_founder, dtype = np.uint32)),
+                        Diploid(np.array(father_starts, dtype = np.uint32),
+                                end,
+                                np.array(father_founder, dtype = np.uint32)))
+
+def _lists(genome):
+    return (genome.mother.starts.tolist(), genome.mother.founder.tolist(),
+            genome.father.starts.tolist(), genome.father.founder.tolist(),
+            genome.mother.end, genome.father.end)
+
+class TestGenomeArena(unittest.TestCase):
+    def setUp(self):
+        self.arena = GenomeArena(capacity = 4)
+        self.a = _genome([0, 10], [1, 2], [0], [3])
+        self.b = _genome([0, 50, 70], [4, 5, 6], [0, 20], [7, 8])
+
+    def test_set_get(self):
+        self.arena[3] = self.a
+        self.arena.set_many([5000, 1], [self.b, self.a])
+        self.assertEqual(_lists(self.arena[3]), _lists(self.a))
+        self.assertEqual(_lists(self.arena[5000]), _lists(self.b))
+        self.assertEqual(_lists(self.arena[1]), _lists(self.a))
+        self.assertIs(self.arena[3], self.arena[3])
+        self.assertEqual(sorted(self.arena), [1, 3, 5000])
+        self.assertEqual(len(self.arena), 3)
+        self.assertNotIn(2, self.arena)
+        self.assertNotIn(10 ** 6, self.arena)
+        self.assertEqual(self.arena.slot(2), NO_GENOME)
+        with self.assertRaises(KeyError):
+            self.arena[2]
+        starts, founder = self.arena.haplotype(self.arena.slot(5000), 0)
+        self.assertEqual(starts.tolist(), [0, 50, 70])
+        self.assertEqual(founder.tolist(), [4, 5, 6])
+
+    def test_shared_slot(self):
+        self.arena[0] = self.b
+        self.arena[1] = self.arena[0]
+        self.assertEqual(self.arena.slot(0), self.arena.slot(1))
+        self.assertIs(self.arena[0], self.arena[1])
+        nbytes = self.arena.nbytes
+        del self.arena[0]
+        self.assertEqual(self.arena.nbytes, nbytes)
+        self.assertEqual(_lists(self.arena[1]), _lists(self.b))
+
+    def test_copy_on_write(self):
+        self.arena[0] = self.b
+        self.arena[1] = self.arena[0]
+        with self.assertRaises(ValueError):
+            self.arena[1].mother.founder[0] = 9
+        genome = writable_genome(self.arena[1])
+        genome.mother.founder[0] = 9
+        self.arena[1] = genome
+        self.assertNotEqual(self.arena.slot(0), self.arena.slot(1))
+        self.assertEqual(self.arena[1].mother.founder.tolist(), [9, 5, 6])
+        self.assertEqual(_lists(self.arena[0]), _lists(self.b))
+
+    def test_delete_and_compact(self):
+        self.arena.set_many(range(6), [self.a, self.b] * 3)
+        for node_id in (0, 2, 3, 4):
+            del self.arena[node_id]
+        with self.assertRaises(KeyError):
+            del self.arena[0]
+        self.assertEqual(sorted(self.arena), [1, 5])
+        # Compacted down to two copies of b, 4 bytes per start and
+        # founder.
+        self.assertEqual(self.arena.nbytes,
+                         2 * 2 * 4 * (len(self.b.mother.starts)
+                                      + len(self.b.father.starts)))
+        self.assertEqual(_lists(self.arena[1]), _lists(self.b))
+        self.assertEqual(_lists(self.arena[5]), _lists(self.b))
+        # Assigning over a node replaces its genome.
+        self.arena[5] = self.a
+        self.assertEqual(_lists(self.arena[5]), _lists(self.a))
+        self.arena.clear()
+        self.assertEqual(len(self.arena), 0)
+        self.assertEqual(self.arena.nbytes, 0)
+
+    def test_pickle(self):
+        self.arena.set_many([0, 2], [self.a, self.b])
+        self.arena[7] = self.arena[2]
+        del self.arena[0]
+        arena = pickle.loads(pickle.dumps(self.arena))
+        self.assertEqual(sorted(arena), [2, 7])
+        self.assertEqual(_lists(arena[2]), _lists(self.b))
+        self.assertIs(arena[2], arena[7])
+        arena[3] = self.a
+        self.assertEqual(_lists(arena[3]), _lists(self.a))
+        np.testing.assert_array_equal(arena.founder_signatures([2, 7, 3]),
+                                      founder_signatures([self.b, self.b,
+                                                          self.a]))
+
+    def test_founder_signatures(self):
+        c = _genome([0], [4097], [0, 50], [9, 3])
+        self.arena.set_many([0, 1, 2], [self.a, self.b, c])
+        self.arena[3] = self.arena[1]
+        signatures = self.arena.founder_signatures([0, 1, 2, 3])
+        np.testing.assert_array_equal(signatures,
+                                      founder_signatures([self.a, self.b, c,
+                                                          self.b]))
+        # a has founders 1, 2, 3, c has 4097 (bit 1), 9 and 3.
+        self.assertEqual(share_founders(signatures[0], signatures).tolist(),
+                         [True, False, True, False])
+        self.arena[0] = self.b
+        self.assertTrue(share_founders(self.arena.founder_signatures([0]),
+                                       signatures[1:2])[0])
+        with self.assertRaises(KeyError):
+            self.arena.founder_signatures([4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from genome_arena import GenomeArena
+from node import NodeGenerator
+from pairwise_ibd import pairwise_ibd
+from sex import Sex
+from shared_segment_detector import SharedSegmentDetector
+from fixtures import related_genomes, uniform_cm_data
+
+class TestPairwiseIbd(unittest.TestCase):
+    def setUp(self):
+        self.nodes = [SimpleNamespace(genome = genome)
+                      for genome in related_genomes()]
+        self.detector = SharedSegmentDetector(uniform_cm_data(), 0)
+
+    def _expected(self, nodes_a, nodes_b):
+        return np.array([[self.detector.shared_segment_length(a.genome,
+                                                              b.genome)
+                          for b in nodes_b] for a in nodes_a])
+
+    def test_symmetric(self):
+        progress = []
+        lengths = pairwise_ibd(self.detector, self.nodes, tile_size = 4,
+                               progress = lambda *args: progress.append(args))
+        expected = self._expected(self.nodes, self.nodes)
+        np.fill_diagonal(expected, 0.0)
+        # Lengths are summed in the order of the first genome.
+        np.testing.assert_allclose(lengths, expected, atol = 1e-9)
+        np.testing.assert_array_equal(lengths, lengths.T)
+        self.assertGreater(np.count_nonzero(lengths), 0)
+        num_pairs = len(self.nodes) * (len(self.nodes) - 1) // 2
+        self.assertEqual(progress[-1], (num_pairs, num_pairs))
+        self.assertGreater(len(progress), 1)
+        sparse = pairwise_ibd(self.detector, self.nodes, tile_size = 4,
+                              sparse = True)
+        np.testing.assert_array_equal(sparse.toarray(), lengths)
+        self.assertEqual(sparse.nnz, np.count_nonzero(lengths))
+        # Tiles of one node leave out the diagonal entirely.
+        np.testing.assert_array_equal(pairwise_ibd(self.detector, self.nodes,
+                                                   tile_size = 1), lengths)
+        sparse = pairwise_ibd(self.detector, self.nodes, processes = 2,
+                              tile_size = 4, sparse = True)
+        np.testing.assert_array_equal(sparse.toarray(), lengths)
+
+    def test_rectangular_and_processes(self):
+        nodes_a = self.nodes[:5]
+        nodes_b = self.nodes[3:]
+        expected = self._expected(nodes_a, nodes_b)
+        for processes in (1, 2):
+            lengths = pairwise_ibd(self.detector, nodes_a, nodes_b,
+                                   processes = processes, tile_size = 3)
+            np.testing.assert_array_equal(lengths, expected)
+        lengths = pairwise_ibd(self.detector, self.nodes, processes = 2,
+                               tile_size = 4)
+        np.testing.assert_array_equal(lengths, pairwise_ibd(self.detector,
+                                                            self.nodes))
+
+    def test_genome_arena(self):
+        generator = NodeGenerator()
+        nodes = [generator.generate_node(sex = Sex.Male)
+                 for _ in self.nodes]
+        arena = GenomeArena()
+        arena.set_many([node._id for node in nodes],
+                       [node.genome for node in self.nodes])
+        generator._genomes = arena
+        np.testing.assert_array_equal(pairwise_ibd(self.detector, nodes,
+                                                   tile_size = 4),
+                                      pairwise_ibd(self.detector, self.nodes,
+                                                   tile_size = 4))
+        # Pairs are skipped using the signatures kept by the arena.
+        arena._signatures[:] = 0
+        self.assertEqual(np.count_nonzero(pairwise_ibd(self.detector,
+                                                       nodes)), 0)
+
+    def test_sample(self):
+        rows, columns, lengths = pairwise_ibd(self.detector, self.nodes,
+                                              sample = 20, seed = 1,
+                                              tile_size = 3)
+        self.assertEqual(len(set(zip(rows.tolist(), columns.tolist()))), 20)
+        self.assertTrue(np.all(rows < columns))
+        dense = pairwise_ibd(self.detector, self.nodes)
+        np.testing.assert_array_equal(lengths, dense[rows, columns])
+        again = pairwise_ibd(self.detector, self.nodes, sample = 20,
+                             seed = 1)
+        np.testing.assert_array_equal(again[0], rows)
+        rows, columns, lengths = pairwise_ibd(self.detector, self.nodes[:3],
+                                              self.nodes, sample = 100)
+        self.assertEqual(len(lengths), 3 * len(self.nodes))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import pickle
+import unittest
+
+import numpy as np
+
+from node import NodeGenerator
+from pedigree import PedigreeArrays, ChildIndex, SuspectedOverlay, NO_NODE
+from sex import Sex
+
+class TestPedigreeArrays(unittest.TestCase):
+    def test_add_grows_columns(self):
+        pedigree = PedigreeArrays(2)
+        for _ in range(5):
+            pedigree.add()
+        self.assertEqual(len(pedigree), 5)
+        self.assertGreaterEqual(pedigree.capacity, 5)
+        np.testing.assert_array_equal(pedigree.father,
+                                      np.full(5, NO_NODE))
+
+    def test_add_many(self):
+        pedigree = PedigreeArrays(2)
+        father = pedigree.add(sex = Sex.Male.value)
+        mother = pedigree.add(sex = Sex.Female.value)
+        children = pedigree.add_many([father, father, NO_NODE],
+                                     [mother, mother, mother],
+                                     sex = [0, 1, 1], generation = 1)
+        self.assertEqual(children.tolist(), [2, 3, 4])
+        self.assertEqual(pedigree.suspected_father[4], NO_NODE)
+        self.assertEqual(list(pedigree.children(father)), [2, 3])
+        self.assertEqual(list(pedigree.suspected_children(mother)),
+                         [2, 3, 4])
+        pedigree.set_twins([2], [3])
+        self.assertEqual(pedigree.twin.tolist(),
+                         [NO_NODE, NO_NODE, 3, 2, NO_NODE])
+
+    def test_children(self):
+        pedigree = PedigreeArrays()
+        father = pedigree.add(sex = Sex.Male.value)
+        mother = pedigree.add(sex = Sex.Female.value)
+        child = pedigree.add(father, mother, father, mother, generation = 1)
+        self.assertEqual(list(pedigree.children(father)), [child])
+        self.assertEqual(list(pedigree.children(mother)), [child])
+        self.assertEqual(list(pedigree.children(child)), [])
+
+    def test_set_suspected_parent(self):
+        pedigree = PedigreeArrays()
+        father = pedigree.add(sex = Sex.Male.value)
+        other = pedigree.add(sex = Sex.Male.value)
+        child = pedigree.add(father, NO_NODE, father, NO_NODE)
+        pedigree.set_suspected_father(child, other)
+        self.assertEqual(list(pedigree.suspected_children(father)), [])
+        self.assertEqual(list(pedigree.suspected_children(other)), [child])
+        self.assertEqual(list(pedigree.children(father)), [child])
+
+    def test_set_suspected_parents_batch(self):
+        pedigree = PedigreeArrays()
+        father = pedigree.add(sex = Sex.Male.value)
+        mother = pedigree.add(sex = Sex.Female.value)
+        children = [pedigree.add(father, mother, father, mother)
+                    for _ in range(3)]
+        pedigree.set_suspected_parents(children[:2],
+                                       father_ids = [NO_NODE, NO_NODE])
+        self.assertEqual(list(pedigree.suspected_children(father)),
+                         [children[2]])
+        self.assertEqual(list(pedigree.suspected_children(mother)), children)
+        self.assertIsNone(pedigree.sibling_ids(children[0], True))
+        self.assertEqual(list(pedigree.sibling_ids(children[0])), children)
+
+    def test_overlay(self):
+        pedigree = PedigreeArrays()
+        father = pedigree.add(sex = Sex.Male.value)
+        mother = pedigree.add(sex = Sex.Female.value)
+        children = pedigree.add_many([father] * 3, [mother] * 3)
+        pedigree.set_suspected_parents(children[:1], father_ids = [NO_NODE])
+        overlay = pedigree.suspected_overlay()
+        self.assertEqual(overlay.node_ids.tolist(), [children[0]])
+        pedigree.apply_overlay(SuspectedOverlay([children[2]], [father],
+                                                [NO_NODE]))
+        self.assertEqual(pedigree.suspected_father[children].tolist(),
+                         [father] * 3)
+        self.assertEqual(list(pedigree.suspected_children(mother)),
+                         children[:2].tolist())
+        pedigree.apply_overlay(overlay)
+        self.assertEqual(pedigree.suspected_overlay().node_ids.tolist(),
+                         [children[0]])
+
+    def test_descendant_ids(self):
+        pedigree = PedigreeArrays()
+        father = pedigree.add(sex = Sex.Male.value)
+        mother = pedigree.add(sex = Sex.Female.value)
+        son = pedigree.add(father, mother, father, mother,
+                           sex = Sex.Male.value)
+        other = pedigree.add(sex = Sex.Female.value)
+        grandchild = pedigree.add(son, other, son, other)
+        self.assertEqual(pedigree.descendant_ids([mother]).tolist(),
+                         [mother, son, grandchild])
+        self.assertEqual(pedigree.descendant_ids([other, son]).tolist(),
+                         [son, other, grandchild])
+
+class TestChildIndex(unittest.TestCase):
+    def test_from_parents(self):
+        fathers = np.array([NO_NODE, NO_NODE, 0, 0, NO_NODE, 0])
+        mothers = np.array([NO_NODE, NO_NODE, 1, 4, NO_NODE, 1])
+        index = ChildIndex.from_parents(fathers, mothers)
+        self.assertEqual(index.children(0).tolist(), [2, 3, 5])
+        self.assertEqual(index.children(1).tolist(), [2, 5])
+        self.assertEqual(index.children(4).tolist(), [3])
+        self.assertEqual(index.num_children(2), 0)
+        self.assertEqual(index.children_of_many([4, 1]).tolist(), [3, 2, 5])
+        self.assertEqual(index.children_of_many([2, 3]).tolist(), [])
+
+class TestNodeView(unittest.TestCase):
+    def setUp(self):
+        self.generator = NodeGenerator()
+        self.father = self.generator.generate_node(sex = Sex.Male)
+        self.mother = self.generator.generate_node(sex = Sex.Female)
+        self.child = self.generator.generate_node(self.father, self.mother)
+
+    def test_relationships(self):
+        child = self.child
+        self.assertEqual(child.father, self.father)
+        self.assertEqual(child.mother, self.mother)
+        self.assertEqual(child.suspected_father, self.father)
+        self.assertIsNone(child.twin)
+        self.assertEqual(child.generation, 1)
+        self.assertEqual(self.father.children, [child])
+
+    def test_views_are_equal(self):
+        mapping = self.generator.mapping
+        self.assertEqual(mapping[self.child._id], self.child)
+        self.assertEqual(len(set([mapping[2], self.child])), 1)
+        self.assertIn(2, mapping)
+        self.assertNotIn(3, mapping)
+
+    def test_numpy_id_hashes(self):
+        node = self.generator.node(np.int32(2))
+        self.assertEqual(len(set([node, self.child])), 1)
+        self.assertEqual({self.child: "child"}[node], "child")
+
+    def test_suspected_parent_setter(self):
+        self.child.suspected_father = None
+        self.assertIsNone(self.child.suspected_father)
+        self.assertEqual(self.child.father, self.father)
+        self.assertEqual(self.father.suspected_children, [])
+
+    def test_twin(self):
+        twin = self.generator.twin_node(self.child)
+        self.assertEqual(twin.twin, self.child)
+        self.assertEqual(self.child.twin, twin)
+        self.assertEqual(twin.sex, self.child.sex)
+
+    def test_genome(self):
+        self.child.genome = "genome"
+        self.assertEqual(self.generator.node(2).genome, "genome")
+        self.assertEqual(self.child.suspected_genome, "genome")
+        self.child.suspected_genome = "other"
+        self.assertEqual(self.child.suspected_genome, "other")
+        self.child.genome = None
+        self.assertIsNone(self.child.genome)
+
+    def test_pickle(self):
+        self.child.genome = "genome"
+        child = pickle.loads(pickle.dumps(self.child))
+        self.assertEqual(child._id, self.child._id)
+        self.assertEqual(child.mother._id, self.mother._id)
+        self.assertEqual(child.genome, "genome")
+        self.assertEqual(child.father.children, [child])
+
+if __name__ == '__main__':
+    unittest.main()
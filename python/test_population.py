@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from island_model import IslandNode, IslandModel, NO_ISLAND
+from node import NodeGenerator
+from pedigree import NO_NODE
+from population import IslandPopulation
+from sex import Sex
+
+def _population(size, seed, num_islands = 2):
+    generator = NodeGenerator()
+    islands = [IslandNode(0.1) for _ in range(num_islands)]
+    island_model = IslandModel(islands)
+    for i in range(size):
+        sex = Sex.Male if i % 2 == 0 else Sex.Female
+        island_model.add_individual(islands[(i // 2) % num_islands],
+                                    generator.generate_node(sex = sex))
+    return (IslandPopulation(island_model, seed = seed), generator)
+
+class TestNewGeneration(unittest.TestCase):
+    def test_parents(self):
+        population, generator = _population(400, 1)
+        population.new_generation(generator, size = 1000)
+        pedigree = generator.pedigree
+        children = population.generations[-1].ids
+        self.assertEqual(len(children), 1000)
+        founders = population.generations[0].ids
+        fathers = pedigree.father[children]
+        mothers = pedigree.mother[children]
+        self.assertTrue(np.isin(fathers, founders).all())
+        self.assertTrue(np.isin(mothers, founders).all())
+        self.assertTrue((pedigree.sex[fathers] == Sex.Male.value).all())
+        self.assertTrue((pedigree.sex[mothers] == Sex.Female.value).all())
+        self.assertTrue((pedigree.generation[children] == 1).all())
+        # Children live on their father's island.
+        island_model = population._island_model
+        for child in population.generations[-1].members:
+            self.assertIs(island_model.get_island(child),
+                          island_model.get_island(child.father))
+
+    def test_twins(self):
+        population, generator = _population(400, 2)
+        population.new_generation(generator, size = 1000)
+        pedigree = generator.pedigree
+        children = population.generations[-1].ids
+        twins = pedigree.twin[children]
+        has_twin = children[twins != NO_NODE]
+        self.assertEqual(len(has_twin), 2 * int(0.003 * 1000))
+        twins = pedigree.twin[has_twin]
+        np.testing.assert_array_equal(pedigree.twin[twins], has_twin)
+        for column in (pedigree.father, pedigree.suspected_mother,
+                       pedigree.sex):
+            np.testing.assert_array_equal(column[twins], column[has_twin])
+
+    def test_monogamy(self):
+        population, generator = _population(400, 3, num_islands = 1)
+        population.new_generation(generator, size = 1000,
+                                  monogamy_rate = 1.0)
+        pedigree = generator.pedigree
+        children = population.generations[-1].ids
+        pairs = set(zip(pedigree.father[children].tolist(),
+                        pedigree.mother[children].tolist()))
+        fathers = [father for father, _ in pairs]
+        self.assertEqual(len(fathers), len(set(fathers)))
+
+    def test_parent_errors(self):
+        population, generator = _population(400, 4)
+        population.new_generation(generator, size = 1000,
+                                  non_paternity_rate = 0.1,
+                                  adoption_rate = 0.05,
+                                  unknown_mother_rate = 0.02,
+                                  unknown_father_rate = 0.03)
+        pedigree = generator.pedigree
+        # Twins are added after the other children and copy their
+        # sibling's parents, so only check the first 997 children.
+        children = population.generations[-1].ids[:997]
+        father = pedigree.father[children]
+        mother = pedigree.mother[children]
+        suspected_father = pedigree.suspected_father[children]
+        suspected_mother = pedigree.suspected_mother[children]
+        self.assertEqual((suspected_mother == NO_NODE).sum(),
+                         int(0.02 * 997))
+        self.assertEqual((suspected_father == NO_NODE).sum(),
+                         int(0.03 * 997))
+        changed_mother = ((suspected_mother != mother)
+                          & (suspected_mother != NO_NODE))
+        self.assertLessEqual(changed_mother.sum(), int(0.05 * 997))
+        changed_father = ((suspected_father != father)
+                          & (suspected_father != NO_NODE))
+        self.assertLessEqual(changed_father.sum(),
+                             int(0.1 * 997) + int(0.05 * 997))
+        self.assertGreater(changed_father.sum(), int(0.1 * 997) // 2)
+        known = suspected_father[suspected_father != NO_NODE]
+        self.assertTrue((pedigree.sex[known] == Sex.Male.value).all())
+
+    def test_seed(self):
+        columns = []
+        for _ in range(2):
+            population, generator = _population(400, 5)
+            population.new_generation(generator, size = 500,
+                                      non_paternity_rate = 0.1)
+            population.new_generation(generator, size = 500)
+            pedigree = generator.pedigree
+            columns.append((pedigree.father.copy(),
+                            pedigree.suspected_father.copy(),
+                            pedigree.sex.copy()))
+        for first, second in zip(*columns):
+            np.testing.assert_array_equal(first, second)
+
+class TestErrorScenario(unittest.TestCase):
+    def test_apply_and_switch(self):
+        population, generator = _population(400, 8)
+        population.new_generation(generator, size = 1000)
+        population.new_generation(generator, size = 1000)
+        pedigree = generator.pedigree
+        original = population.suspected_overlay
+        self.assertEqual(len(original), 0)
+        scenario = population.error_scenario(non_paternity_rate = 0.1,
+                                             unknown_mother_rate = 0.05,
+                                             seed = 1)
+        np.testing.assert_array_equal(pedigree.suspected_father,
+                                      pedigree.father)
+        population.apply_overlay(scenario)
+        children = population.generations[-1].ids
+        unknown_mother = pedigree.suspected_mother[children] == NO_NODE
+        self.assertGreaterEqual(unknown_mother.sum(), int(0.05 * 997))
+        changed_father = (pedigree.suspected_father[children]
+                          != pedigree.father[children])
+        self.assertGreater(changed_father.sum(), int(0.1 * 997) // 2)
+        self.assertTrue((pedigree.generation[scenario.node_ids] > 0).all())
+        twins = pedigree.twin[children]
+        has_twin = children[twins != NO_NODE]
+        np.testing.assert_array_equal(
+            pedigree.suspected_father[has_twin],
+            pedigree.suspected_father[pedigree.twin[has_twin]])
+        population.apply_overlay(original)
+        np.testing.assert_array_equal(pedigree.suspected_father,
+                                      pedigree.father)
+        np.testing.assert_array_equal(pedigree.suspected_mother,
+                                      pedigree.mother)
+
+class TestIslandModel(unittest.TestCase):
+    def test_migrate(self):
+        population, generator = _population(1000, 6, num_islands = 3)
+        island_model = population._island_model
+        ids = population.generations[0].ids
+        before = island_model.island_ids(ids)
+        island_model.migrate(ids, np.random.default_rng(0))
+        after = island_model.island_ids(ids)
+        moved = (before != after).mean()
+        self.assertGreater(moved, 0.05)
+        self.assertLess(moved, 0.15)
+        self.assertTrue(((after >= 0) & (after < 3)).all())
+
+    def test_island_index(self):
+        population, generator = _population(40, 7)
+        index = population.island_index(0)
+        island_model = population._island_model
+        island = island_model.islands[1]
+        men = index.members(1, Sex.Male)
+        self.assertEqual(len(men), 10)
+        for node_id in men.tolist():
+            node = generator.node(node_id)
+            self.assertEqual(node.sex, Sex.Male)
+            self.assertIs(island_model.get_island(node), island)
+        self.assertEqual(sorted(index.members(1).tolist()),
+                         sorted(men.tolist()
+                                + index.members(1, Sex.Female).tolist()))
+        self.assertEqual(island_model.island_ids([1000]).tolist(),
+                         [NO_ISLAND])
+
+    def test_unknown_node(self):
+        population, generator = _population(40, 8)
+        island_model = population._island_model
+        # Without spare capacity, NO_NODE would index the last node.
+        island_model._island_of = island_model._island_of[:40]
+        self.assertEqual(island_model.island_ids([NO_NODE, 0]).tolist(),
+                         [NO_ISLAND, 0])
+
+if __name__ == '__main__':
+    unittest.main()
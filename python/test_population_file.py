@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from diploid import Diploid
+from island_model import IslandNode, IslandModel
+from node import NodeGenerator
+from population import IslandPopulation
+from population_file import (load_population, save_population,
+                             convert_pickle, is_population_file,
+                             compress_genomes, PopulationFileError,
+                             PopulationFileWriter, COMPRESSED_VERSION)
+from genome_codec import encode_starts, pack_codes, HaplotypeDecoder
+from recomb_genome import RecombGenome
+from sex import Sex
+
+def _genome(founder):
+    mother = Diploid(np.array([0, 10], dtype = np.uint32), 100,
+                     np.array([founder, founder + 1], dtype = np.uint32))
+    father = Diploid(np.array([0], dtype = np.uint32), 100,
+                     np.array([founder + 2], dtype = np.uint32))
+    return RecombGenome(mother, father)
+
+class TestPopulationFile(unittest.TestCase):
+    def setUp(self):
+        generator = NodeGenerator()
+        islands = [IslandNode(0.1), IslandNode(0.2)]
+        island_model = IslandModel(islands)
+        for i in range(20):
+            sex = Sex.Male if i % 2 == 0 else Sex.Female
+            island_model.add_individual(islands[i // 10],
+                                        generator.generate_node(sex = sex))
+        self.population = IslandPopulation(island_model, seed = 1)
+        self.population.new_generation(generator, size = 4)
+        members = list(self.population.members)
+        for i, member in enumerate(members):
+            member.genome = _genome(i * 3)
+        twin = generator.twin_node(members[-1])
+        twin.genome = members[-1].genome
+        island_model.add_individual(island_model.get_island(members[-1]),
+                                    twin)
+        self.population.generations[-1]._ids = np.append(
+            self.population.generations[-1].ids, twin._id)
+        members[-2].suspected_father = None
+        members[-2].suspected_genome = _genome(100)
+        directory = tempfile.mkdtemp()
+        self.filename = os.path.join(directory, "population.pop")
+        self.pickle_filename = os.path.join(directory, "population.pickle")
+
+    def tearDown(self):
+        for filename in (self.filename, self.pickle_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+        os.rmdir(os.path.dirname(self.filename))
+
+    def assertPopulationsEqual(self, expected, loaded):
+        expected_pedigree = expected.node_generator.pedigree
+        loaded_pedigree = loaded.node_generator.pedigree
+        for column in ("father", "mother", "suspected_father",
+                       "suspected_mother", "twin", "sex", "generation"):
+            np.testing.assert_array_equal(getattr(loaded_pedigree, column),
+                                          getattr(expected_pedigree, column))
+        self.assertEqual([generation.ids.tolist() for generation
+                          in loaded.generations],
+                         [generation.ids.tolist() for generation
+                          in expected.generations])
+        island_model = loaded._island_model
+        for node in loaded.members:
+            expected_node = expected.node_generator.node(node._id)
+            expected_island = expected._island_model.get_island(expected_node)
+            self.assertEqual(island_model.get_island(node).switch_probability,
+                             expected_island.switch_probability)
+            for attribute in ("genome", "suspected_genome"):
+                genome = getattr(node, attribute)
+                expected_genome = getattr(expected_node, attribute)
+                for haplotype in ("mother", "father"):
+                    np.testing.assert_array_equal(
+                        getattr(genome, haplotype).starts,
+                        getattr(expected_genome, haplotype).starts)
+                    np.testing.assert_array_equal(
+                        getattr(genome, haplotype).founder,
+                        getattr(expected_genome, haplotype).founder)
+
+    def test_round_trip(self):
+        save_population(self.population, self.filename)
+        self.assertTrue(is_population_file(self.filename))
+        for mmap in (True, False):
+            loaded = load_population(self.filename, mmap = mmap)
+            self.assertPopulationsEqual(self.population, loaded)
+
+    def test_compressed_round_trip(self):
+        save_population(self.population, self.filename,
+                        compress_genomes = True)
+        with open(self.filename, "rb") as population_file:
+            population_file.seek(8)
+            self.assertEqual(population_file.read(1)[0], COMPRESSED_VERSION)
+        for mmap in (True, False):
+            loaded = load_population(self.filename, mmap = mmap)
+            self.assertPopulationsEqual(self.population, loaded)
+
+    def test_compress_genomes(self):
+        save_population(self.population, self.filename)
+        expected = load_population(self.filename)
+        table = compress_genomes(self.population)
+        self.assertGreater(table.nbytes, 0)
+        self.assertPopulationsEqual(expected, self.population)
+        unpickled = pickle.loads(pickle.dumps(self.population))
+        self.assertPopulationsEqual(expected, unpickled)
+
+    def test_twins_share_genome(self):
+        save_population(self.population, self.filename)
+        loaded = load_population(self.filename)
+        twin = loaded.generations[-1].members[-1]
+        self.assertIs(twin.genome, twin.twin.genome)
+
+    def test_loaded_population_is_editable(self):
+        save_population(self.population, self.filename)
+        loaded = load_population(self.filename)
+        child = loaded.generations[-1].members[0]
+        child.suspected_mother = None
+        child.genome = None
+        self.assertIsNone(child.suspected_mother)
+        self.assertIsNone(child.genome)
+        loaded.clean_genomes()
+        self.assertTrue(all(member.genome is None
+                            for member in loaded.members))
+        # Editing the mapped population does not change the file.
+        reloaded = load_population(self.filename)
+        self.assertPopulationsEqual(self.population, reloaded)
+
+    def test_convert_pickle(self):
+        with open(self.pickle_filename, "wb") as pickle_file:
+            pickle.dump(self.population, pickle_file)
+        self.assertFalse(is_population_file(self.pickle_filename))
+        self.assertPopulationsEqual(self.population,
+                                    load_population(self.pickle_filename))
+        convert_pickle(self.pickle_filename, self.filename)
+        self.assertPopulationsEqual(self.population,
+                                    load_population(self.filename))
+
+    def test_streaming_writer(self):
+        islands = [IslandNode(0.1), IslandNode(0.2)]
+        writer = PopulationFileWriter(self.filename, 60, islands)
+        generator = writer.node_generator
+        island_model = writer.island_model
+        for i in range(20):
+            sex = Sex.Male if i % 2 == 0 else Sex.Female
+            island_model.add_individual(islands[i // 10],
+                                        generator.generate_node(sex = sex))
+        population = IslandPopulation(island_model, seed = 2)
+        expected_genomes = dict()
+        for generation_number in range(3):
+            if generation_number > 0:
+                population.new_generation(generator, size = 20)
+            generation = population.generations[-1]
+            for member in generation.members:
+                member.genome = _genome(member._id)
+            write_genomes = generation_number > 0
+            if write_genomes:
+                expected_genomes.update((member._id, member.genome)
+                                        for member in generation.members)
+            writer.finish_generation(generation, write_genomes)
+        writer.close(population)
+
+        loaded = load_population(self.filename)
+        pedigree = generator.pedigree
+        loaded_pedigree = loaded.node_generator.pedigree
+        self.assertEqual(len(loaded_pedigree), 60)
+        for column in ("father", "suspected_mother", "sex", "generation"):
+            np.testing.assert_array_equal(getattr(loaded_pedigree, column),
+                                          getattr(pedigree, column))
+        self.assertEqual([generation.ids.tolist() for generation
+                          in loaded.generations],
+                         [list(range(0, 20)), list(range(20, 40)),
+                          list(range(40, 60))])
+        ids = np.arange(60)
+        np.testing.assert_array_equal(loaded._island_model.island_ids(ids),
+                                      island_model.island_ids(ids))
+        for node_id in range(60):
+            genome = loaded.node_generator.node(node_id).genome
+            if node_id not in expected_genomes:
+                self.assertIsNone(genome)
+                continue
+            np.testing.assert_array_equal(genome.mother.founder,
+                                          expected_genomes[node_id].mother.founder)
+
+    def test_streaming_writer_discard(self):
+        writer = PopulationFileWriter(self.filename, 60, [IslandNode(0.1)])
+        self.assertFalse(os.path.exists(self.filename))
+        writer.discard()
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), [])
+
+    def test_unsupported_version(self):
+        save_population(self.population, self.filename)
+        with open(self.filename, "r+b") as population_file:
+            population_file.seek(8)
+            population_file.write(b"\xff")
+        with self.assertRaises(PopulationFileError):
+            load_population(self.filename)
+
+class TestGenomeCodec(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.RandomState(5)
+        lengths = [1, 0, 40, 3, 200]
+        offsets = np.zeros(len(lengths) + 1, dtype = np.int64)
+        np.cumsum(lengths, out = offsets[1:])
+        starts = np.concatenate([np.sort(rng.randint(0, 2 ** 32, size = n,
+                                                     dtype = np.uint64))
+                                 for n in lengths]).astype(np.uint32)
+        for bits in (1, 7, 19, 32):
+            dictionary = np.unique(rng.randint(0, 2 ** 32, size = 2 ** min(bits, 12),
+                                               dtype = np.uint64)).astype(np.uint32)
+            codes = rng.randint(0, len(dictionary),
+                                size = len(starts)).astype(np.uint32)
+            start_bytes, byte_offsets = encode_starts(offsets, starts)
+            decoder = HaplotypeDecoder(start_bytes, byte_offsets, offsets,
+                                       pack_codes(codes, bits), bits,
+                                       dictionary)
+            for h in range(len(lengths)):
+                decoded_starts, decoded_founder = decoder.decode(h)
+                np.testing.assert_array_equal(decoded_starts,
+                                              starts[offsets[h]:offsets[h + 1]])
+                np.testing.assert_array_equal(decoded_founder,
+                                              dictionary[codes[offsets[h]:offsets[h + 1]]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from node import NodeGenerator
+from population_genomes import (generate_genomes, mate, mate_generation,
+                                use_lazy_genomes, genome_nbytes,
+                                replicate_genomes, replicate_sharing,
+                                regenerate_genomes, affected_ids)
+from recomb_genome import RecombGenomeGenerator, MeiosisRandom
+from sex import Sex
+from fixtures import FounderDetector, uniform_recombinators, founder_population
+
+def _genomes(nodes):
+    return {node._id: (node.genome.mother.starts.tobytes(),
+                       node.genome.mother.founder.tobytes(),
+                       node.genome.father.starts.tobytes(),
+                       node.genome.father.founder.tobytes())
+            for node in nodes}
+
+def _genomes_list(genomes):
+    return [(genome.mother.starts.tolist(), genome.mother.founder.tolist(),
+             genome.father.starts.tolist(), genome.father.founder.tolist())
+            for genome in genomes]
+
+class TestMeiosisRandom(unittest.TestCase):
+    def test_order_independent(self):
+        recombinators = uniform_recombinators()
+        chrom_sizes = recombinators[Sex.Male]._num_bases
+        genome_generator = RecombGenomeGenerator(chrom_sizes)
+        mother = genome_generator.generate()
+        father = genome_generator.generate()
+        meiosis_random = MeiosisRandom(11)
+        def child(node_id):
+            genome = mate(mother, father, recombinators[Sex.Female],
+                          recombinators[Sex.Male], meiosis_random, node_id)
+            return (genome.mother.starts.tolist(),
+                    genome.mother.founder.tolist(),
+                    genome.father.starts.tolist(),
+                    genome.father.founder.tolist())
+        forward = [child(node_id) for node_id in range(20)]
+        backward = [child(node_id) for node_id in reversed(range(20))]
+        self.assertEqual(forward, backward[::-1])
+        self.assertEqual(len(set(map(str, forward))), 20)
+        self.assertEqual(forward[3], child(3))
+
+    def test_mate_generation(self):
+        recombinators = uniform_recombinators()
+        chrom_sizes = recombinators[Sex.Male]._num_bases
+        genome_generator = RecombGenomeGenerator(chrom_sizes)
+        meiosis_random = MeiosisRandom(12)
+        parents = [genome_generator.generate() for _ in range(6)]
+        for generation in range(3):
+            node_ids = list(range(100 * generation, 100 * generation + 50))
+            pairs = [(parents[i % len(parents)],
+                      parents[(3 * i + 1) % len(parents)])
+                     for i in range(len(node_ids))]
+            batch = mate_generation(node_ids, pairs, recombinators,
+                                    meiosis_random)
+            single = [mate(mother, father, recombinators[Sex.Female],
+                           recombinators[Sex.Male], meiosis_random, node_id)
+                      for node_id, (mother, father) in zip(node_ids, pairs)]
+            self.assertEqual(_genomes_list(batch), _genomes_list(single))
+            parents = batch
+
+class TestGenerateGenomes(unittest.TestCase):
+    def setUp(self):
+        self.recombinators = uniform_recombinators()
+        chrom_sizes = self.recombinators[Sex.Male]._num_bases
+        self.chrom_sizes = chrom_sizes
+
+    def _generate(self, processes, seed):
+        population = founder_population(1)
+        genome_generator = RecombGenomeGenerator(self.chrom_sizes)
+        generate_genomes(population, genome_generator, self.recombinators,
+                         processes = processes, seed = seed)
+        return population
+
+    def test_independent_of_processes(self):
+        serial = _genomes(self._generate(1, 3).members)
+        parallel = _genomes(self._generate(2, 3).members)
+        self.assertEqual(len(serial), 1240)
+        self.assertEqual(serial, parallel)
+        self.assertNotEqual(serial, _genomes(self._generate(1, 4).members))
+
+    def test_twins_share_genome(self):
+        population = self._generate(2, 3)
+        twins = [node for node in population.members
+                 if node.twin is not None]
+        self.assertGreater(len(twins), 0)
+        for node in twins:
+            self.assertIs(node.genome, node.twin.genome)
+
+    def test_founder_ids(self):
+        population = self._generate(2, 3)
+        founders = population.generations[0].members
+        founder_ids = set()
+        for node in founders:
+            founder_ids.update(np.unique(node.genome.mother.founder).tolist())
+            founder_ids.update(np.unique(node.genome.father.founder).tolist())
+        for node in population.generations[-1].members:
+            for diploid in (node.genome.mother, node.genome.father):
+                self.assertTrue(set(diploid.founder.tolist()) <= founder_ids)
+
+class TestRegenerateGenomes(unittest.TestCase):
+    def setUp(self):
+        self.recombinators = uniform_recombinators()
+        self.chrom_sizes = self.recombinators[Sex.Male]._num_bases
+
+    def _generate(self, population):
+        generate_genomes(population, RecombGenomeGenerator(self.chrom_sizes),
+                         self.recombinators, true_genealogy = False, seed = 5)
+        return _genomes(population.members)
+
+    def test_matches_full_regeneration(self):
+        population = founder_population(1)
+        self._generate(population)
+        before = _genomes(population.members)
+        pedigree = population.node_generator.pedigree
+        middle = population.generations[1].members
+        fathers = [node for node in population.generations[0].members
+                   if node.sex == Sex.Male]
+        edited = middle[:3]
+        for node, father in zip(edited, fathers[-3:]):
+            node.suspected_father = father
+        self.assertEqual(len(pedigree.take_edited_ids()), 0)
+        edited_ids = pedigree.take_edited_ids(suspected = True)
+        self.assertEqual(edited_ids.tolist(),
+                         sorted(node._id for node in edited))
+        self.assertEqual(len(pedigree.take_edited_ids(suspected = True)), 0)
+        affected = affected_ids(pedigree, edited_ids, False)
+        regenerated = regenerate_genomes(population,
+                                         RecombGenomeGenerator(self.chrom_sizes),
+                                         self.recombinators, edited_ids,
+                                         true_genealogy = False, seed = 5)
+        self.assertEqual(regenerated.tolist(), affected.tolist())
+        after = _genomes(population.members)
+        changed = set(node_id for node_id in before
+                      if before[node_id] != after[node_id])
+        self.assertTrue(changed <= set(affected.tolist()))
+        self.assertGreater(len(changed), 3)
+        population.node_generator._genomes.clear()
+        self.assertEqual(after, self._generate(population))
+
+    def test_true_parent_edits(self):
+        population = founder_population(1)
+        generate_genomes(population, RecombGenomeGenerator(self.chrom_sizes),
+                         self.recombinators, seed = 5)
+        before = _genomes(population.members)
+        pedigree = population.node_generator.pedigree
+        middle = population.generations[1].members
+        fathers = [node._id for node in population.generations[0].members
+                   if node.sex == Sex.Male]
+        edited = [node._id for node in middle[:3]]
+        pedigree.set_parents(edited, father_ids = fathers[-3:])
+        self.assertEqual(len(pedigree.take_edited_ids(suspected = True)), 0)
+        regenerated = regenerate_genomes(population,
+                                         RecombGenomeGenerator(self.chrom_sizes),
+                                         self.recombinators,
+                                         pedigree.take_edited_ids(),
+                                         seed = 5)
+        self.assertEqual(regenerated.tolist(),
+                         affected_ids(pedigree, edited).tolist())
+        after = _genomes(population.members)
+        self.assertNotEqual(after, before)
+        population.node_generator._genomes.clear()
+        generate_genomes(population, RecombGenomeGenerator(self.chrom_sizes),
+                         self.recombinators, seed = 5)
+        self.assertEqual(after, _genomes(population.members))
+
+    def test_missing_parent_genomes(self):
+        population = founder_population(1)
+        generate_genomes(population, RecombGenomeGenerator(self.chrom_sizes),
+                         self.recombinators, keep_last = 1, seed = 5)
+        child = population.generations[1].members[0]
+        with self.assertRaises(ValueError):
+            regenerate_genomes(population,
+                               RecombGenomeGenerator(self.chrom_sizes),
+                               self.recombinators, [child._id], seed = 5)
+
+class TestLazyGenomes(unittest.TestCase):
+    def setUp(self):
+        self.recombinators = uniform_recombinators()
+        self.chrom_sizes = self.recombinators[Sex.Male]._num_bases
+
+    def _lazy(self, max_bytes, keep_last = None):
+        population = founder_population(1)
+        genome_generator = RecombGenomeGenerator(self.chrom_sizes)
+        genomes = use_lazy_genomes(population, genome_generator,
+                                   self.recombinators, seed = 3,
+                                   max_bytes = max_bytes,
+                                   keep_last = keep_last)
+        return population, genomes
+
+    def test_matches_generate_genomes(self):
+        population = founder_population(1)
+        genome_generator = RecombGenomeGenerator(self.chrom_sizes)
+        generate_genomes(population, genome_generator, self.recombinators,
+                         seed = 3)
+        expected = _genomes(population.members)
+        lazy_population, genomes = self._lazy(20000)
+        # Generating in any order with a small cache gives the same
+        # genomes.
+        members = list(lazy_population.members)
+        self.assertEqual(_genomes(reversed(members)), expected)
+        self.assertEqual(_genomes(members), expected)
+        self.assertLessEqual(genomes.nbytes, 20000)
+
+    def test_keep_last_and_pinning(self):
+        population, genomes = self._lazy(1, keep_last = 1)
+        founder = population.generations[0].members[0]
+        self.assertFalse(founder.has_genome)
+        self.assertIsNone(founder.genome)
+        anchor, other = population.generations[-1].members[:2]
+        self.assertTrue(anchor.has_genome)
+        genomes.pin([anchor._id])
+        genome = anchor.genome
+        other.genome
+        self.assertIs(anchor.genome, genome)
+        self.assertEqual(genomes.nbytes, genome_nbytes(other.genome))
+        anchor.genome = None
+        self.assertFalse(anchor.has_genome)
+        anchor.genome = genome
+        self.assertIs(anchor.genome, genome)
+        self.assertEqual(len(genomes), 600)
+
+class TestReplicateGenomes(unittest.TestCase):
+    def setUp(self):
+        self.recombinators = uniform_recombinators()
+        chrom_sizes = self.recombinators[Sex.Male]._num_bases
+        self.genome_generator = RecombGenomeGenerator(chrom_sizes)
+        generator = NodeGenerator()
+        grandfather = generator.generate_node(sex = Sex.Male)
+        grandmother = generator.generate_node(sex = Sex.Female)
+        father = generator.generate_node(grandfather, grandmother,
+                                         sex = Sex.Male)
+        mother = generator.generate_node(sex = Sex.Female)
+        child_a = generator.generate_node(father, mother)
+        child_b = generator.generate_node(father, mother)
+        # Children are listed first, so depths have to be resolved.
+        self.nodes = [child_a, child_b, father, grandfather, grandmother,
+                      mother]
+
+    def test_matches_mate(self):
+        genomes = replicate_genomes(self.nodes, self.genome_generator,
+                                    self.recombinators, 5, seed = 2)
+        self.assertEqual(len(genomes), len(self.nodes))
+        self.assertTrue(all(len(node_genomes) == 5
+                            for node_genomes in genomes.values()))
+        meiosis_random = MeiosisRandom(2)
+        child_a, child_b, father, grandfather, grandmother, mother = self.nodes
+        for replicate in (0, 4):
+            father_genome = mate(genomes[grandmother._id][replicate],
+                                 genomes[grandfather._id][replicate],
+                                 self.recombinators[Sex.Female],
+                                 self.recombinators[Sex.Male],
+                                 meiosis_random, replicate * 6 + 2)
+            child = mate(genomes[mother._id][replicate], father_genome,
+                         self.recombinators[Sex.Female],
+                         self.recombinators[Sex.Male],
+                         meiosis_random, replicate * 6 + 1)
+            self.assertEqual(_genomes_list([genomes[father._id][replicate],
+                                            genomes[child_b._id][replicate]]),
+                             _genomes_list([father_genome, child]))
+        again = replicate_genomes(self.nodes, self.genome_generator,
+                                  self.recombinators, 5, seed = 2)
+        self.assertEqual(_genomes_list(again[child_a._id]),
+                         _genomes_list(genomes[child_a._id]))
+        self.assertNotEqual(_genomes_list(genomes[child_a._id][:1]),
+                            _genomes_list(genomes[child_a._id][1:2]))
+
+    def test_sharing(self):
+        child_a, child_b, father, grandfather, grandmother, mother = self.nodes
+        pairs = [(child_a, child_b), (father, mother), (child_a, mother)]
+        sharing = replicate_sharing(self.nodes, pairs, self.genome_generator,
+                                    self.recombinators, FounderDetector(),
+                                    20, seed = 3)
+        self.assertEqual(sharing.shape, (20, 3))
+        self.assertTrue(np.all(sharing[:, 0] > 0))
+        self.assertTrue(np.all(sharing[:, 1] == 0))
+        self.assertTrue(np.all(sharing[:, 2] > 0))
+
+if __name__ == '__main__':
+    unittest.main()
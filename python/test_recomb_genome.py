@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 
 from bisect import bisect_left
+from os import path, utime, listdir, remove, rmdir
 from unittest.mock import MagicMock
+import tempfile
 import unittest
 
 import numpy as np
 # import pyximport; pyximport.install()
 
 import recomb_genome
-from recomb_helper import new_sequence
+from cm import centimorgan_data_from_directory
+from recomb_helper import new_sequence, crossover
 
 def ar(locs):
     return np.array(locs, dtype = np.uint32)
@@ -341,7 +344,139 @@ class TestSwapAtLocations(unittest.TestCase):
                                                dtype = np.uint32))
 
 
+class TestCrossover(unittest.TestCase):
+    def test_two_intervals_to_end(self):
+        mother = recomb_genome.Diploid(ar([0, 5, 12]), 20, ar([1, 2, 3]))
+        father = recomb_genome.Diploid(ar([0, 8]), 20, ar([4, 5]))
+        new_mother, new_father = crossover(mother, father, ar([3, 6, 10, 20]))
+        np.testing.assert_array_equal(new_mother.starts, ar([0, 3, 6, 10]))
+        np.testing.assert_array_equal(new_mother.founder, ar([1, 4, 2, 5]))
+        np.testing.assert_array_equal(new_father.starts,
+                                      ar([0, 3, 5, 6, 8, 10, 12]))
+        np.testing.assert_array_equal(new_father.founder,
+                                      ar([4, 1, 2, 4, 5, 2, 3]))
+        self.assertEqual(new_mother.end, 20)
+
+class TestRecombinator(unittest.TestCase):
+    def setUp(self):
+        # Chromosome 1 has 1cM in its first 1Mb and 99cM in the next
+        # 1Mb, every other chromosome has 100cM over 2Mb.
+        data = {chrom: [(0, 0.0, 0.0), (1000000, 1.0, 50.0),
+                        (2000000, 1.0, 100.0)]
+                for chrom in recomb_genome.CHROMOSOME_ORDER}
+        data[1] = [(0, 0.0, 0.0), (1000000, 1.0, 1.0),
+                   (2000000, 1.0, 100.0)]
+        self.recombinator = recomb_genome.Recombinator(data)
+
+    def test_batched_matches_single(self):
+        rngs = [np.random.default_rng(i) for i in range(50)]
+        locations, indptr = self.recombinator.sample_crossovers(rngs)
+        self.assertEqual(len(indptr), 51)
+        for i in range(50):
+            single, _ = self.recombinator.sample_crossovers(
+                [np.random.default_rng(i)])
+            np.testing.assert_array_equal(locations[indptr[i]:indptr[i + 1]],
+                                          single)
+
+    def test_locations(self):
+        rngs = [np.random.default_rng(i) for i in range(500)]
+        locations, indptr = self.recombinator.sample_crossovers(rngs)
+        ends = np.cumsum([2000000] * len(recomb_genome.CHROMOSOME_ORDER))
+        for i in range(500):
+            meiosis = locations[indptr[i]:indptr[i + 1]].astype(np.int64)
+            self.assertEqual(len(meiosis) % 2, 0)
+            self.assertTrue((np.diff(meiosis) >= 0).all())
+            # Each (start, stop) pair stays within one chromosome.
+            chroms = np.searchsorted(ends, meiosis, side = "right")
+            chroms[1::2] = np.searchsorted(ends, meiosis[1::2] - 1,
+                                           side = "right")
+            np.testing.assert_array_equal(chroms[::2], chroms[1::2])
+        # Crossovers follow the genetic map: 1% of chromosome 1's
+        # events are in its first megabase.
+        first = locations[locations < 2000000]
+        self.assertLess((first < 1000000).mean(), 0.05)
+
+class TestRecombGenomeGenerator(unittest.TestCase):
+    def test_founders_share_starts(self):
+        sizes = {chrom: 1000 for chrom in recomb_genome.CHROMOSOME_ORDER}
+        generator = recomb_genome.RecombGenomeGenerator(sizes)
+        a = generator.generate()
+        b = generator.founder_genome(7)
+        self.assertIs(a.mother.starts, b.father.starts)
+        self.assertEqual(a.mother.starts.tolist(), list(range(0, 22000, 1000)))
+        self.assertEqual(set(b.mother.founder.tolist()), {14})
+        self.assertEqual(set(b.father.founder.tolist()), {15})
+        with self.assertRaises(ValueError):
+            b.father.starts[0] = 1
+        copy = recomb_genome.writable_genome(b)
+        copy.father.starts[0] = 1
+        self.assertEqual(a.mother.starts[0], 0)
+
+class TestRecombinationMaps(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for chrom in recomb_genome.CHROMOSOME_ORDER:
+            filename = path.join(self.directory,
+                                 "genetic_map_chr{}_b36.txt".format(chrom))
+            with open(filename, "w") as hapmap_file:
+                hapmap_file.write("position COMBINED_rate(cM/Mb) Genetic_Map(cM)\n")
+                hapmap_file.write("100 1.5 0.0\n")
+                hapmap_file.write("{} 2.0 {}\n".format(1000 * chrom, 0.25 * chrom))
+                hapmap_file.write("{} 0.0 {}\n".format(2000 * chrom, 0.5 * chrom))
+
+    def tearDown(self):
+        for filename in listdir(self.directory):
+            remove(path.join(self.directory, filename))
+        rmdir(self.directory)
+
+    def test_cache_matches_files(self):
+        cache_file = path.join(self.directory,
+                               recomb_genome.RECOMBINATION_CACHE_FILENAME)
+        parsed = recomb_genome.read_recombination_maps(self.directory)
+        self.assertTrue(path.exists(cache_file))
+        cached = recomb_genome.read_recombination_maps(self.directory)
+        hapmap_files = recomb_genome.hapmap_filenames(self.directory)
+        for chrom, filename in hapmap_files.items():
+            rows = recomb_genome._read_recombination_file(filename)
+            self.assertEqual(parsed[chrom].tolist(), rows)
+            self.assertEqual(cached[chrom].tolist(), rows)
+        recombinator = recomb_genome.recombinators_from_directory(self.directory)
+        expected = recomb_genome.recombinators_from_hapmap_files(hapmap_files)
+        self.assertEqual(recombinator._num_bases, expected._num_bases)
+        np.testing.assert_array_equal(recombinator._map_centimorgans,
+                                      expected._map_centimorgans)
+        cm_data = centimorgan_data_from_directory(self.directory)
+        self.assertEqual(cm_data.bases[:3].tolist(), [100, 1000, 2000])
+        self.assertEqual(cm_data.bases[3], 2100)
+        self.assertAlmostEqual(cm_data.cm[-1], 0.5 * sum(range(1, 23)))
+
+    def test_cache_invalidated(self):
+        recomb_genome.read_recombination_maps(self.directory)
+        filename = recomb_genome.hapmap_filenames(self.directory)[5]
+        with open(filename, "a") as hapmap_file:
+            hapmap_file.write("20000 0.0 4.0\n")
+        utime(filename, ns = (0, 0))
+        maps = recomb_genome.read_recombination_maps(self.directory)
+        self.assertEqual(maps[5][-1].tolist(), [20000, 0.0, 4.0])
+        self.assertEqual(recomb_genome.read_recombination_maps(self.directory)[5].tolist(),
+                         maps[5].tolist())
+
+    def test_corrupt_cache(self):
+        expected = recomb_genome.read_recombination_maps(self.directory)
+        cache_file = path.join(self.directory,
+                               recomb_genome.RECOMBINATION_CACHE_FILENAME)
+        with open(cache_file, "rb") as cache:
+            data = cache.read()
+        for truncated in (data[:len(data) // 2], data[:10], b""):
+            with open(cache_file, "wb") as cache:
+                cache.write(truncated)
+            maps = recomb_genome.read_recombination_maps(self.directory)
+            self.assertEqual(maps[5].tolist(), expected[5].tolist())
+            # The cache is rebuilt, without leaving temporary files.
+            self.assertEqual(len(listdir(self.directory)),
+                             len(recomb_genome.CHROMOSOME_ORDER) + 1)
+            with open(cache_file, "rb") as cache:
+                self.assertEqual(cache.read(), data)
 
-    
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from read_binary_simulation import BinarySimulationDeserializer
+from recomb_genome import RecombGenomeGenerator
+from sex import Sex
+from simulation import (simulate, seed_filename, SimulationSerializer,
+                        SimulationFileError)
+from fixtures import FounderDetector, uniform_recombinators, founder_population
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.recombinators = uniform_recombinators()
+        chrom_sizes = self.recombinators[Sex.Male]._num_bases
+        self.genome_generator = RecombGenomeGenerator(chrom_sizes)
+        self.population = founder_population(2, num_founders = 20, size = 60)
+        last = self.population.generations[-1].members
+        self.pairs = [(last[i], last[j]) for i, j
+                      in ((0, 1), (5, 1), (3, 7), (2, 7))]
+        directory = tempfile.mkdtemp()
+        self.filenames = [os.path.join(directory, name)
+                          for name in ("a", "b")]
+
+    def tearDown(self):
+        directory = os.path.dirname(self.filenames[0])
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+        os.rmdir(directory)
+
+    def _simulate(self, filename, iterations, processes, seed = 4):
+        return simulate(self.population, self.pairs, self.genome_generator,
+                        self.recombinators, FounderDetector(), filename,
+                        iterations, processes, seed = seed)
+
+    def test_deserialize(self):
+        self.assertEqual(self._simulate(self.filenames[0], 3, 1), 3)
+        deserializer = BinarySimulationDeserializer(self.filenames[0])
+        anchors = set(labeled._id for _, labeled in self.pairs)
+        self.assertEqual(deserializer.anchors, anchors)
+        for unlabeled, labeled in self.pairs:
+            shared = deserializer.anchor_shared(labeled._id)[unlabeled._id]
+            self.assertEqual(len(shared), 3)
+            self.assertTrue(np.all(shared >= 0))
+
+    def test_resume_and_processes(self):
+        self._simulate(self.filenames[0], 4, 1)
+        self._simulate(self.filenames[1], 2, 2)
+        # An interrupted write leaves a partial row, which is dropped.
+        with open(self.filenames[1], "ab") as simulation_file:
+            simulation_file.write(b"\0" * 12)
+        self.assertEqual(self._simulate(self.filenames[1], 4, 2), 4)
+        with open(self.filenames[0], "rb") as a, \
+             open(self.filenames[1], "rb") as b:
+            self.assertEqual(a.read(), b.read())
+        # Genomes of the population are left alone.
+        self.assertFalse(self.population.generations[-1].members[0].has_genome)
+
+    def test_recorded_seed(self):
+        self._simulate(self.filenames[0], 4, 1)
+        self._simulate(self.filenames[1], 2, 1)
+        # Resuming without a seed continues with the recorded one.
+        self.assertEqual(self._simulate(self.filenames[1], 4, 1,
+                                        seed = None), 4)
+        with open(self.filenames[0], "rb") as a, \
+             open(self.filenames[1], "rb") as b:
+            self.assertEqual(a.read(), b.read())
+        with self.assertRaises(SimulationFileError):
+            self._simulate(self.filenames[1], 5, 1, seed = 5)
+        os.remove(seed_filename(self.filenames[1]))
+        with self.assertRaises(SimulationFileError):
+            self._simulate(self.filenames[1], 5, 1, seed = None)
+
+    def test_mismatched_pairs(self):
+        with SimulationSerializer(self.filenames[0], [(1, 2)]) as serializer:
+            serializer.write([1.5])
+        with self.assertRaises(SimulationFileError):
+            SimulationSerializer(self.filenames[0], [(1, 3)])
+        with SimulationSerializer(self.filenames[0], [(1, 3)],
+                                  clobber = True) as serializer:
+            self.assertEqual(serializer.completed_iterations, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,10 @@ from itertools import combinations, product, chain
 from random import sample
 from collections import deque
 
+import numpy as np
+
+from pedigree import NO_NODE
+
 inf = float("inf")
 
 # TODO: Deduplicate with version in population_statistics. Very confusing.
@@ -74,31 +78,43 @@ def first_missing_ancestor(node, suspected = True):
     return inf
 
 def closest_error(node):
+    generator = node.node_generator
+    pedigree = generator.pedigree
+    child_index = pedigree.child_index(False)
+    suspected_child_index = pedigree.child_index(True)
     visited = set()
-    to_explore = deque([(0, node)])
+    to_explore = deque([(0, node._id)])
     while len(to_explore) > 0:
-        distance, node = to_explore.popleft()
-        children = set(node.children)
-        if (node.mother != node.suspected_mother
-            or node.father != node.suspected_father
-            or children != set(node.suspected_children)):
-            return (distance, node)
-        visited.add(node)
-        if node.mother not in visited:
-            to_explore.append((distance + 1, node.mother))
-        if node.father not in visited:
-            to_explore.append((distance + 1, node.father))
-        to_explore.extend((distance + 1, n) for n in children - visited)
+        distance, node_id = to_explore.popleft()
+        mother = pedigree.mother[node_id]
+        father = pedigree.father[node_id]
+        children = child_index.children(node_id)
+        if (mother != pedigree.suspected_mother[node_id]
+            or father != pedigree.suspected_father[node_id]
+            or not np.array_equal(children,
+                                  suspected_child_index.children(node_id))):
+            return (distance, generator.node(node_id))
+        visited.add(node_id)
+        for parent in (int(mother), int(father)):
+            if parent != NO_NODE and parent not in visited:
+                to_explore.append((distance + 1, parent))
+        to_explore.extend((distance + 1, n) for n in children.tolist()
+                          if n not in visited)
     return (None, None)
 
 def closest_error_descendants(node):
-    descendants = deque([(0, node)])
+    generator = node.node_generator
+    pedigree = generator.pedigree
+    child_index = pedigree.child_index(False)
+    suspected_child_index = pedigree.child_index(True)
+    descendants = deque([(0, node._id)])
     while len(descendants) > 0:
-        distance, node = descendants.popleft()
-        children = set(node.children)
-        if children != set(node.suspected_children):
-            return (distance, node)
-        descendants.extend((distance + 1, n) for n in children)
+        distance, node_id = descendants.popleft()
+        children = child_index.children(node_id)
+        if not np.array_equal(children,
+                              suspected_child_index.children(node_id)):
+            return (distance, generator.node(node_id))
+        descendants.extend((distance + 1, n) for n in children.tolist())
     return (None, None)
 
 def closest_error_ancestors(node):
@@ -270,21 +286,16 @@ def all_related(node, suspected = False, generations_back = float("inf")):
                                generations_back = generations_back)
     if len(ancestors) == 0:
         return set()
-    descendant_sets = (descendants_of(ancestor, suspected)
-                       for ancestor in ancestors)
-    return set(chain.from_iterable(descendant_sets))
+    return _descendant_nodes(node.node_generator,
+                             [ancestor._id for ancestor in ancestors],
+                             suspected)
 
 def descendants_of(node, suspected = False):
-    descendants = set()
-    to_visit = [node]
-    while len(to_visit) > 0:
-        ancestor = to_visit.pop()
-        descendants.add(ancestor)
-        if suspected:
-            to_visit.extend(ancestor.suspected_children)
-        else:
-            to_visit.extend(ancestor.children)
-    return descendants
+    return _descendant_nodes(node.node_generator, [node._id], suspected)
+
+def _descendant_nodes(generator, node_ids, suspected):
+    descendant_ids = generator.pedigree.descendant_ids(node_ids, suspected)
+    return set(map(generator.node, descendant_ids.tolist()))
 
 def descendants_with_common_ancestor(ancestor, generation_members):
     """
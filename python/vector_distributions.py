@@ -9,9 +9,10 @@ from matplotlib import pyplot
 
 from node import NodeGenerator
 from sex import Sex
-from population_genomes import generate_genomes_ancestors
+from population_genomes import replicate_sharing
 from recomb_genome import recombinators_from_directory, RecombGenomeGenerator
-from classify_relationship import shared_segment_length_genomes
+from cm import centimorgan_data_from_directory
+from shared_segment_detector import SharedSegmentDetector
 
 node_generator = NodeGenerator()
 name_map = None
@@ -51,21 +52,21 @@ def parse_genealogy_file(filename):
                                                        sex = genders[name])
     return (all_nodes, set(founders.values()))
 
-def simulate_sharing(founders, pair, genome_generator, recombinators,
-                     iterations = 10000):
-    sharing = []
-    for i in range(iterations):
-        generate_genomes_ancestors(founders, genome_generator, recombinators)
-        shared = shared_segment_length_genomes(pair[0].genome, pair[1].genome,
-                                               0)
-        sharing.append(shared)
-    return sharing
+def simulate_sharing(all_nodes, pair, genome_generator, recombinators,
+                     ibd_detector, iterations = 10000, seed = None):
+    sharing = replicate_sharing(all_nodes.values(), [pair], genome_generator,
+                                recombinators, ibd_detector, iterations,
+                                seed)
+    return sharing[:, 0]
         
 parser = ArgumentParser(description = "Examine the distributions of various relationships.")
 parser.add_argument("relationship_file", nargs = 2,
                     help = "File to describe the genealogy.")
 parser.add_argument("pair_1", nargs = 2)
 parser.add_argument("pair_2", nargs = 2)
+parser.add_argument("--iterations", type = int, default = 10000,
+                    help = "Number of genome realizations per relationship.")
+parser.add_argument("--seed", type = int, default = None)
 
 args = parser.parse_args()
 
@@ -76,14 +77,18 @@ all_nodes_1, founders_1 = parse_genealogy_file(args.relationship_file[1])
 recombinators = recombinators_from_directory("../data/recombination_rates")
 chrom_sizes = recombinators[Sex.Male]._num_bases
 genome_generator = RecombGenomeGenerator(chrom_sizes)
+cm_data = centimorgan_data_from_directory("../data/recombination_rates")
+ibd_detector = SharedSegmentDetector(cm_data, 0)
 
 pair_0 = [all_nodes_0[name] for name in args.pair_1]
-sharing_0 = simulate_sharing(founders_0, pair_0, genome_generator,
-                             recombinators)
+sharing_0 = simulate_sharing(all_nodes_0, pair_0, genome_generator,
+                             recombinators, ibd_detector, args.iterations,
+                             args.seed)
 
 pair_1 = [all_nodes_1[name] for name in args.pair_2]
-sharing_1 = simulate_sharing(founders_1, pair_1, genome_generator,
-                             recombinators)
+sharing_1 = simulate_sharing(all_nodes_1, pair_1, genome_generator,
+                             recombinators, ibd_detector, args.iterations,
+                             args.seed)
 
 weights_0 = np.ones_like(sharing_0)/float(len(sharing_0))
 weights_1 = np.ones_like(sharing_1)/float(len(sharing_1))